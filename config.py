@@ -12,4 +12,122 @@ liked_posts = set()
 active_file_transfers = {}  # Outgoing file transfers
 incoming_files = {}  # Incoming file transfers
 pending_file_offer = None
-received_acks = set()
+received_acks = {}  # MESSAGE_IDs we have ACKed, oldest first
+
+# Presence (PING -> PROFILE replies)
+PROFILE_SUPPRESS_WINDOW = 5  # seconds after a PROFILE broadcast in which we only unicast
+PROFILE_JITTER_MAX = 1.0  # max random delay before a PROFILE broadcast
+PRESENCE_BUDGET_BPS = 2 * 1024  # bytes/s for all presence replies
+PRESENCE_BUDGET_BURST = 4 * 1024
+
+# Startup discovery
+DISCOVERY_BACKOFF = (0, 0.25, 0.5, 1, 2)  # seconds between discovery rounds
+DISCOVERY_QUIET_ROUNDS = 2  # rounds without a new peer before the view is stable
+
+# Heartbeats and liveness
+HEARTBEAT_LAN_RATE = 0.5  # target PINGs per second across the whole LAN
+HEARTBEAT_MIN_INTERVAL = 15  # seconds
+HEARTBEAT_MAX_INTERVAL = 3600
+HEARTBEAT_JITTER = 0.1  # +/- fraction of the interval
+HEARTBEAT_SUSPECT_MISSES = 3  # missed heartbeats before a peer is suspect
+HEARTBEAT_DEAD_MISSES = 6  # missed heartbeats before a peer is dropped
+LIVENESS_SWEEP_INTERVAL = 5  # seconds between liveness checks
+
+# Peer list digest exchange
+PEERS_SYNC_INTERVAL = 60  # min seconds between digest exchanges we start
+PEERS_SYNC_DATAGRAM_SIZE = 1200  # max bytes of peer entries per PEERS_SYNC
+
+# Broadcast fanout to nodes on non-default ports
+BROADCAST_PORTS_REFRESH = 5  # seconds between rebuilding the live port set
+BROADCAST_PORT_TTL = 900  # forget announced ports not heard for this long
+BROADCAST_PROBE_BATCH = 4  # unseen ports of the range probed per heartbeat
+
+# Reliable delivery (ACK and retry, RFC sec. 10)
+RELIABLE_TIMEOUT = 2  # seconds to wait for an ACK until a peer's RTT is measured
+RELIABLE_RETRIES = 3  # resends before giving up
+RECEIVED_ACKS_MAX = 4096  # ACKed MESSAGE_IDs remembered to drop retransmissions
+TIMER_WHEEL_TICK = 0.05  # seconds per timer wheel slot
+TIMER_WHEEL_SLOTS = 512
+RTO_MIN = 0.2  # bounds on the per-peer retransmission timeout, seconds
+RTO_MAX = 10
+RTT_SAMPLES = 64  # recent RTT samples kept per peer for percentiles
+
+# File transfer window
+FILE_OFFER_TIMEOUT = 300  # seconds an offer waits for FILE_ACCEPT or FILE_REJECT
+FILE_WINDOW_INITIAL = 8  # chunks in flight when a transfer starts
+FILE_WINDOW_MIN = 2
+FILE_WINDOW_MAX = 256
+FILE_WINDOW_MAX_BYTES = 256 * 1024  # in-flight chunk data, within a default receive buffer
+FILE_REORDER_THRESHOLD = 3  # later chunks acked before a missing one counts as lost
+FILE_MAX_STALLS = 5  # back-to-back timeouts before a transfer fails
+FILE_ACK_EVERY = 4  # in-order chunks per FILE_ACK
+FILE_ACK_DELAY = 0.05  # seconds before a partial batch is acked anyway
+FILE_SACK_BITS = 512  # chunks after CUMULATIVE covered by one FILE_ACK
+FILE_HISTORY = 32  # finished transfers kept for stats
+FILE_RATE_LIMIT = 0  # bytes/s across all uploads; 0 for no cap
+FILE_DRR_QUANTUM = 64 * 1024  # bytes each upload may send per scheduling round
+FILE_RATE_WINDOW = 5  # seconds of progress behind the rate and ETA in `file status`
+
+# Resumable transfers
+FILE_CHECKPOINT_DIR = ".lsnp_transfers"  # progress of unfinished transfers
+FILE_CHECKPOINT_INTERVAL = 1  # min seconds between download checkpoints
+FILE_RESUME_IDLE = 10  # seconds without a new chunk before a download asks to resume
+FILE_RESUME_MAX_RANGES = 128  # received ranges listed in one FILE_RESUME
+FILE_RESUME_TTL = 7 * 86400  # seconds an unfinished transfer can still be resumed
+
+# Group file distribution (one broadcast stream, NACK repair)
+GROUP_FILE_TRANSPORT = "broadcast"  # or "multicast" to socket_manager.MULTICAST_GROUP
+GROUP_FILE_CHUNK_SIZE = 8 * 1024  # kept small: a lost fragment costs every member the chunk
+GROUP_FILE_RATE = 4 * 2**20  # bytes/s a group transfer starts at
+GROUP_FILE_RATE_MIN = 256 * 1024
+GROUP_FILE_RATE_MAX = 32 * 2**20
+GROUP_FILE_LOSS_TARGET = 0.05  # share of chunks any one member NACKs above which the rate backs off
+GROUP_FILE_START_WAIT = 10  # seconds after the first FILE_ACCEPT to wait for the rest
+GROUP_FILE_NACK_INTERVAL = 0.25  # seconds between a member's NACKs while it has gaps
+GROUP_FILE_LINGER = 15  # seconds of silence after the last chunk before giving up on members
+GROUP_FILE_MEMBER_TIMEOUT = 60  # seconds without a chunk before a member drops the download
+
+# How GROUP_MESSAGEs reach members (ACKs and unicast retries in every case)
+GROUP_MESSAGE_TRANSPORT = "auto"  # or always "unicast", "multicast" or "broadcast"
+GROUP_FANOUT_MIN_MEMBERS = 10  # fewer recipients than this always get one unicast each
+GROUP_BROADCAST_MIN_COVERAGE = 0.8  # share of known peers a group must include to be broadcast
+
+# Swarm downloads (the same content fetched from every peer holding it)
+FILE_SWARM = True  # ask the LAN for other holders of each accepted file
+FILE_SWARM_MIN_SIZE = 4 * 2**20  # bytes; smaller files aren't worth the extra round trips
+FILE_SWARM_MAX_SOURCES = 8  # peers a download pulls from at once, its sender included
+FILE_SWARM_BLOCK = 2**20  # bytes handed to a source at a time
+FILE_SWARM_HORIZON = 2.0  # seconds of work kept queued at each source, at its observed rate
+FILE_SWARM_TICK = 0.1  # seconds between rebalancing passes
+FILE_SWARM_STALL = 3.0  # seconds a source may deliver nothing before its blocks move
+
+# Delta transfers (only what changed since a revision the receiver has)
+FILE_DELTA = True  # offer delta mode; a receiver with an older revision answers with block signatures
+FILE_DELTA_MIN_SIZE = 256 * 1024  # bytes; smaller files are always sent whole
+FILE_DELTA_BLOCK_MIN = 2048  # bytes per signature block, grown to keep within FILE_DELTA_MAX_BLOCKS
+FILE_DELTA_MAX_BLOCKS = 8192
+FILE_DELTA_MAX_RATIO = 0.8  # send the whole file when the delta would be larger than this share of it
+FILE_DELTA_SCAN_LIMIT = 4 * 2**20  # bytes searched byte by byte for moved blocks (~1 s of CPU per MB)
+FILE_DELTA_WAIT = 10  # seconds the sender waits for all signatures before sending the whole file
+
+# TCP side channel for bulk file data (FILE_CHUNKs over UDP remain the fallback)
+FILE_TCP = True  # offer a TCP port for each file; the receiver pulls the raw bytes from it
+FILE_TCP_MIN_SIZE = 2**20  # bytes; smaller files aren't worth a connection
+FILE_TCP_WAIT = 5  # seconds after a FILE_ACCEPT with TCP: 1 before the sender falls back to UDP
+FILE_TCP_TIMEOUT = 10  # seconds a connection may stall before the transfer goes back to UDP
+FILE_TCP_SEGMENT = 8 * 2**20  # bytes per sendfile call, between progress updates
+
+# Where downloads go, and the content store of received files
+FILE_DOWNLOAD_DIR = "."  # accepted files are saved here under their bare name
+FILE_STORE_DIR = ".lsnp_store"  # received files by content hash
+FILE_STORE_MAX_BYTES = 2 * 2**30  # least recently used entries go beyond this; 0 disables
+
+# Chunk size and path MTU
+FILE_LEGACY_CHUNK_SIZE = 1024  # for peers that don't advertise MAX_DATAGRAM
+FILE_CHUNK_MIN = 512
+FILE_CHUNK_MAX = 47 * 1024  # cap on the negotiated chunk size; base64 of it fits one datagram
+PMTU_BASE = 1200  # datagram size assumed to reach any peer
+PMTU_PRECISION = 16  # stop the probe search once within this many bytes
+PMTU_PROBE_TRIES = 2  # lost probes of one size before it counts as too big
+PMTU_PROBE_TIMEOUT = 0.25  # seconds to wait for a PMTU_ACK (or 2 x SRTT if longer)
+PMTU_TTL = 600  # seconds a measured path size is reused
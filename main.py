@@ -1,15 +1,38 @@
 # main.py
 from network.socket_manager import start_listening
-from network.message_sender import send_ack, send_file_received
+from network.message_sender import send_ack
+from network.file_transfer import (
+    DELIVERED,
+    answer_from_store,
+    delta_basis,
+    download_path,
+    handle_file_accept,
+    handle_file_ack,
+    handle_file_cancel,
+    handle_file_chunk,
+    handle_file_delta,
+    handle_file_have,
+    handle_file_reject,
+    handle_file_request,
+    handle_file_resume,
+    handle_file_signatures,
+    restore_transfers,
+    stop_transfer,
+)
 from network.broadcast import (
-    send_ping,
-    send_profile,
     my_info,
-    get_local_ip,
-    send_immediate_discovery,
+    init_my_info,
+    note_port,
 )
 from ui.cli import start_cli
 from network.peer_registry import add_peer
+from network.presence import handle_ping
+from network.discovery import start_discovery
+from network.liveness import start_heartbeat
+from network.peer_sync import maybe_sync, handle_peers_digest, handle_peers_sync
+from network.pmtu import handle_pmtu_probe, handle_pmtu_ack
+from network.reliable import handle_ack
+from network.swarm import handle_file_query
 from network.tictactoe import handle_invite, handle_move, handle_result
 from ui.utils import print_verbose, print_prompt, print_error
 from network.token_utils import (
@@ -18,19 +41,44 @@ from network.token_utils import (
     revoke_token,
     revoked_tokens,
 )
-import threading
 import config
 import time
-import base64
+from typing import Dict
 from ui.image_display import display_image
 from network.group_manager import (
+    get_group_members,
     handle_group_create,
     handle_group_update,
     handle_group_message,
+    is_group_recipient,
+)
+from network.group_transfer import (
+    handle_file_nack,
+    handle_group_file_answer,
+    handle_group_file_received,
 )
 
 PROFILE_RESEND_INTERVAL = 10
-initial_discovery = True
+# Offers with a HASH are looked up in what we have on these, one file hashed at a time
+OFFER_WORKERS = 1
+_offer_executor = None
+
+# Sent with ACK and retry; a repeat of one we already ACKed is only re-ACKed
+ACKED_TYPES = {
+    "FILE_OFFER",
+    "FILE_ACCEPT",
+    "FILE_REJECT",
+    "FILE_RESUME",
+    "FILE_REQUEST",
+    "FILE_SIGNATURES",
+    "FILE_DELTA",
+    "TICTACTOE_INVITE",
+    "TICTACTOE_MOVE",
+    "TICTACTOE_RESULT",
+    "GROUP_CREATE",
+    "GROUP_UPDATE",
+    "GROUP_MESSAGE",
+}
 
 
 def validate_message(message: str) -> bool:
@@ -51,6 +99,66 @@ def validate_message(message: str) -> bool:
     return True
 
 
+def _get_offer_executor():
+    global _offer_executor
+    if _offer_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        _offer_executor = ThreadPoolExecutor(
+            max_workers=OFFER_WORKERS, thread_name_prefix="offer"
+        )
+    return _offer_executor
+
+
+def _report_offer_error(future) -> None:
+    if future.exception():
+        print_error(f"error processing FILE_OFFER: {future.exception()}")
+
+
+def _present_file_offer(content: Dict, display_name: str, message_id: str) -> None:
+    """Settle a FILE_OFFER from what we already have, or ask the user about it"""
+    fileid = content["FILEID"]
+    user_id = content["FROM"]
+    group_id = content.get("GROUP_ID")
+    file_info = config.incoming_files.get(fileid)
+    if file_info and answer_from_store(fileid, my_info, content["FILENAME"]):
+        if message_id:
+            send_ack(message_id, user_id)
+        print(
+            f"\n{display_name} sent '{content['FILENAME']}', which you already have; "
+            f"saved as {file_info['filename']}\n"
+        )
+        print_prompt()
+        return
+
+    config.pending_file_offer = {
+        "fileid": fileid,
+        "from": user_id,
+        "filename": content["FILENAME"],
+    }
+
+    if config.verbose_mode:
+        print_verbose(
+            f"\nTYPE: FILE_OFFER\n"
+            f"FROM: {user_id}\n"
+            f"FILENAME: {content['FILENAME']}\n"
+            f"FILESIZE: {content['FILESIZE']}\n"
+            f"FILEID: {fileid}\n"
+            f"DESCRIPTION: {content.get('DESCRIPTION', '')}\n"
+            f"TIMESTAMP: {content.get('TIMESTAMP', '')}\n"
+            f"TOKEN: {content.get('TOKEN', '')}\n\n"
+        )
+    else:
+        recipient = f"group {group_id}" if group_id else "you"
+        print(
+            f"\n{display_name} is sending {recipient} a file '{
+                content['FILENAME']}'. Do you accept? (Y/N)\n"
+        )
+    if message_id:
+        send_ack(message_id, user_id)
+    print_prompt()
+
+
 def handle_message(message: str, addr: tuple) -> None:
     try:
         if not validate_message(message):
@@ -64,7 +172,18 @@ def handle_message(message: str, addr: tuple) -> None:
             "FOLLOW": "follow",
             "UNFOLLOW": "follow",
             "FILE_OFFER": "file",
+            "FILE_ACCEPT": "file",
+            "FILE_REJECT": "file",
             "FILE_CHUNK": "file",
+            "FILE_ACK": "file",
+            "FILE_NACK": "file",
+            "FILE_RESUME": "file",
+            "FILE_CANCEL": "file",
+            "FILE_QUERY": "file",
+            "FILE_HAVE": "file",
+            "FILE_REQUEST": "file",
+            "FILE_SIGNATURES": "file",
+            "FILE_DELTA": "file",
             "TICTACTOE_INVITE": "game",
             "TICTACTOE_MOVE": "game",
             "TICTACTOE_RESULT": "game",
@@ -73,6 +192,8 @@ def handle_message(message: str, addr: tuple) -> None:
             "GROUP_UPDATE": "group",
             "GROUP_MESSAGE": "group",
             "REVOKE": "chat",
+            "PEERS_DIGEST": "broadcast",
+            "PEERS_SYNC": "broadcast",
         }
         for line in message.splitlines():
             if ":" in line:
@@ -83,12 +204,27 @@ def handle_message(message: str, addr: tuple) -> None:
         user_id = content.get("USER_ID") or content.get("FROM")
         token = content.get("TOKEN", "")
 
+        # ACKs from older peers carry no FROM, so match them before the check
+        if msg_type == "ACK":
+            handle_ack(content.get("MESSAGE_ID", ""), content.get("FROM"), addr[0])
+            if config.verbose_mode:
+                print_verbose(
+                    f"\nTYPE: ACK\n"
+                    f"MESSAGE_ID: {content.get('MESSAGE_ID', '')}\n"
+                    f"STATUS: {content.get('STATUS', '')}\n\n"
+                )
+            return
+
         if not user_id:
             return
 
         if user_id == my_info["user_id"]:
             return
 
+        # Group messages may come by broadcast: drop other groups' before the token checks
+        if msg_type == "GROUP_MESSAGE" and not is_group_recipient(content, my_info):
+            return
+
         # Handle REVOKE message first since it doesn't need token validation
         if msg_type == "REVOKE":
             revoke_token(token)
@@ -153,6 +289,11 @@ def handle_message(message: str, addr: tuple) -> None:
             display_name=display_name,
         )
 
+        message_id = content.get("MESSAGE_ID")
+        if msg_type in ACKED_TYPES and message_id in config.received_acks:
+            send_ack(message_id, user_id)
+            return
+
         # --- POST ---
         if msg_type == "POST":
             if "CONTENT" not in content:
@@ -202,11 +343,14 @@ def handle_message(message: str, addr: tuple) -> None:
 
         # --- PROFILE ---
         elif msg_type == "PROFILE":
-            if initial_discovery:
-                return
             # Store avatar if present
             avatar_data = content.get("AVATAR_DATA")
             avatar_type = content.get("AVATAR_TYPE")
+            note_port(content.get("PORT"))
+            capabilities = {
+                c.strip() for c in content.get("CAPABILITIES", "").split(",") if c.strip()
+            }
+            max_datagram = content.get("MAX_DATAGRAM")
 
             # Update peer info with avatar
             add_peer(
@@ -216,7 +360,10 @@ def handle_message(message: str, addr: tuple) -> None:
                 display_name=display_name,
                 avatar_data=avatar_data,
                 avatar_type=avatar_type,
+                capabilities=capabilities,
+                max_datagram=int(max_datagram) if max_datagram else None,
             )
+            maybe_sync(user_id, my_info)
             if config.verbose_mode:
                 avatar_info = ""
                 if avatar_data:
@@ -247,7 +394,34 @@ def handle_message(message: str, addr: tuple) -> None:
         elif msg_type == "PING":
             if config.verbose_mode:
                 print_verbose(f"\nTYPE: PING\nUSER_ID: {user_id}\n\n")
-            send_profile(my_info)
+            handle_ping(user_id)
+            maybe_sync(user_id, my_info)
+
+        # --- PEERS_DIGEST / PEERS_SYNC ---
+        elif msg_type == "PEERS_DIGEST":
+            if config.verbose_mode:
+                print_verbose(
+                    f"\nTYPE: PEERS_DIGEST\n"
+                    f"FROM: {user_id}\n"
+                    f"DIGEST: {content.get('DIGEST', '')}\n"
+                    f"COUNT: {content.get('COUNT', '')}\n\n"
+                )
+            handle_peers_digest(content, addr, my_info)
+
+        elif msg_type == "PEERS_SYNC":
+            handle_peers_sync(content, addr, my_info)
+
+        elif msg_type == "PMTU_PROBE":
+            handle_pmtu_probe(content, addr, my_info, len(message))
+
+        elif msg_type == "PMTU_ACK":
+            if config.verbose_mode:
+                print_verbose(
+                    f"\nTYPE: PMTU_ACK\nFROM: {user_id}\n"
+                    f"PROBE_ID: {content.get('PROBE_ID', '')}\n"
+                    f"SIZE: {content.get('SIZE', '')}\n\n"
+                )
+            handle_pmtu_ack(content, addr, my_info)
 
         # --- FOLLOW ---
         elif msg_type == "FOLLOW":
@@ -279,15 +453,6 @@ def handle_message(message: str, addr: tuple) -> None:
                 print(f"\n{display_name} has unfollowed you\n")
             print_prompt()
 
-        # --- ACK ---
-        elif msg_type == "ACK":
-            if config.verbose_mode:
-                print_verbose(
-                    f"\nTYPE: ACK\n"
-                    f"MESSAGE_ID: {content.get('MESSAGE_ID', '')}\n"
-                    f"STATUS: {content.get('STATUS', '')}\n\n"
-                )
-
         # --- TicTacToe ---
         elif msg_type == "TICTACTOE_INVITE":
             if config.verbose_mode:
@@ -425,98 +590,183 @@ def handle_message(message: str, addr: tuple) -> None:
                 return
 
             fileid = content["FILEID"]
+            if fileid in config.incoming_files:
+                # A resent offer we already hold: keep its answer and progress
+                if message_id:
+                    send_ack(message_id, user_id)
+                return
+            group_id = content.get("GROUP_ID")
+            if group_id and user_id not in get_group_members(group_id):
+                print_error(f"Ignoring file offer to group {group_id} from non-member {user_id}")
+                return
 
-            config.pending_file_offer = {
-                "fileid": fileid,
-                "from": user_id,
-                "filename": content["FILENAME"],
-            }
-
-            fileid = content["FILEID"]
+            filesize = int(content["FILESIZE"])
+            destination = download_path(content["FILENAME"])
             config.incoming_files[fileid] = {
                 "from": user_id,
-                "filename": content["FILENAME"],
-                "filesize": int(content["FILESIZE"]),
+                "filename": destination,
+                "filesize": filesize,
                 "filetype": content.get("FILETYPE", "application/octet-stream"),
                 "description": content.get("DESCRIPTION", ""),
-                "chunks": {},
-                "received_chunks": 0,
+                "chunk_size": int(content.get("CHUNK_SIZE", config.FILE_LEGACY_CHUNK_SIZE)),
+                "hash": content.get("HASH"),
+                "group_id": group_id,
+                # An older revision we could take a delta against
+                "delta_basis": delta_basis(content["FILENAME"])
+                if content.get("DELTA") == "1" and not group_id
+                else None,
+                # Where to fetch the file over TCP instead of FILE_CHUNKs
+                "tcp_port": int(content["TCP_PORT"])
+                if content.get("TCP_PORT", "").isdigit() and not group_id
+                else None,
+                "accepted": False,
             }
+            if content.get("HASH"):
+                # Looking for a copy we already have may hash or copy a whole file
+                _get_offer_executor().submit(
+                    _present_file_offer, content, display_name, message_id
+                ).add_done_callback(_report_offer_error)
+            else:
+                _present_file_offer(content, display_name, message_id)
 
+        # --- FILE_ACCEPT / FILE_REJECT ---
+        elif msg_type in ("FILE_ACCEPT", "FILE_REJECT"):
             if config.verbose_mode:
                 print_verbose(
-                    f"\nTYPE: FILE_OFFER\n"
+                    f"\nTYPE: {msg_type}\n"
                     f"FROM: {user_id}\n"
-                    f"FILENAME: {content['FILENAME']}\n"
-                    f"FILESIZE: {content['FILESIZE']}\n"
-                    f"FILEID: {fileid}\n"
-                    f"DESCRIPTION: {content.get('DESCRIPTION', '')}\n"
-                    f"TIMESTAMP: {content.get('TIMESTAMP', '')}\n"
-                    f"TOKEN: {content.get('TOKEN', '')}\n\n"
+                    f"FILEID: {content.get('FILEID', '')}\n\n"
                 )
+            if "FILEID" not in content:
+                print_error(f"Invalid {msg_type}: missing required fields")
+                return
+            if message_id:
+                send_ack(message_id, user_id)
+            if "GROUP_ID" in content:
+                handle_group_file_answer(content, addr, my_info)
+            elif msg_type == "FILE_ACCEPT":
+                handle_file_accept(content, addr, my_info)
             else:
-                print(
-                    f"\n{display_name} is sending you a file '{
-                        content['FILENAME']}'. Do you accept? (Y/N)\n"
+                handle_file_reject(content, addr, my_info)
+
+        # --- FILE_NACK ---
+        elif msg_type == "FILE_NACK":
+            if config.verbose_mode:
+                print_verbose(
+                    f"\nTYPE: FILE_NACK\n"
+                    f"FROM: {user_id}\n"
+                    f"GROUP_ID: {content.get('GROUP_ID', '')}\n"
+                    f"FILEID: {content.get('FILEID', '')}\n"
+                    f"RANGES: {content.get('RANGES', '')}\n\n"
                 )
-            print_prompt()
+            if "FILEID" not in content or "GROUP_ID" not in content:
+                print_error("Invalid FILE_NACK: missing required fields")
+                return
+            handle_file_nack(content, addr, my_info)
 
         # --- FILE_CHUNK ---
         elif msg_type == "FILE_CHUNK":
-            required_fields = ["FROM", "FILEID", "CHUNK_INDEX", "TOTAL_CHUNKS", "DATA"]
-            if any(field not in content for field in required_fields):
-                print_error("Invalid FILE_CHUNK: missing required fields")
-                return
+            handle_file_chunk(content, addr, my_info)
 
-            fileid = content["FILEID"]
-            if fileid not in config.incoming_files:
-                if config.verbose_mode:
-                    print_verbose(f"Ignoring FILE_CHUNK for unknown file ID {fileid}")
+        # --- FILE_ACK ---
+        elif msg_type == "FILE_ACK":
+            if config.verbose_mode:
+                print_verbose(
+                    f"\nTYPE: FILE_ACK\n"
+                    f"FROM: {user_id}\n"
+                    f"FILEID: {content.get('FILEID', '')}\n"
+                    f"CUMULATIVE: {content.get('CUMULATIVE', '')}\n"
+                    f"SACK: {content.get('SACK', '')}\n\n"
+                )
+            if "FILEID" not in content or "CUMULATIVE" not in content:
+                print_error("Invalid FILE_ACK: missing required fields")
                 return
+            handle_file_ack(content, addr, my_info)
 
-            chunk_index = int(content["CHUNK_INDEX"])
-            total_chunks = int(content["TOTAL_CHUNKS"])
-            chunk_data = base64.b64decode(content["DATA"])
-
-            # Store the chunk
-            config.incoming_files[fileid]["chunks"][chunk_index] = chunk_data
-            config.incoming_files[fileid]["received_chunks"] += 1
-
+        # --- FILE_RESUME ---
+        elif msg_type == "FILE_RESUME":
             if config.verbose_mode:
                 print_verbose(
-                    f"\nTYPE: FILE_CHUNK\n"
+                    f"\nTYPE: FILE_RESUME\n"
                     f"FROM: {user_id}\n"
-                    f"FILEID: {fileid}\n"
-                    f"CHUNK_INDEX: {chunk_index}\n"
-                    f"TOTAL_CHUNKS: {total_chunks}\n"
-                    f"CHUNK_SIZE: {len(chunk_data)}\n"
-                    f"TOKEN: {content.get('TOKEN', '')}\n\n"
+                    f"FILEID: {content.get('FILEID', '')}\n"
+                    f"HASH: {content.get('HASH', '')}\n"
+                    f"RANGES: {content.get('RANGES', '')}\n\n"
                 )
+            if "FILEID" not in content:
+                print_error("Invalid FILE_RESUME: missing required fields")
+                return
+            if message_id:
+                send_ack(message_id, user_id)
+            handle_file_resume(content, addr, my_info)
+
+        # --- FILE_QUERY ---
+        elif msg_type == "FILE_QUERY":
+            if "FILEID" not in content or "HASH" not in content:
+                print_error("Invalid FILE_QUERY: missing required fields")
+                return
+            handle_file_query(content, addr, my_info)
 
-            # Check if all chunks received
-            if config.incoming_files[fileid]["received_chunks"] >= total_chunks:
-                file_info = config.incoming_files[fileid]
-                try:
-                    # Reassemble file
-                    with open(file_info["filename"], "wb") as f:
-                        for i in range(total_chunks):
-                            f.write(file_info["chunks"][i])
-
-                    if not config.verbose_mode:
-                        print(
-                            f"\nFile transfer of {
-                                file_info['filename']} is complete\n"
-                        )
-
-                    # Send acknowledgment
-                    send_file_received(fileid, user_id, my_info)
+        # --- FILE_HAVE ---
+        elif msg_type == "FILE_HAVE":
+            if "FILEID" not in content or "HASH" not in content:
+                print_error("Invalid FILE_HAVE: missing required fields")
+                return
+            handle_file_have(content, addr, my_info)
 
-                except Exception as e:
-                    print_error(f"Failed to save file: {e}")
-                    send_file_received(fileid, user_id, my_info, "ERROR")
+        # --- FILE_REQUEST ---
+        elif msg_type == "FILE_REQUEST":
+            if config.verbose_mode:
+                print_verbose(
+                    f"\nTYPE: FILE_REQUEST\n"
+                    f"FROM: {user_id}\n"
+                    f"FILEID: {content.get('FILEID', '')}\n"
+                    f"SEQ: {content.get('SEQ', '')}\n"
+                    f"RANGES: {content.get('RANGES', '')}\n\n"
+                )
+            numeric = ("FILESIZE", "CHUNK_SIZE", "SEQ")
+            if (
+                "FILEID" not in content
+                or "HASH" not in content
+                or not all(content.get(field, "").isdigit() for field in numeric)
+            ):
+                print_error("Invalid FILE_REQUEST: missing required fields")
+                return
+            if message_id:
+                send_ack(message_id, user_id)
+            handle_file_request(content, addr, my_info)
+
+        # --- FILE_SIGNATURES ---
+        elif msg_type == "FILE_SIGNATURES":
+            if any(field not in content for field in ("FILEID", "PART", "SIGS")):
+                print_error("Invalid FILE_SIGNATURES: missing required fields")
+                return
+            if message_id:
+                send_ack(message_id, user_id)
+            handle_file_signatures(content, addr, my_info)
 
-                # Clean up
-                del config.incoming_files[fileid]
+        # --- FILE_DELTA ---
+        elif msg_type == "FILE_DELTA":
+            if config.verbose_mode:
+                print_verbose(
+                    f"\nTYPE: FILE_DELTA\n"
+                    f"FROM: {user_id}\n"
+                    f"FILEID: {content.get('FILEID', '')}\n"
+                    f"DELTA_SIZE: {content.get('DELTA_SIZE', '')}\n\n"
+                )
+            if "FILEID" not in content or not content.get("DELTA_SIZE", "").isdigit():
+                print_error("Invalid FILE_DELTA: missing required fields")
+                return
+            if message_id:
+                send_ack(message_id, user_id)
+            handle_file_delta(content, addr, my_info)
+
+        # --- FILE_CANCEL ---
+        elif msg_type == "FILE_CANCEL":
+            if "FILEID" not in content:
+                print_error("Invalid FILE_CANCEL: missing required fields")
+                return
+            handle_file_cancel(content, addr, my_info)
 
         # --- FILE_RECEIVED ---
         elif msg_type == "FILE_RECEIVED":
@@ -525,10 +775,15 @@ def handle_message(message: str, addr: tuple) -> None:
                 return
 
             fileid = content["FILEID"]
-            if fileid in config.active_file_transfers:
+            if "GROUP_ID" in content:
+                handle_group_file_received(content, addr, my_info)
+            elif fileid in config.active_file_transfers:
                 status = content["STATUS"]
-                if status == "COMPLETE":
-                    if config.verbose_mode:
+                stop_transfer(fileid, status)
+                if status in DELIVERED:
+                    if status == "HAVE":
+                        print(f"\n{display_name} already had file {fileid}; nothing was sent\n")
+                    elif config.verbose_mode:
                         print_verbose(
                             f"\nFile {fileid} successfully received by {
                                 user_id}\n"
@@ -561,27 +816,10 @@ if __name__ == "__main__":
     if not sock:
         exit(1)
 
-    my_info.update(
-        {
-            "port": port,
-            "user_id": f"{my_info['username']}@{get_local_ip()}:{port}",
-        }
-    )
-
-    def limited_discovery():
-        global initial_discovery
-        start_time = time.time()
-        while time.time() - start_time < 5:
-            send_immediate_discovery(my_info, port=port)  # Pass port here
-            time.sleep(1)
-        initial_discovery = False
-
-    threading.Thread(target=limited_discovery, daemon=True).start()
+    init_my_info(port)
+    restore_transfers(my_info)
 
-    def ping_loop():
-        while True:
-            send_ping(my_info, port=port)  # Pass port here too
-            time.sleep(300)
+    start_discovery(my_info, port=port)
 
-    threading.Thread(target=ping_loop, daemon=True).start()
+    start_heartbeat(my_info)
     start_cli(my_info)
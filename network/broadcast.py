@@ -3,11 +3,23 @@ import socket
 import base64
 import os
 import time
-import subprocess
-import platform
-import ipaddress
-from typing import Dict
+import threading
+from typing import Dict, List
+import config
 from config import verbose_mode
+from network.peer_registry import get_peer_list
+from network.socket_manager import BASE_PORT, MAX_DATAGRAM, MAX_PORT_ATTEMPTS
+
+BROADCAST_TARGET_TTL = 60  # seconds before re-detecting the broadcast address
+
+_profile_cache: Dict = {"key": None, "data": None}
+_capabilities = set()  # protocol extensions advertised in PROFILE
+_broadcast_target: Dict = {"address": None, "local_ip": None, "expires": 0.0}
+_broadcast_sock = None
+_last_profile_broadcast = 0.0
+# Broadcast fanout ports: live set cache, announced port -> last seen, probe cursor
+_ports: Dict = {"live": [BASE_PORT], "expires": 0.0, "announced": {}, "probe_next": 0}
+_broadcast_lock = threading.Lock()
 
 
 def get_local_ip():
@@ -26,6 +38,10 @@ def get_subnet_broadcast():
     Detect broadcast address for the interface used by get_local_ip().
     Works on Windows and Linux, ignores other adapters.
     """
+    import ipaddress
+    import platform
+    import subprocess
+
     local_ip = get_local_ip()
     system = platform.system().lower()
 
@@ -63,20 +79,52 @@ def get_subnet_broadcast():
     return f"{'.'.join(local_ip.split('.')[:3])}.255"
 
 
-def send_ping(my_info, port=50999):
-    """RFC-compliant PING message"""
+def send_ping(my_info, probe=0):
+    """RFC-compliant PING message, also probing `probe` not-yet-seen ports"""
     message = "TYPE: PING\n" f"USER_ID: {my_info['user_id']}\n\n"
-    send_broadcast(message, target_ports=[port])
+    send_broadcast(message, target_ports=broadcast_ports(probe))
 
 
-def send_profile(my_info: Dict, port=50999) -> None:
+def _profile_cache_key(my_info: Dict, port: int) -> tuple:
+    """Everything that ends up in the PROFILE message, cheap to compute"""
+    avatar_path = my_info.get("avatar_path")
+    avatar_stat = None
+    if avatar_path:
+        try:
+            st = os.stat(avatar_path)
+            avatar_stat = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            avatar_stat = None
+    return (
+        my_info.get("user_id"),
+        my_info.get("username"),
+        my_info.get("status", "Active"),
+        my_info.get("port", port),
+        avatar_path,
+        avatar_stat,
+        my_info.get("avatar_type"),
+        # str hashes are cached by the interpreter, so this stays O(1)
+        hash(my_info.get("avatar_data")),
+        tuple(sorted(_capabilities)),
+    )
+
+
+def build_profile(my_info: Dict, port=50999) -> bytes:
+    """Return the encoded PROFILE message, rebuilding it only when it changed"""
+    key = _profile_cache_key(my_info, port)
+    if _profile_cache["key"] == key:
+        return _profile_cache["data"]
+
     message = (
         "TYPE: PROFILE\n"
         f"USER_ID: {my_info['user_id']}\n"
         f"DISPLAY_NAME: {my_info['username']}\n"
         f"STATUS: {my_info.get('status', 'Active')}\n"
-        f"PORT: {my_info.get('port', port)}\n\n"
     )
+    if _capabilities:
+        message += f"CAPABILITIES: {','.join(sorted(_capabilities))}\n"
+    message += f"MAX_DATAGRAM: {MAX_DATAGRAM}\n"
+    message += f"PORT: {my_info.get('port', port)}\n\n"
 
     avatar_path = my_info.get("avatar_path")
     if avatar_path and os.path.exists(avatar_path):
@@ -100,7 +148,30 @@ def send_profile(my_info: Dict, port=50999) -> None:
                 f"AVATAR_DATA: {my_info['avatar_data']}\n\n"
             )
 
-    send_broadcast(message, target_ports=[port])
+    _profile_cache["key"] = key
+    _profile_cache["data"] = message.encode("utf-8")
+    return _profile_cache["data"]
+
+
+def advertise_capability(name: str) -> None:
+    """Announce a protocol extension in the CAPABILITIES field of PROFILE"""
+    _capabilities.add(name)
+
+
+def invalidate_profile_cache() -> None:
+    _profile_cache["key"] = None
+    _profile_cache["data"] = None
+
+
+def send_profile(my_info: Dict, port=50999) -> None:
+    global _last_profile_broadcast
+    send_broadcast(build_profile(my_info, port))
+    _last_profile_broadcast = time.time()
+
+
+def last_profile_broadcast() -> float:
+    """Time of our most recent PROFILE broadcast (0 if none yet)"""
+    return _last_profile_broadcast
 
 
 def get_mime_type(filepath):
@@ -113,47 +184,141 @@ def get_mime_type(filepath):
     }.get(ext, "application/octet-stream")
 
 
+def _get_broadcast_target():
+    """Cached (broadcast address, local ip); detection spawns a subprocess"""
+    now = time.time()
+    if _broadcast_target["expires"] < now:
+        _broadcast_target["local_ip"] = get_local_ip()
+        _broadcast_target["address"] = get_subnet_broadcast()
+        _broadcast_target["expires"] = now + BROADCAST_TARGET_TTL
+    return _broadcast_target["address"], _broadcast_target["local_ip"]
+
+
+def broadcast_address() -> str:
+    """The subnet broadcast address, re-detected every BROADCAST_TARGET_TTL seconds"""
+    return _get_broadcast_target()[0]
+
+
+def _get_broadcast_socket():
+    global _broadcast_sock
+    if _broadcast_sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        # Bind to 0.0.0.0 ephemeral port
+        try:
+            sock.bind(("0.0.0.0", 0))
+        except Exception as e:
+            if verbose_mode:
+                print(f"Could not bind broadcast socket: {e}")
+        _broadcast_sock = sock
+    return _broadcast_sock
+
+
+def _valid_port(port):
+    """port as an int, or None if it isn't a usable UDP port"""
+    try:
+        port = int(port)
+    except (TypeError, ValueError):
+        return None
+    return port if 0 < port < 65536 else None
+
+
+def note_port(port) -> None:
+    """Remember a port some node announced (PROFILE PORT field)"""
+    port = _valid_port(port)
+    if port is not None:
+        _ports["announced"][port] = time.time()
+
+
+def broadcast_ports(probe: int = 0) -> List[int]:
+    """
+    Ports that broadcasts fan out to: the default port, every port a known
+    peer listens on or announced recently, plus `probe` ports of the
+    50999-51098 range taken round-robin so new nodes on other ports are
+    eventually found.
+    """
+    now = time.time()
+    if _ports["expires"] < now:
+        live = {BASE_PORT}
+        # Ports come from what peers sent; one that isn't a port is skipped
+        for peer in get_peer_list():
+            port = _valid_port(peer["port"])
+            if port is not None:
+                live.add(port)
+        for port, seen in list(_ports["announced"].items()):
+            if now - seen > config.BROADCAST_PORT_TTL:
+                del _ports["announced"][port]
+            else:
+                live.add(port)
+        _ports["live"] = sorted(live)
+        _ports["expires"] = now + config.BROADCAST_PORTS_REFRESH
+
+    ports = list(_ports["live"])
+    for _ in range(min(probe, MAX_PORT_ATTEMPTS)):
+        port = BASE_PORT + _ports["probe_next"]
+        _ports["probe_next"] = (_ports["probe_next"] + 1) % MAX_PORT_ATTEMPTS
+        if port not in ports:
+            ports.append(port)
+    return ports
+
+
 def send_broadcast(message, target_ports=None):
     """
     Sends a UDP broadcast to the detected subnet broadcast address.
-    Use target_ports if specified, else use default port 50999.
+    Use target_ports if specified, else every port in use on the LAN.
+    Accepts either a str or already-encoded bytes; it is sent as-is to
+    each port in one pass over one socket.
     """
-    subnet_broadcast = get_subnet_broadcast()
-    ports = target_ports if target_ports else [50999]  # default port
-    local_ip = get_local_ip()
+    data = message if isinstance(message, bytes) else message.encode("utf-8")
 
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            # Bind to 0.0.0.0 ephemeral port
-            try:
-                sock.bind(("0.0.0.0", 0))
-            except Exception as e:
-                if verbose_mode:
-                    print(f"Could not bind broadcast socket: {e}")
-
+        ports = target_ports if target_ports else broadcast_ports()
+        with _broadcast_lock:
+            subnet_broadcast, local_ip = _get_broadcast_target()
+            sock = _get_broadcast_socket()
             for port in ports:
                 if verbose_mode:
                     print(
                         f"[broadcast] sending from {local_ip} -> {subnet_broadcast}:{port}"
                     )
-                sock.sendto(message.encode("utf-8"), (subnet_broadcast, port))
+                sock.sendto(data, (subnet_broadcast, port))
     except Exception as e:
         print(f"Broadcast failed: {e}")
 
 
-def send_immediate_discovery(my_info, port=50999):
-    for _ in range(3):
-        send_profile(my_info, port=port)
-        time.sleep(0.5)
-    for _ in range(3):
-        send_ping(my_info, port=port)
-        time.sleep(0.5)
+def send_multicast(message, address: str, target_ports: List[int]) -> None:
+    """
+    Sends one datagram to a multicast address per port in target_ports;
+    only sockets that joined `address` get it. Accepts str or bytes.
+    """
+    data = message if isinstance(message, bytes) else message.encode("utf-8")
+
+    try:
+        with _broadcast_lock:
+            sock = _get_broadcast_socket()
+            for port in target_ports:
+                if verbose_mode:
+                    print(f"[multicast] sending to {address}:{port}")
+                sock.sendto(data, (address, port))
+    except Exception as e:
+        print(f"Multicast failed: {e}")
+
+
+def init_my_info(port: int) -> Dict:
+    """Fill in the address-dependent identity once our port is bound"""
+    my_info.update(
+        {
+            "port": port,
+            "user_id": f"{my_info['username']}@{get_local_ip()}:{port}",
+        }
+    )
+    return my_info
 
 
+# Address-dependent fields are set by init_my_info() at startup
 my_info = {
     "username": "User" + str(int(time.time()) % 1000),
     "hostname": socket.gethostname(),
-    "user_id": f"User{int(time.time()) % 1000}@{get_local_ip()}",
+    "user_id": "User" + str(int(time.time()) % 1000),
     "status": "Available",
 }
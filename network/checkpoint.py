@@ -0,0 +1,62 @@
+# network/checkpoint.py
+import json
+import os
+import time
+from typing import Dict, List
+
+import config
+from ui.utils import print_error
+
+# One JSON file per transfer: "<fileid>.in.json" for downloads, ".out.json" for uploads
+INCOMING = "in"
+OUTGOING = "out"
+
+
+def _path(fileid: str, kind: str) -> str:
+    return os.path.join(config.FILE_CHECKPOINT_DIR, f"{fileid}.{kind}.json")
+
+
+def save(fileid: str, kind: str, record: Dict) -> None:
+    """Write a transfer's checkpoint, replacing the previous one atomically"""
+    path = _path(fileid, kind)
+    try:
+        os.makedirs(config.FILE_CHECKPOINT_DIR, exist_ok=True)
+        temp = f"{path}.tmp"
+        with open(temp, "w") as f:
+            json.dump({**record, "saved_at": time.time()}, f)
+        os.replace(temp, path)
+    except OSError as e:
+        print_error(f"Failed to checkpoint transfer {fileid}: {e}")
+
+
+def remove(fileid: str, kind: str) -> None:
+    try:
+        os.unlink(_path(fileid, kind))
+    except OSError:
+        pass
+
+
+def load(kind: str) -> List[Dict]:
+    """Checkpoints of one kind younger than FILE_RESUME_TTL; older ones are deleted"""
+    records = []
+    try:
+        names = os.listdir(config.FILE_CHECKPOINT_DIR)
+    except OSError:
+        return records
+    suffix = f".{kind}.json"
+    now = time.time()
+    for name in names:
+        if not name.endswith(suffix):
+            continue
+        fileid = name[: -len(suffix)]
+        try:
+            with open(os.path.join(config.FILE_CHECKPOINT_DIR, name)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            remove(fileid, kind)
+            continue
+        if now - record.get("saved_at", 0) > config.FILE_RESUME_TTL:
+            remove(fileid, kind)
+            continue
+        records.append(record)
+    return records
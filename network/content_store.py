@@ -0,0 +1,178 @@
+# network/content_store.py
+"""
+Received files kept by content hash under FILE_STORE_DIR, so an offer of
+content we already have is settled without a transfer and swarm downloads
+can be served from here. Entries are hard links to the received files where
+the filesystem allows, copies otherwise; an entry whose size or mtime has
+changed since it was stored (edited through another link) is dropped rather
+than served. The least recently used entries go once the store holds more
+than FILE_STORE_MAX_BYTES.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import config
+from network.integrity import file_digest
+from network.metrics import register_source
+from ui.utils import print_error
+
+_INDEX = "index.json"
+_DIGEST = re.compile(r"^([a-z0-9_]+):([0-9a-f]+)$")
+
+# HASH -> [size, mtime_ns] of each entry, least recently used first
+_entries: "OrderedDict[str, list]" = OrderedDict()
+_loaded = False
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "bytes_saved": 0, "stored": 0, "evicted": 0}
+
+
+def _path(digest: str) -> Optional[str]:
+    """File of an entry; None for a HASH that can't name one (it came off the wire)"""
+    match = _DIGEST.match(digest.lower()) if digest else None
+    if not match:
+        return None
+    return os.path.join(config.FILE_STORE_DIR, f"{match.group(1)}-{match.group(2)}")
+
+
+def _load() -> None:
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    try:
+        with open(os.path.join(config.FILE_STORE_DIR, _INDEX)) as f:
+            for digest, size, mtime in json.load(f):
+                if _path(digest):
+                    _entries[digest] = [size, mtime]
+    except (OSError, ValueError, TypeError):
+        pass
+
+
+def _save() -> None:
+    path = os.path.join(config.FILE_STORE_DIR, _INDEX)
+    try:
+        os.makedirs(config.FILE_STORE_DIR, exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump([[digest, *entry] for digest, entry in _entries.items()], f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print_error(f"Failed to save the content store index: {e}")
+
+
+def _drop(digest: str) -> None:
+    _entries.pop(digest, None)
+    try:
+        os.unlink(_path(digest))
+    except OSError:
+        pass
+
+
+def _link_or_copy(source: str, dest: str) -> None:
+    """Put `source`'s content at `dest` atomically, sharing its blocks if possible"""
+    temp = f"{dest}.{os.getpid()}.tmp"
+    try:
+        os.link(source, temp)
+    except OSError:
+        shutil.copyfile(source, temp)
+    try:
+        os.replace(temp, dest)
+    except OSError:
+        os.unlink(temp)
+        raise
+
+
+def lookup(digest: str) -> Optional[str]:
+    """Path of the stored, unchanged file with this content"""
+    path = _path(digest)
+    if not path:
+        return None
+    with _lock:
+        _load()
+        entry = _entries.get(digest)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+            unchanged = [stat.st_size, stat.st_mtime_ns] == entry
+        except OSError:
+            unchanged = False
+        if not unchanged:
+            _drop(digest)
+            _save()
+        else:
+            # LRU order is kept in memory; the index is written on add and eviction
+            _entries.move_to_end(digest)
+    return path if unchanged else None
+
+
+def add(digest: str, path: str) -> None:
+    """Keep a received file, already checked against `digest`, in the store"""
+    target = _path(digest)
+    if not target or config.FILE_STORE_MAX_BYTES <= 0:
+        return
+    try:
+        if os.path.getsize(path) > config.FILE_STORE_MAX_BYTES:
+            return
+        os.makedirs(config.FILE_STORE_DIR, exist_ok=True)
+        with _lock:
+            _load()
+            _link_or_copy(path, target)
+            stat = os.stat(target)
+            _entries[digest] = [stat.st_size, stat.st_mtime_ns]
+            _entries.move_to_end(digest)
+            _stats["stored"] += 1
+            total = sum(size for size, _ in _entries.values())
+            while total > config.FILE_STORE_MAX_BYTES:
+                oldest = next(iter(_entries))
+                total -= _entries[oldest][0]
+                _drop(oldest)
+                _stats["evicted"] += 1
+            _save()
+    except OSError as e:
+        print_error(f"Failed to add {os.path.basename(path)} to the content store: {e}")
+
+
+def materialize(digest: str, filesize: int, dest: str) -> bool:
+    """
+    Make `dest` hold the content `digest` without a transfer: it already
+    does, or it is linked or copied from the store. False if we don't have it.
+    """
+    if not _path(digest):
+        return False
+    try:
+        if os.path.getsize(dest) == filesize and file_digest(dest) == digest:
+            _stats["hits"] += 1
+            _stats["bytes_saved"] += filesize
+            return True
+    except OSError:
+        pass
+    source = lookup(digest)
+    try:
+        if not source or os.path.getsize(source) != filesize:
+            _stats["misses"] += 1
+            return False
+        directory = os.path.dirname(os.path.abspath(dest))
+        os.makedirs(directory, exist_ok=True)
+        _link_or_copy(source, dest)
+    except OSError as e:
+        print_error(f"Failed to save {dest} from the content store: {e}")
+        return False
+    _stats["hits"] += 1
+    _stats["bytes_saved"] += filesize
+    return True
+
+
+def get_store_stats() -> Dict:
+    with _lock:
+        _load()
+        entries = len(_entries)
+        size = sum(size for size, _ in _entries.values())
+    return {"entries": entries, "bytes": size, **_stats}
+
+
+register_source("content_store", get_store_stats)
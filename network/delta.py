@@ -0,0 +1,200 @@
+# network/delta.py
+"""
+rsync-style deltas. The receiver of a new revision sends the signatures of
+the fixed-size blocks of the revision it has (a rolling Adler-32 and a short
+BLAKE2b per block); the sender finds those blocks anywhere in the new file
+and sends only a stream of copy instructions and the bytes in between,
+which the receiver replays against its old revision.
+
+Delta stream: a header, then records
+    b"C" + first block + block count      copy blocks of the basis
+    b"D" + length + bytes                 literal data
+"""
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, Iterator, Optional
+
+_MAGIC = b"LSD1"
+_HEADER = struct.Struct(">4sIQ")  # magic, block size, size of the result
+_COPY = struct.Struct(">cII")
+_DATA = struct.Struct(">cI")
+_SIGNATURE = struct.Struct(">I8s")  # Adler-32, BLAKE2b-64
+_MOD = 65521  # Adler-32's modulus
+_READ_BLOCK = 1 << 20
+
+SIGNATURE_SIZE = _SIGNATURE.size
+
+
+def _strong(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+def block_size(basis_size: int, minimum: int, max_blocks: int) -> int:
+    """Smallest block of at least `minimum` bytes that splits the basis into `max_blocks` or fewer"""
+    return max(minimum, -(-basis_size // max_blocks))
+
+
+def signatures(path: str, block: int) -> bytes:
+    """Signatures of every full block of `path`, SIGNATURE_SIZE bytes each"""
+    out = bytearray()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(block)
+            if len(data) < block:
+                break  # a short last block can't be found again at the same size
+            out += _SIGNATURE.pack(zlib.adler32(data), _strong(data))
+    return bytes(out)
+
+
+class _Writer:
+    """Delta records, coalescing neighbouring copies"""
+
+    def __init__(self, f, block: int, size: int):
+        self._f = f
+        self._copy: Optional[list] = None  # [first, count]
+        self.copied = 0  # blocks
+        self.literal = 0  # bytes
+        f.write(_HEADER.pack(_MAGIC, block, size))
+
+    def copy(self, index: int) -> None:
+        self.copied += 1
+        if self._copy and self._copy[0] + self._copy[1] == index:
+            self._copy[1] += 1
+            return
+        self._flush_copy()
+        self._copy = [index, 1]
+
+    def data(self, data) -> None:
+        if not len(data):
+            return
+        self._flush_copy()
+        self.literal += len(data)
+        for start in range(0, len(data), _READ_BLOCK):
+            piece = data[start:start + _READ_BLOCK]
+            self._f.write(_DATA.pack(b"D", len(piece)))
+            self._f.write(piece)
+
+    def _flush_copy(self) -> None:
+        if self._copy:
+            self._f.write(_COPY.pack(b"C", *self._copy))
+            self._copy = None
+
+    def close(self) -> None:
+        self._flush_copy()
+
+
+def make_delta(path: str, block: int, basis_signatures: bytes, out_path: str, scan_limit: int) -> Dict:
+    """
+    Write the delta that turns the basis described by `basis_signatures`
+    into the file at `path`. Unmatched stretches are searched byte by byte
+    for blocks that moved, up to `scan_limit` bytes in all; past that only
+    block-aligned positions are tried, which still finds blocks after
+    in-place edits but not after further shifts.
+    """
+    if block <= 0:
+        raise ValueError(f"invalid block size {block}")
+    table: Dict[int, Dict[bytes, int]] = {}
+    for index in range(len(basis_signatures) // SIGNATURE_SIZE):
+        weak, strong = _SIGNATURE.unpack_from(basis_signatures, index * SIGNATURE_SIZE)
+        table.setdefault(weak, {}).setdefault(strong, index)
+
+    size = os.path.getsize(path)
+    with open(path, "rb") as src, open(out_path, "wb") as out:
+        writer = _Writer(out, block, size)
+        data = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        try:
+            literal_from = 0
+            pos = 0
+            scanned = 0
+            weak = None
+            while pos + block <= size:
+                if weak is None:
+                    weak = zlib.adler32(data[pos:pos + block])
+                    a, b = weak & 0xFFFF, weak >> 16
+                candidates = table.get(weak)
+                if candidates:
+                    index = candidates.get(_strong(data[pos:pos + block]))
+                    if index is not None:
+                        writer.data(data[literal_from:pos])
+                        writer.copy(index)
+                        pos += block
+                        literal_from = pos
+                        weak = None
+                        continue
+                if scanned >= scan_limit or pos + block >= size:
+                    pos += block
+                    weak = None
+                    continue
+                # Roll the window one byte on
+                leaving, entering = data[pos], data[pos + block]
+                a = (a - leaving + entering) % _MOD
+                b = (b - block * leaving + a - 1) % _MOD
+                weak = (b << 16) | a
+                pos += 1
+                scanned += 1
+            writer.data(data[literal_from:size])
+            writer.close()
+        finally:
+            if size:
+                data.close()
+    return {
+        "size": size,
+        "delta_size": os.path.getsize(out_path),
+        "copied": writer.copied * block,
+        "literal": writer.literal,
+    }
+
+
+def _records(f) -> Iterator[tuple]:
+    while True:
+        kind = f.read(1)
+        if not kind:
+            return
+        if kind == b"C":
+            _, first, count = _COPY.unpack(kind + f.read(_COPY.size - 1))
+            yield kind, first, count
+        elif kind == b"D":
+            _, length = _DATA.unpack(kind + f.read(_DATA.size - 1))
+            yield kind, length, None
+        else:
+            raise ValueError(f"corrupt delta record {kind!r}")
+
+
+def apply_delta(basis_path: str, delta_path: str, out_path: str, algorithm: str) -> str:
+    """Rebuild the new revision at `out_path`; returns its '<algorithm>:<hex>' digest"""
+    hasher = hashlib.new(algorithm)
+    with open(basis_path, "rb") as basis, open(delta_path, "rb") as delta, open(out_path, "wb") as out:
+        magic, block, size = _HEADER.unpack(delta.read(_HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError("not a delta stream")
+        if block <= 0:
+            raise ValueError(f"invalid block size {block}")
+
+        def emit(data: bytes) -> None:
+            hasher.update(data)
+            out.write(data)
+
+        for kind, first, count in _records(delta):
+            if kind == b"C":
+                basis.seek(first * block)
+                remaining = count * block
+                while remaining:
+                    data = basis.read(min(remaining, _READ_BLOCK))
+                    if not data:
+                        raise ValueError("delta copies past the end of the basis")
+                    emit(data)
+                    remaining -= len(data)
+            else:
+                remaining = first
+                while remaining:
+                    data = delta.read(min(remaining, _READ_BLOCK))
+                    if not data:
+                        raise ValueError("truncated delta")
+                    emit(data)
+                    remaining -= len(data)
+        if out.tell() != size:
+            raise ValueError(f"delta rebuilt {out.tell()} bytes, expected {size}")
+    return f"{algorithm}:{hasher.hexdigest()}"
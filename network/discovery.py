@@ -0,0 +1,106 @@
+# network/discovery.py
+import threading
+import time
+from typing import Callable, Dict
+
+import config
+from network.broadcast import send_ping, send_profile
+from network.metrics import register_source
+from network.peer_registry import on_new_peer
+from network.socket_manager import MAX_PORT_ATTEMPTS
+from ui.utils import print_verbose
+
+
+class DiscoveryScheduler:
+    """
+    Startup discovery as a small state machine: idle -> probing -> stable.
+
+    Each round broadcasts one PROFILE and one PING, then waits for the next
+    delay in DISCOVERY_BACKOFF. Probing stops early once
+    DISCOVERY_QUIET_ROUNDS rounds in a row brought no new peer (but never
+    before peers had time to answer through their PROFILE jitter).
+    """
+
+    def __init__(
+        self,
+        probe: Callable,
+        clock: Callable = time.time,
+        sleep: Callable = time.sleep,
+    ):
+        self._probe = probe  # () -> None, one PROFILE + PING round
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.state = "idle"
+        self.rounds = 0
+        self._new_peers = 0
+        self._metrics: Dict[str, float] = {}
+        self._started_at = None
+
+    def peer_added(self, _entry: Dict) -> None:
+        with self._lock:
+            self._new_peers += 1
+            if self._started_at is None:
+                return
+            elapsed = self._clock() - self._started_at
+            self._metrics.setdefault("time_to_first_peer", elapsed)
+            if self.state == "probing":
+                self._metrics["time_to_stable_view"] = elapsed
+
+    def run(self) -> None:
+        with self._lock:
+            self.state = "probing"
+            self._started_at = self._clock()
+            self._new_peers = 0
+        quiet = 0
+
+        for delay in config.DISCOVERY_BACKOFF:
+            self._sleep(delay)
+            with self._lock:
+                found = self._new_peers
+                self._new_peers = 0
+                elapsed = self._clock() - self._started_at
+
+            if self.rounds:
+                quiet = 0 if found else quiet + 1
+                if (
+                    quiet >= config.DISCOVERY_QUIET_ROUNDS
+                    and elapsed >= config.PROFILE_JITTER_MAX
+                ):
+                    break
+
+            self._probe()
+            self.rounds += 1
+
+        with self._lock:
+            self.state = "stable"
+            self._metrics["rounds"] = self.rounds
+            self._metrics["settled_after"] = self._clock() - self._started_at
+            self._metrics.setdefault("time_to_stable_view", 0.0)
+        if config.verbose_mode:
+            print_verbose(
+                f"Discovery stable after {self.rounds} rounds "
+                f"({self._metrics['settled_after']:.2f}s)"
+            )
+
+    def get_metrics(self) -> Dict:
+        with self._lock:
+            return {"state": self.state, **self._metrics}
+
+
+_discovery = None
+
+
+def start_discovery(my_info: Dict, port: int = 50999) -> None:
+    """Run startup discovery on a background thread"""
+    global _discovery
+
+    def probe():
+        # The first round PINGs the whole port range to find local instances
+        send_profile(my_info, port=port)
+        send_ping(my_info, probe=0 if _discovery.rounds else MAX_PORT_ATTEMPTS)
+
+    _discovery = DiscoveryScheduler(probe)
+    on_new_peer(_discovery.peer_added)
+    register_source("discovery", _discovery.get_metrics)
+    threading.Thread(target=_discovery.run, daemon=True).start()
@@ -0,0 +1,1907 @@
+# network/file_transfer.py
+import base64
+import binascii
+import errno
+import heapq
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional
+
+import config
+from network import checkpoint, content_store, delta, tcp_transfer
+from network.message_sender import (
+    FileChunkSender,
+    send_file_ack,
+    send_file_cancel,
+    send_file_delta,
+    send_file_nack,
+    send_file_query,
+    send_file_received,
+    send_file_reply,
+    send_file_request,
+    send_file_resume,
+    send_file_signatures,
+)
+from network.integrity import PrefixHasher, chunk_crc, file_digest
+from network.metrics import register_source
+from network.peer_registry import get_peer_address
+from network.reliable import schedule
+from network.rtt import RttEstimator, get_estimator
+from network.swarm import SwarmDownload, held_file
+from network.token_utils import validate_token, verify_token_ip
+from network.transfer_scheduler import RateMeter, get_scheduler
+from ui.utils import print_error, print_verbose
+
+
+class ReceivedChunks:
+    """Bitmap of chunk indices seen so far, plus the first missing index"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.bits = bytearray((total + 7) // 8)
+        self.count = 0
+        self.cumulative = 0  # every chunk below this has arrived
+
+    def __contains__(self, index: int) -> bool:
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def add(self, index: int) -> bool:
+        """Mark a chunk; returns False for duplicates and out-of-range indices"""
+        if not 0 <= index < self.total or index in self:
+            return False
+        self.bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+        while self.cumulative < self.total and self.cumulative in self:
+            self.cumulative += 1
+        return True
+
+    def discard(self, index: int) -> bool:
+        """Unmark a chunk; returns False if it wasn't marked"""
+        if not 0 <= index < self.total or index not in self:
+            return False
+        self.bits[index >> 3] &= ~(1 << (index & 7))
+        self.count -= 1
+        self.cumulative = min(self.cumulative, index)
+        return True
+
+    @classmethod
+    def restore(cls, total: int, bits: bytes) -> "ReceivedChunks":
+        """Rebuild from a bitmap saved in a checkpoint"""
+        received = cls(total)
+        received.bits[: len(bits)] = bits[: len(received.bits)]
+        received.count = int.from_bytes(received.bits, "little").bit_count()
+        while received.cumulative < total and received.cumulative in received:
+            received.cumulative += 1
+        return received
+
+    def complete(self) -> bool:
+        return self.count == self.total
+
+    def ranges(self, limit: int) -> str:
+        """Up to `limit` runs of received chunks as 'first-last,...', lowest first"""
+        runs = []
+        index = 0
+        while index < self.total and len(runs) < limit:
+            if index not in self:
+                index += 1
+                continue
+            first = index
+            while index < self.total and index in self:
+                index += 1
+            runs.append(f"{first}-{index - 1}")
+        return ",".join(runs)
+
+    def gaps(self, end: int, limit: int) -> str:
+        """Up to `limit` runs of chunks missing below `end` as 'first-last,...', lowest first"""
+        runs = []
+        index = self.cumulative
+        end = min(end, self.total)
+        while index < end and len(runs) < limit:
+            if index in self:
+                # Step over fully received bytes of the bitmap at once
+                full = index & 7 == 0 and self.bits[index >> 3] == 0xFF
+                index += 8 if full else 1
+                continue
+            first = index
+            while index < end and index not in self:
+                index += 1
+            runs.append(f"{first}-{index - 1}")
+        return ",".join(runs)
+
+    def sack(self, limit: int, start: int = None) -> str:
+        """Base64 bitmap of which of the `limit` chunks from `start` (`cumulative`) arrived"""
+        start = self.cumulative if start is None else start
+        out = bytearray((limit + 7) // 8)
+        for offset in range(min(limit, self.total - start)):
+            if start + offset in self:
+                out[offset >> 3] |= 1 << (offset & 7)
+        return base64.b64encode(bytes(out).rstrip(b"\0")).decode("ascii")
+
+
+class PartialFile:
+    """
+    A download in progress: chunks are written straight to their offset in a
+    preallocated temp file beside the destination, which atomically replaces
+    the destination once every chunk is in. Memory use doesn't grow with the
+    file size.
+    """
+
+    def __init__(self, path: str, filesize: int, chunk_size: int, temp_path: str = None):
+        self.path = path
+        self.filesize = filesize
+        self.chunk_size = chunk_size
+        if temp_path:
+            # Reopen the temp file of an interrupted download
+            self._fd = os.open(temp_path, os.O_RDWR)
+            self.temp_path = temp_path
+            if os.fstat(self._fd).st_size != filesize:
+                self._close()
+                raise OSError(f"{temp_path} is not {filesize} bytes")
+            return
+        directory = os.path.dirname(os.path.abspath(path))
+        self._fd, self.temp_path = tempfile.mkstemp(
+            dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".part"
+        )
+        try:
+            self._preallocate()
+        except OSError:
+            self.discard()
+            raise
+
+    def _preallocate(self) -> None:
+        if self.filesize and hasattr(os, "posix_fallocate"):
+            try:
+                # Reserve the blocks now, so a full disk fails before the transfer
+                os.posix_fallocate(self._fd, 0, self.filesize)
+                return
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise
+                # Filesystem without fallocate support: a sparse file will do
+        os.ftruncate(self._fd, self.filesize)
+
+    def expected_size(self, index: int) -> int:
+        return max(0, min(self.chunk_size, self.filesize - index * self.chunk_size))
+
+    def write(self, index: int, data: bytes) -> None:
+        offset = index * self.chunk_size
+        view = memoryview(data)
+        while view:
+            if hasattr(os, "pwrite"):
+                written = os.pwrite(self._fd, view, offset)
+            else:
+                os.lseek(self._fd, offset, os.SEEK_SET)
+                written = os.write(self._fd, view)
+            view = view[written:]
+            offset += written
+
+    def read(self, index: int) -> bytes:
+        """Read back a chunk already written"""
+        offset = index * self.chunk_size
+        size = self.expected_size(index)
+        if hasattr(os, "pread"):
+            return os.pread(self._fd, size, offset)
+        os.lseek(self._fd, offset, os.SEEK_SET)
+        return os.read(self._fd, size)
+
+    def _close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def commit(self) -> None:
+        """Move the finished file into place"""
+        self._close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self) -> None:
+        self._close()
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
+
+
+def range_indices(ranges: str, total: int) -> Iterator[int]:
+    """
+    Chunk indices listed in a RANGES field, in order and each once, limited
+    to the `total` chunks of the file. Every run is checked up front: one
+    that isn't "first-last" with first <= last raises ValueError before any
+    index is produced.
+    """
+    runs = []
+    for run in filter(None, ranges.split(",")):
+        first, _, last = run.partition("-")
+        last = last or first
+        if not (first.isdecimal() and last.isdecimal()) or int(first) > int(last):
+            raise ValueError(f"bad chunk range {run!r}")
+        runs.append((int(first), min(int(last) + 1, total)))
+    return _merged_runs(sorted(runs))
+
+
+def _merged_runs(runs: List[tuple]) -> Iterator[int]:
+    end = 0
+    for first, stop in runs:
+        yield from range(max(first, end), stop)
+        end = max(end, stop)
+
+
+def sack_indices(cumulative: int, sack: str) -> Iterator[int]:
+    """Chunk indices marked in a SACK bitmap sent along with `cumulative`"""
+    data = base64.b64decode(sack) if sack else b""
+    for position, byte in enumerate(data):
+        for bit in range(8):
+            if byte >> bit & 1:
+                yield cumulative + position * 8 + bit
+
+
+class SendWindow:
+    """
+    Sender side of one file transfer: keeps up to `cwnd` chunks in flight,
+    resends only the chunks the receiver's SACK bitmaps show missing, and
+    adapts the window to loss (slow start, then AIMD, one cut per RTT).
+    """
+
+    def __init__(
+        self,
+        total_chunks: int,
+        chunk_size: int,
+        filesize: int,
+        send: Callable,
+        peer: str,
+        rtt: RttEstimator = None,
+        clock: Callable = time.monotonic,
+        schedule: Callable = schedule,
+        on_done: Callable = None,
+    ):
+        self.total = total_chunks
+        self.chunk_size = chunk_size
+        self.filesize = filesize
+        self._send = send  # (chunk_index) -> None
+        self._peer = peer
+        self._rtt = rtt or get_estimator()
+        self._clock = clock
+        self._schedule = schedule
+        self._on_done = on_done  # (window) -> None, once finished or failed
+        self._lock = threading.Lock()
+
+        self.acked = ReceivedChunks(total_chunks)
+        self.in_flight: Dict[int, tuple] = {}  # index -> (sent_at, attempts)
+        self._attempts: Dict[int, int] = {}  # index -> sends so far, once resent
+        self._lost: List[int] = []  # heap of indices waiting to be resent
+        self._added: List[int] = []  # heap of indices acked unsent, then wanted after all
+        self._next = 0  # lowest index never sent
+        # Never more in flight than the receiver's socket buffer can queue
+        self.max_window = float(
+            max(
+                config.FILE_WINDOW_MIN,
+                min(config.FILE_WINDOW_MAX, config.FILE_WINDOW_MAX_BYTES // chunk_size),
+            )
+        )
+        self.cwnd = min(float(config.FILE_WINDOW_INITIAL), self.max_window)
+        self.ssthresh = self.max_window
+        self._recover_until = 0.0
+        self._last_progress = 0.0
+        self._last_sent = 0.0
+        self._stalls = 0
+
+        self.state = "idle"
+        self.started_at = None
+        self.finished_at = None
+        self.stats = {"chunks_sent": 0, "retransmits": 0, "loss_events": 0, "timeouts": 0}
+
+    def start(self) -> None:
+        with self._lock:
+            now = self._clock()
+            self.state = "sending"
+            self.started_at = now
+            self._last_progress = now
+            if self.acked.complete():
+                self._finish("complete", now)
+                batch = []
+            else:
+                batch = self._fill(now)
+        self._transmit(batch)
+        if self.state == "sending":
+            self._arm()
+        else:
+            self._done()
+
+    def _fill(self, now: float) -> List[int]:
+        """Claim the chunks to send so the window is full again"""
+        batch = []
+        while len(self.in_flight) < int(self.cwnd):
+            if self._lost:
+                index = heapq.heappop(self._lost)
+                if index in self.acked or index in self.in_flight:
+                    continue
+                attempts = self._attempts.get(index, 1) + 1
+                self._attempts[index] = attempts
+                self.stats["retransmits"] += 1
+            elif self._added:
+                index = heapq.heappop(self._added)
+                if index in self.acked or index in self.in_flight:
+                    continue
+                attempts = 1
+            elif self._next < self.total:
+                index = self._next
+                self._next += 1
+                if index in self.acked:
+                    continue
+                attempts = 1
+            else:
+                break
+            self.in_flight[index] = (now, attempts)
+            self.stats["chunks_sent"] += 1
+            batch.append(index)
+        return batch
+
+    def _transmit(self, batch: List[int]) -> None:
+        for index in batch:
+            try:
+                self._send(index)
+            except Exception as e:
+                print_error(f"Failed to send chunk {index}: {e}")
+
+    def mark_sent(self, index: int) -> bool:
+        """
+        For senders that queue chunks before they go out: stamp the real send
+        time, or return False if the chunk no longer needs sending
+        """
+        with self._lock:
+            sent = self.in_flight.get(index)
+            if self.state != "sending" or sent is None:
+                return False
+            now = self._clock()
+            self.in_flight[index] = (now, sent[1])
+            self._last_sent = now
+            return True
+
+    def extend(self, indices: Iterator[int]) -> bool:
+        """
+        Send chunks that were counted as acked without being sent, such as the
+        blocks a swarm download hands to this source later on. Returns False
+        once the window has finished.
+        """
+        with self._lock:
+            if self.state != "sending":
+                return False
+            for index in indices:
+                # Past _next the in-order pass picks it up once it's unmarked
+                if self.acked.discard(index) and index < self._next:
+                    heapq.heappush(self._added, index)
+            batch = self._fill(self._clock())
+        self._transmit(batch)
+        return True
+
+    def chunk_bytes(self, index: int) -> int:
+        return max(0, min(self.chunk_size, self.filesize - index * self.chunk_size))
+
+    def acked_bytes(self) -> int:
+        return min(self.filesize, self.acked.count * self.chunk_size)
+
+    def on_ack(self, cumulative: int, sack: str = "") -> None:
+        """Apply a receiver report: all chunks below `cumulative` plus the SACK bits"""
+        with self._lock:
+            if self.state != "sending":
+                return
+            now = self._clock()
+            newly = [
+                index
+                for index in range(self.acked.cumulative, min(cumulative, self.total))
+                if self.acked.add(index)
+            ]
+            highest = cumulative - 1
+            for index in sack_indices(cumulative, sack):
+                if index < self.total and self.acked.add(index):
+                    newly.append(index)
+                highest = max(highest, index)
+
+            sample = None
+            for index in newly:
+                sent = self.in_flight.pop(index, None)
+                self._attempts.pop(index, None)
+                # Karn's rule: only chunks sent once give a usable RTT
+                if sent and sent[1] == 1:
+                    sample = now - sent[0]
+                if self.cwnd < self.ssthresh:
+                    self.cwnd += 1
+                else:
+                    self.cwnd += 1 / self.cwnd
+            self.cwnd = min(self.cwnd, self.max_window)
+            if newly:
+                self._last_progress = now
+                self._stalls = 0
+            if sample is not None:
+                self._rtt.observe(self._peer, sample)
+
+            # A chunk is lost once several later ones were acked (and a resent
+            # chunk only again after another round trip)
+            srtt = self._rtt.srtt(self._peer) or 0.0
+            lost = [
+                index
+                for index, (sent_at, _) in self.in_flight.items()
+                if index + config.FILE_REORDER_THRESHOLD <= highest
+                and now - sent_at >= srtt
+            ]
+            if lost:
+                for index in lost:
+                    del self.in_flight[index]
+                    heapq.heappush(self._lost, index)
+                if now >= self._recover_until:
+                    self.cwnd = max(float(config.FILE_WINDOW_MIN), self.cwnd / 2)
+                    self.ssthresh = self.cwnd
+                    self._recover_until = now + srtt
+                    self.stats["loss_events"] += 1
+
+            if self.acked.complete():
+                self._finish("complete", now)
+                batch = []
+            else:
+                batch = self._fill(now)
+        self._transmit(batch)
+        if self.state != "sending":
+            self._done()
+
+    def _timeout(self) -> float:
+        return min(config.RTO_MAX, self._rtt.rto(self._peer) * 2**self._stalls)
+
+    def _quiet_since(self) -> float:
+        # A chunk that only just left a send queue can't have been acked yet
+        return max(self._last_progress, self._last_sent)
+
+    def _arm(self) -> None:
+        delay = self._quiet_since() + self._timeout() - self._clock()
+        self._schedule(max(delay, config.TIMER_WHEEL_TICK), self._on_timer)
+
+    def _on_timer(self) -> None:
+        batch = []
+        with self._lock:
+            if self.state != "sending":
+                return
+            now = self._clock()
+            if now - self._quiet_since() >= self._timeout():
+                # Nothing acked for a whole RTO: the window (or its ACKs) is gone
+                self._stalls += 1
+                self.stats["timeouts"] += 1
+                if self._stalls > config.FILE_MAX_STALLS:
+                    self._finish("failed", now)
+                else:
+                    for index in self.in_flight:
+                        heapq.heappush(self._lost, index)
+                    self.in_flight.clear()
+                    self.ssthresh = max(float(config.FILE_WINDOW_MIN), self.cwnd / 2)
+                    self.cwnd = float(config.FILE_WINDOW_MIN)
+                    self._last_progress = now
+                    batch = self._fill(now)
+        self._transmit(batch)
+        if self.state == "sending":
+            self._arm()
+        else:
+            self._done()
+
+    def _finish(self, state: str, now: float) -> None:
+        self.state = state
+        self.finished_at = now
+        self.in_flight.clear()
+
+    def _done(self) -> None:
+        callback, self._on_done = self._on_done, None
+        if callback:
+            callback(self)
+
+    def stop(self, state: str = "complete") -> None:
+        """End the transfer early, e.g. once the receiver reported the outcome"""
+        with self._lock:
+            if self.state == "sending":
+                self._finish(state, self._clock())
+        self._done()
+
+    def summary(self) -> Dict:
+        end = self.finished_at if self.finished_at is not None else self._clock()
+        elapsed = end - self.started_at if self.started_at is not None else 0.0
+        acked_bytes = self.acked_bytes()
+        sent = self.stats["chunks_sent"]
+        return {
+            "state": self.state,
+            "chunks": f"{self.acked.count}/{self.total}",
+            "window": round(self.cwnd, 1),
+            "throughput_kbps": round(acked_bytes / elapsed / 1024, 1) if elapsed else 0.0,
+            "retransmit_rate": round(self.stats["retransmits"] / sent, 3) if sent else 0.0,
+            "elapsed": round(elapsed, 3),
+        }
+
+
+# Recent outcomes, for `stats` after a transfer has left active_file_transfers
+_history = deque(maxlen=config.FILE_HISTORY)
+# FILE_RECEIVED statuses meaning the receiver has the file; HAVE: it needed no transfer
+DELIVERED = ("COMPLETE", "HAVE")
+
+# FILEID -> (sender, total chunks) of finished downloads, to repeat a lost final FILE_ACK
+_finished_incoming: Dict[str, tuple] = {}
+_integrity_stats = {"crc_failures": 0, "hash_failures": 0}
+_ack_lock = threading.Lock()
+_delta_lock = threading.Lock()
+_delta_stats = {"sent": 0, "bytes_saved": 0}
+_tcp_lock = threading.Lock()
+_tcp_stats = {"sent": 0, "received": 0, "fallbacks": 0}
+_TCP_PIECE = 2**20  # bytes a TCP download is read and written in
+
+
+def _transfer_done(fileid: str, window: SendWindow) -> None:
+    summary = window.summary()
+    _history.append((fileid, summary))
+    transfer = config.active_file_transfers.get(fileid)
+    if window.state == "failed" and transfer and transfer.get("served"):
+        # Our share of someone's swarm download; they can do without us
+        if transfer.get("window") is window:
+            config.active_file_transfers.pop(fileid, None)
+    elif window.state == "failed":
+        # Kept, with its checkpoint, so the receiver can still FILE_RESUME it
+        print_error(f"File transfer {fileid} stalled: receiver stopped responding")
+    elif config.verbose_mode and window.state == "complete":
+        print_verbose(
+            f"File {fileid} sent: {summary['chunks']} chunks in {summary['elapsed']}s "
+            f"({summary['throughput_kbps']} KB/s, "
+            f"{summary['retransmit_rate']:.1%} retransmitted)"
+        )
+
+
+def start_transfer(fileid: str, received: str = "", wanted: str = None) -> bool:
+    """
+    Start pushing the chunks of an offered file to its recipient, skipping
+    the chunk ranges the receiver already has, or sending only the `wanted`
+    ones if it is pulling the file from several sources
+    """
+    transfer = config.active_file_transfers.get(fileid)
+    if not transfer or "window" in transfer:
+        return False
+    total = transfer["total_chunks"]
+    try:
+        received = range_indices(received, total)
+        share = None if wanted is None else set(range_indices(wanted, total))
+    except ValueError as e:
+        print_error(f"Cannot start file transfer {fileid}: {e}")
+        return False
+    # From here on the file goes as FILE_CHUNKs; a TCP fetch would only race them
+    _close_tcp(transfer)
+
+    try:
+        chunks = FileChunkSender(fileid, transfer["sender_info"])
+    except (OSError, LookupError) as e:
+        print_error(f"Failed to start file transfer {fileid}: {e}")
+        config.active_file_transfers.pop(fileid, None)
+        checkpoint.remove(fileid, checkpoint.OUTGOING)
+        return False
+
+    scheduler = get_scheduler()
+
+    def done(window: SendWindow) -> None:
+        scheduler.remove_flow(fileid)
+        chunks.close()
+        _transfer_done(fileid, window)
+
+    window = SendWindow(
+        transfer["total_chunks"],
+        transfer["chunk_size"],
+        transfer["filesize"],
+        send=lambda index: scheduler.enqueue(fileid, index, window.chunk_bytes(index)),
+        peer=transfer["recipient"],
+        on_done=done,
+    )
+    for index in received:
+        window.acked.add(index)
+    if share is not None:
+        for index in range(window.total):
+            if index not in share:
+                window.acked.add(index)
+    scheduler.add_flow(fileid, lambda index: window.mark_sent(index) and chunks.send(index))
+    transfer["window"] = window
+    transfer["meter"] = RateMeter(transfer["filesize"])
+    transfer["meter"].update(window.acked_bytes())
+    if not transfer.get("served"):
+        _save_outgoing(fileid, transfer)
+    window.start()
+    return True
+
+
+def _save_outgoing(fileid: str, transfer: Dict) -> None:
+    checkpoint.save(
+        fileid,
+        checkpoint.OUTGOING,
+        {
+            "fileid": fileid,
+            "filepath": os.path.abspath(transfer["filepath"]),
+            "recipient": transfer["recipient"],
+            "chunk_size": transfer["chunk_size"],
+            "total_chunks": transfer["total_chunks"],
+            "filesize": transfer["filesize"],
+            "hash": transfer.get("hash"),
+            "file_stat": transfer.get("file_stat"),
+            "stream": transfer.get("stream"),
+            "delta": transfer.get("delta"),
+        },
+    )
+
+
+def stop_transfer(fileid: str, status: str = "COMPLETE") -> None:
+    """The receiver reported the outcome; stop retransmitting"""
+    transfer = config.active_file_transfers.get(fileid)
+    if transfer and transfer.get("offer_timer"):
+        # Settled without a FILE_ACCEPT, e.g. the receiver already had the file
+        transfer["offer_timer"].cancel()
+    if transfer:
+        _close_tcp(transfer)
+    if transfer and "window" in transfer:
+        transfer["window"].stop("complete" if status in DELIVERED else "failed")
+    if transfer and transfer.get("stream"):
+        _remove_stream(transfer)
+    checkpoint.remove(fileid, checkpoint.OUTGOING)
+
+
+def handle_file_accept(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """The recipient accepted our offer: start sending chunks"""
+    fileid = content["FILEID"]
+    sender = content["FROM"]
+    transfer = config.active_file_transfers.get(fileid)
+    if not transfer or transfer["recipient"] != sender:
+        # The offer expired or was withdrawn before the answer came
+        send_file_cancel(fileid, sender, "UNKNOWN", my_info)
+        return
+    if transfer.get("offer_timer"):
+        transfer["offer_timer"].cancel()
+    if transfer.get("delta") and not content.get("DELTA_PARTS"):
+        # The receiver could not rebuild the file from our delta: it wants the file itself
+        _drop_delta(fileid, transfer)
+    if transfer.get("tcp") and content.get("TCP") == "1":
+        # The receiver pulls the file from our listener; UDP takes over if it never connects
+        transfer["tcp_timer"] = schedule(config.FILE_TCP_WAIT, lambda: _tcp_fallback(fileid, transfer))
+        return
+    parts = content.get("DELTA_PARTS", "")
+    if parts.isdigit() and int(parts):
+        block = content.get("DELTA_BLOCK", "")
+        if not block.isdigit() or int(block) < config.FILE_DELTA_BLOCK_MIN:
+            # Receivers never pick less than FILE_DELTA_BLOCK_MIN; a block of 0 would never finish scanning
+            print_error(f"Invalid DELTA_BLOCK {block!r} for {fileid}; sending the whole file")
+            _send_whole(fileid, transfer)
+            return
+        # The receiver has an older revision; its block signatures follow
+        with _delta_lock:
+            if "delta_parts" in transfer or "window" in transfer:
+                return
+            transfer["delta_parts"] = int(parts)
+            transfer["delta_block"] = int(block)
+            # Parts that came ahead of the accept, as far as they belong to it
+            transfer["signatures"] = {
+                part: signatures
+                for part, signatures in transfer.get("signatures", {}).items()
+                if part < int(parts)
+            }
+            transfer["delta_timer"] = schedule(
+                config.FILE_DELTA_WAIT, lambda: _send_whole(fileid, transfer)
+            )
+        _maybe_build_delta(fileid, transfer)
+        return
+    if start_transfer(fileid) and config.verbose_mode:
+        print_verbose(f"{sender} accepted {fileid}; sending")
+
+
+def handle_file_signatures(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """One part of the block signatures of the receiver's older revision"""
+    fileid = content["FILEID"]
+    transfer = config.active_file_transfers.get(fileid)
+    if not transfer or transfer["recipient"] != content["FROM"] or "window" in transfer:
+        return
+    try:
+        part = int(content["PART"])
+        announced = int(content["PARTS"])
+        signatures = base64.b64decode(content["SIGS"], validate=True)
+    except (KeyError, ValueError, binascii.Error):
+        print_error(f"Invalid FILE_SIGNATURES for {fileid}")
+        return
+    with _delta_lock:
+        # Until the accept says how many parts there are, the message's own PARTS bounds it
+        parts = transfer.get("delta_parts", announced)
+        if not 0 <= part < parts or transfer.get("delta_state"):
+            return
+        transfer.setdefault("signatures", {})[part] = signatures
+    _maybe_build_delta(fileid, transfer)
+
+
+def _maybe_build_delta(fileid: str, transfer: Dict) -> None:
+    """Once the accept and every signature part are in, build the delta off the listener thread"""
+    with _delta_lock:
+        parts = transfer.get("delta_parts")
+        if not parts or transfer.get("delta_state") or len(transfer["signatures"]) < parts:
+            return
+        transfer["delta_state"] = "building"
+        transfer["delta_timer"].cancel()
+    threading.Thread(target=_build_delta, args=(fileid, transfer), daemon=True).start()
+
+
+def _build_delta(fileid: str, transfer: Dict) -> None:
+    parts = transfer["delta_parts"]
+    stream = os.path.join(config.FILE_CHECKPOINT_DIR, f"{fileid}.delta")
+    started = time.monotonic()
+    try:
+        signatures = b"".join(transfer["signatures"][part] for part in range(parts))
+        os.makedirs(config.FILE_CHECKPOINT_DIR, exist_ok=True)
+        stats = delta.make_delta(
+            transfer["filepath"],
+            transfer["delta_block"],
+            signatures,
+            stream,
+            config.FILE_DELTA_SCAN_LIMIT,
+        )
+    except (OSError, KeyError, ValueError) as e:
+        print_error(f"Failed to build a delta for {fileid}: {e}")
+        stats = None
+    transfer.pop("signatures", None)
+    withdrawn = config.active_file_transfers.get(fileid) is not transfer
+    if not withdrawn and stats and stats["delta_size"] <= config.FILE_DELTA_MAX_RATIO * transfer["filesize"]:
+        transfer["delta"] = {
+            "filesize": transfer["filesize"],
+            "copied": stats["copied"],
+            "literal": stats["literal"],
+        }
+        transfer["stream"] = stream
+        transfer["filesize"] = stats["delta_size"]
+        transfer["total_chunks"] = -(-stats["delta_size"] // transfer["chunk_size"])
+        _delta_stats["sent"] += 1
+        _delta_stats["bytes_saved"] += transfer["delta"]["filesize"] - stats["delta_size"]
+        if config.verbose_mode:
+            print_verbose(
+                f"Delta for {fileid}: {stats['delta_size']} of {transfer['delta']['filesize']} "
+                f"bytes, {stats['copied']} reused, built in {time.monotonic() - started:.2f}s"
+            )
+
+        def undelivered(*_) -> None:
+            if config.active_file_transfers.get(fileid) is transfer and "window" not in transfer:
+                del config.active_file_transfers[fileid]
+                _remove_stream(transfer)
+                print_error(f"{transfer['recipient']} stopped answering; dropped {fileid}")
+
+        send_file_delta(
+            fileid,
+            transfer["recipient"],
+            stats["delta_size"],
+            transfer["sender_info"],
+            on_delivered=lambda *_: start_transfer(fileid),
+            on_give_up=undelivered,
+        )
+        return
+    try:
+        os.unlink(stream)
+    except OSError:
+        pass
+    if not withdrawn:
+        _send_whole(fileid, transfer, building=True)
+
+
+def _send_whole(fileid: str, transfer: Dict, building: bool = False) -> None:
+    """Give up on a delta (signatures missing, or it wouldn't save enough): send the file"""
+    with _delta_lock:
+        if transfer.get("delta_state") not in (("building",) if building else (None,)):
+            return
+        transfer["delta_state"] = "whole"
+    if config.active_file_transfers.get(fileid) is transfer:
+        start_transfer(fileid)
+
+
+def _drop_delta(fileid: str, transfer: Dict) -> None:
+    """Go back to sending the file itself, e.g. after the receiver failed to apply our delta"""
+    with _delta_lock:
+        window = transfer.pop("window", None)
+        if window:
+            window.stop("restarted")
+        _remove_stream(transfer)
+        transfer["filesize"] = transfer.pop("delta")["filesize"]
+        transfer["total_chunks"] = -(-transfer["filesize"] // transfer["chunk_size"])
+        transfer.pop("stream", None)
+        transfer["delta_state"] = "whole"
+    if config.verbose_mode:
+        print_verbose(f"{transfer['recipient']} could not use the delta for {fileid}; sending the file")
+
+
+def serve_tcp(fileid: str, conn, addr: tuple, request: Dict) -> bool:
+    """
+    Someone connected to the TCP listener of an offered file: if it is the
+    recipient, stream the file from the OFFSET it asks for. False refuses it.
+    """
+    transfer = config.active_file_transfers.get(fileid)
+    token = request.get("TOKEN", "")
+    offset = request.get("OFFSET", "")
+    if (
+        not transfer
+        or request.get("TYPE") != "FILE_FETCH"
+        or request.get("FILEID") != fileid
+        or request.get("FROM") != transfer["recipient"]
+        or token.split("|")[0] != transfer["recipient"]
+        or not validate_token(token, "file")
+        or not verify_token_ip(token, addr[0])
+        or not offset.isdigit()
+        or int(offset) > transfer["filesize"]
+    ):
+        print_error(f"Refused a TCP connection from {addr[0]} for {fileid}")
+        return False
+    listener = transfer["tcp"]
+    with _tcp_lock:
+        if listener.state != "listening":
+            return False
+        listener.state = "serving"
+    for timer in ("offer_timer", "tcp_timer"):
+        if transfer.get(timer):
+            transfer[timer].cancel()
+
+    offset = int(offset)
+    meter = transfer["meter"] = RateMeter(transfer["filesize"])
+    meter.update(offset)
+    # A restarted sender can still finish it over UDP when the receiver asks
+    _save_outgoing(fileid, transfer)
+    if config.verbose_mode:
+        print_verbose(f"{transfer['recipient']} is fetching {fileid} over TCP from byte {offset}")
+
+    # Each segment waits its turn in the transfer scheduler like a FILE_CHUNK,
+    # so FILE_RATE_LIMIT and the round-robin between uploads cover TCP too
+    scheduler = get_scheduler()
+    flow = f"{fileid}/tcp"
+    granted = threading.Semaphore(0)
+
+    def grant(_) -> bool:
+        granted.release()
+        return True
+
+    def pace(size: int) -> None:
+        scheduler.enqueue(flow, None, size)
+        granted.acquire()
+
+    scheduler.add_flow(flow, grant)
+    try:
+        tcp_transfer.serve_file(
+            conn,
+            transfer.get("stream") or transfer["filepath"],
+            offset,
+            transfer["filesize"] - offset,
+            lambda sent: meter.update(meter.done + sent),
+            pace,
+            # Under a cap, sent in bursts no bigger than the bucket holds
+            scheduler.quantum if scheduler.rate else None,
+        )
+        listener.state = "sent"
+        _tcp_stats["sent"] += 1
+    except OSError as e:
+        # The receiver sends FILE_RESUME for the rest
+        listener.state = "failed"
+        if config.verbose_mode:
+            print_verbose(f"TCP transfer of {fileid} broke off: {e}")
+    finally:
+        scheduler.remove_flow(flow)
+    elapsed = time.monotonic() - meter.started_at
+    _history.append(
+        (
+            fileid,
+            {
+                "state": "complete" if listener.state == "sent" else "failed",
+                "chunks": f"{-(-meter.done // transfer['chunk_size'])}/{transfer['total_chunks']}",
+                "window": "tcp",
+                "throughput_kbps": round((meter.done - offset) / elapsed / 1024, 1) if elapsed else 0.0,
+                "retransmit_rate": 0.0,
+                "elapsed": round(elapsed, 3),
+            },
+        )
+    )
+    return True
+
+
+def _close_tcp(transfer: Dict) -> bool:
+    """Stop a transfer's TCP listener if nobody has connected yet; False if it had no open one"""
+    with _tcp_lock:
+        listener = transfer.get("tcp")
+        if not listener or listener.state != "listening":
+            return False
+        listener.close()
+    if transfer.get("tcp_timer"):
+        transfer["tcp_timer"].cancel()
+    return True
+
+
+def _tcp_fallback(fileid: str, transfer: Dict) -> None:
+    """The receiver said it would fetch over TCP but never connected: send FILE_CHUNKs"""
+    if config.active_file_transfers.get(fileid) is transfer and _close_tcp(transfer):
+        _tcp_stats["fallbacks"] += 1
+        start_transfer(fileid)
+
+
+def _remove_stream(transfer: Dict) -> None:
+    try:
+        os.unlink(transfer["stream"])
+    except OSError:
+        pass
+
+
+def handle_file_reject(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """The recipient declined our offer, or dropped a download part way through"""
+    fileid = content["FILEID"]
+    transfer = config.active_file_transfers.get(fileid)
+    if not transfer or transfer["recipient"] != content["FROM"]:
+        return
+    if transfer.get("offer_timer"):
+        transfer["offer_timer"].cancel()
+    _close_tcp(transfer)
+    if "window" in transfer:
+        transfer["window"].stop("rejected")
+    checkpoint.remove(fileid, checkpoint.OUTGOING)
+    config.active_file_transfers.pop(fileid, None)
+    print_error(f"{content['FROM']} rejected {os.path.basename(transfer['filepath'])}")
+
+
+def handle_file_resume(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """A receiver that lost its place (or restarted) asks for the chunks it lacks"""
+    fileid = content["FILEID"]
+    sender = content["FROM"]
+    transfer = config.active_file_transfers.get(fileid)
+    if not transfer or transfer["recipient"] != sender:
+        send_file_cancel(fileid, sender, "UNKNOWN", my_info)
+        return
+    try:
+        # Checked before the running window is touched
+        range_indices(content.get("RANGES", ""), transfer["total_chunks"])
+    except ValueError as e:
+        print_error(f"Cannot resume {fileid}: {e}")
+        send_file_cancel(fileid, sender, "INVALID", my_info)
+        stop_transfer(fileid, "ERROR")
+        config.active_file_transfers.pop(fileid, None)
+        return
+    if transfer.get("file_stat") is None:
+        # Checkpointed without size and mtime: only hashing the file can tell
+        threading.Thread(
+            target=_resume, args=(content, transfer, my_info, True), daemon=True
+        ).start()
+        return
+    _resume(content, transfer, my_info)
+
+
+def _resume(content: Dict, transfer: Dict, my_info: Dict, rehash: bool = False) -> None:
+    fileid = content["FILEID"]
+    sender = content["FROM"]
+    offered = content.get("HASH") or transfer.get("hash")
+    try:
+        if rehash:
+            unchanged = not offered or file_digest(transfer["filepath"]) == offered
+        else:
+            stat = os.stat(transfer["filepath"])
+            unchanged = (not offered or offered == transfer.get("hash")) and [
+                stat.st_size,
+                stat.st_mtime_ns,
+            ] == transfer["file_stat"]
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        print_error(f"Cannot resume {fileid}: {transfer['filepath']} changed or is gone")
+        send_file_cancel(fileid, sender, "CHANGED", my_info)
+        stop_transfer(fileid, "ERROR")
+        config.active_file_transfers.pop(fileid, None)
+        return
+
+    window = transfer.pop("window", None)
+    if window:
+        window.stop("restarted")
+    # Whatever share of a swarm download we had, it is all ours again
+    transfer.pop("swarm_seq", None)
+    if config.verbose_mode:
+        print_verbose(f"Resuming {fileid} for {sender}")
+    start_transfer(fileid, content.get("RANGES", ""))
+
+
+def handle_file_request(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """
+    A swarm download wants the chunk RANGES from us: content we are sending
+    it already, or hold from an earlier transfer
+    """
+    fileid = content["FILEID"]
+    requester = content["FROM"]
+    seq = int(content["SEQ"])
+    wanted = content.get("RANGES", "")
+    transfer = config.active_file_transfers.get(fileid)
+    if transfer is None:
+        path = held_file(content["HASH"])
+        try:
+            filesize = int(content["FILESIZE"])
+            chunk_size = int(content["CHUNK_SIZE"])
+            # Chunk sizes we would offer ourselves; a tiny one would make a huge window
+            if not path or not config.FILE_CHUNK_MIN <= chunk_size <= config.FILE_CHUNK_MAX:
+                raise ValueError(fileid)
+            stat = os.stat(path)
+            if stat.st_size != filesize:
+                raise ValueError(fileid)
+            range_indices(wanted, -(-filesize // chunk_size))
+        except (OSError, ValueError):
+            send_file_cancel(fileid, requester, "UNKNOWN", my_info)
+            return
+        transfer = {
+            "filepath": path,
+            "recipient": requester,
+            "chunk_size": chunk_size,
+            "total_chunks": -(-filesize // chunk_size),
+            "filesize": filesize,
+            "sender_info": my_info,
+            "hash": content["HASH"],
+            "file_stat": [stat.st_size, stat.st_mtime_ns],
+            "served": True,
+        }
+        config.active_file_transfers[fileid] = transfer
+        if config.verbose_mode:
+            print_verbose(f"Serving part of {os.path.basename(path)} to {requester}")
+    elif transfer["recipient"] != requester:
+        send_file_cancel(fileid, requester, "UNKNOWN", my_info)
+        return
+    else:
+        try:
+            range_indices(wanted, transfer["total_chunks"])
+        except ValueError as e:
+            print_error(f"Invalid FILE_REQUEST for {fileid}: {e}")
+            return
+    if seq <= transfer.get("swarm_seq", 0):
+        return  # a late retry of a request we have acted on
+    if transfer.get("offer_timer"):
+        transfer["offer_timer"].cancel()
+
+    window = transfer.get("window")
+    if (
+        "swarm_seq" in transfer
+        and window
+        and window.extend(range_indices(wanted, transfer["total_chunks"]))
+    ):
+        transfer["swarm_seq"] = seq
+        return
+    # First request, or our window ran out of work: start one limited to RANGES
+    transfer["swarm_seq"] = seq
+    if window:
+        del transfer["window"]
+        window.stop("restarted")
+    start_transfer(fileid, wanted=wanted)
+
+
+def restore_transfers(my_info: Dict) -> None:
+    """Reload unfinished transfers after a restart and ask senders to resume ours"""
+    for record in checkpoint.load(checkpoint.OUTGOING):
+        fileid = record["fileid"]
+        if not os.path.exists(record["filepath"]) or (
+            record.get("stream") and not os.path.exists(record["stream"])
+        ):
+            checkpoint.remove(fileid, checkpoint.OUTGOING)
+            continue
+        # Idle until the receiver sends FILE_RESUME
+        config.active_file_transfers[fileid] = {**record, "sender_info": my_info}
+
+    for record in checkpoint.load(checkpoint.INCOMING):
+        fileid = record["fileid"]
+        try:
+            partial = PartialFile(
+                record["filename"],
+                record["filesize"],
+                record["chunk_size"],
+                temp_path=record["temp_path"],
+            )
+        except OSError:
+            checkpoint.remove(fileid, checkpoint.INCOMING)
+            continue
+        received = ReceivedChunks.restore(
+            record["total_chunks"], base64.b64decode(record["bitmap"])
+        )
+        hasher = None if record.get("delta") else _new_hasher(fileid, record.get("hash"))
+        if hasher:
+            # Hash state can't be saved; catch up on the prefix already on disk
+            hasher.advance(received.cumulative, -1, None, partial.read)
+        config.incoming_files[fileid] = {
+            "from": record["from"],
+            "sender_addr": tuple(record["sender_addr"]),
+            "filename": record["filename"],
+            "filesize": record["filesize"],
+            "chunk_size": record["chunk_size"],
+            "hash": record.get("hash"),
+            "delta": record.get("delta"),
+            "accepted": True,
+            "file": partial,
+            "received": received,
+            "hasher": hasher,
+            "meter": RateMeter(record["filesize"]),
+            "unacked": 0,
+            "ack_timer": None,
+            "checkpointed_at": time.monotonic(),
+            "last_chunk_at": 0.0,
+        }
+        config.incoming_files[fileid]["meter"].update(
+            min(record["filesize"], received.count * record["chunk_size"])
+        )
+        _watch_idle(fileid, my_info)
+
+
+def handle_file_ack(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """Feed a receiver's CUMULATIVE/SACK report into the sending window"""
+    transfer = config.active_file_transfers.get(content["FILEID"])
+    if not transfer or transfer["recipient"] != content["FROM"] or "window" not in transfer:
+        return
+    if "SEQ" in content and int(content["SEQ"]) != transfer.get("swarm_seq"):
+        # Made against a share of the file we no longer (or don't yet) have
+        return
+    window = transfer["window"]
+    window.on_ack(int(content["CUMULATIVE"]), content.get("SACK", ""))
+    transfer["meter"].update(window.acked_bytes())
+
+
+def _flush_ack(fileid: str, my_info: Dict, force: bool = False, source: str = None) -> None:
+    with _ack_lock:
+        file_info = config.incoming_files.get(fileid)
+        if not file_info or "received" not in file_info:
+            return
+        swarm = file_info.get("swarm")
+        if not force and not file_info["unacked"] and not swarm:
+            return
+        file_info["unacked"] = 0
+        file_info["ack_timer"] = None
+        if swarm:
+            acks = swarm.acks(source)
+        else:
+            received = file_info["received"]
+            acks = [
+                (file_info["from"], received.cumulative, received.sack(config.FILE_SACK_BITS), None)
+            ]
+    for sender, cumulative, sack, seq in acks:
+        send_file_ack(fileid, sender, cumulative, sack, my_info, seq)
+
+
+def _open_incoming(fileid: str, file_info: Dict, my_info: Dict, addr: tuple) -> None:
+    """Create the temp file and progress state of a download; called with _ack_lock held"""
+    file_info["file"] = PartialFile(
+        file_info["filename"], file_info["filesize"], file_info["chunk_size"]
+    )
+    file_info["received"] = ReceivedChunks(-(-file_info["filesize"] // file_info["chunk_size"]))
+    # A delta stream is checked once it has been applied, see _apply_delta
+    file_info["hasher"] = None if file_info.get("delta") else _new_hasher(fileid, file_info.get("hash"))
+    file_info["meter"] = RateMeter(file_info["filesize"])
+    file_info["unacked"] = 0
+    file_info["ack_timer"] = None
+    file_info["sender_addr"] = get_peer_address(file_info["from"]) or addr
+    file_info["checkpointed_at"] = time.monotonic()
+    file_info["last_chunk_at"] = time.monotonic()
+    if not file_info.get("group_id"):
+        # Group downloads are watched by _watch_gaps from the moment they are accepted
+        schedule(config.FILE_RESUME_IDLE, lambda: _watch_idle(fileid, my_info))
+
+
+def handle_file_chunk(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """Store a chunk, report progress to the sender and assemble the file when complete"""
+    required_fields = ["FROM", "FILEID", "CHUNK_INDEX", "TOTAL_CHUNKS", "DATA"]
+    if any(field not in content for field in required_fields):
+        print_error("Invalid FILE_CHUNK: missing required fields")
+        return
+
+    user_id = content["FROM"]
+    fileid = content["FILEID"]
+    chunk_index = int(content["CHUNK_INDEX"])
+    total_chunks = int(content["TOTAL_CHUNKS"])
+
+    file_info = config.incoming_files.get(fileid)
+    if file_info is None:
+        finished = _finished_incoming.get(fileid)
+        if finished and user_id in finished[0]:
+            # Our final FILE_ACK was lost and the sender is still going
+            send_file_ack(fileid, user_id, finished[1], "", my_info)
+        elif config.verbose_mode and "GROUP_ID" not in content:
+            # Group chunks reach every node on the LAN; only members know the file
+            print_verbose(f"Ignoring FILE_CHUNK for unknown file ID {fileid}")
+        return
+    group_id = file_info.get("group_id")
+    swarm = file_info.get("swarm")
+    if content.get("GROUP_ID") != group_id:
+        return
+    if user_id != file_info["from"] and not (swarm and swarm.has_source(user_id)):
+        return
+    if not file_info.get("accepted"):
+        if config.verbose_mode:
+            print_verbose(f"Ignoring FILE_CHUNK for {fileid}: offer not accepted")
+        return
+
+    try:
+        chunk_data = base64.b64decode(content["DATA"])
+    except ValueError:
+        print_error(f"Invalid FILE_CHUNK {chunk_index} for {fileid}: bad DATA")
+        return
+
+    try:
+        with _ack_lock:
+            if "received" not in file_info:
+                expected = -(-file_info["filesize"] // file_info["chunk_size"])
+                if total_chunks != expected:
+                    print_error(
+                        f"Invalid FILE_CHUNK for {fileid}: {total_chunks} chunks, "
+                        f"offer implies {expected}"
+                    )
+                    return
+                _open_incoming(fileid, file_info, my_info, addr)
+            partial = file_info["file"]
+            received = file_info["received"]
+            if not 0 <= chunk_index < received.total:
+                print_error(f"Invalid FILE_CHUNK for {fileid}: no chunk {chunk_index}")
+                return
+            if len(chunk_data) != partial.expected_size(chunk_index):
+                print_error(
+                    f"Invalid FILE_CHUNK {chunk_index} for {fileid}: "
+                    f"{len(chunk_data)} bytes, expected {partial.expected_size(chunk_index)}"
+                )
+                return
+            crc = content.get("CRC32")
+            if crc and chunk_crc(chunk_data) != crc.lower():
+                # Left unmarked: the next FILE_ACK shows the gap and only this chunk is resent
+                _integrity_stats["crc_failures"] += 1
+                if config.verbose_mode:
+                    print_verbose(f"CRC mismatch on chunk {chunk_index} of {fileid}")
+                new = False
+            else:
+                # Written before it is marked, so a failed write is simply resent
+                new = chunk_index not in received
+            if new:
+                partial.write(chunk_index, chunk_data)
+                received.add(chunk_index)
+                file_info["meter"].update(file_info["meter"].done + len(chunk_data))
+                if file_info["hasher"]:
+                    file_info["hasher"].advance(
+                        received.cumulative, chunk_index, chunk_data, partial.read
+                    )
+                now = time.monotonic()
+                file_info["last_chunk_at"] = now
+                file_info["highest"] = max(file_info.get("highest", -1), chunk_index)
+                if (
+                    # A group download has no FILE_RESUME to pick it up again; NACKs repair it
+                    not group_id
+                    and now - file_info["checkpointed_at"] >= config.FILE_CHECKPOINT_INTERVAL
+                    and not received.complete()
+                ):
+                    file_info["checkpointed_at"] = now
+                    _save_incoming(fileid, file_info)
+            file_info["unacked"] += 1
+            if swarm:
+                # Each source is acked for its own share of the file, see SwarmDownload
+                unacked = swarm.on_chunk(user_id, chunk_index, new)
+                ack_now = not new or received.complete() or unacked >= config.FILE_ACK_EVERY
+            else:
+                # Gaps and duplicates are reported at once so the sender can repair
+                in_order = new and received.cumulative == chunk_index + 1
+                ack_now = not group_id and (
+                    not in_order
+                    or received.complete()
+                    or file_info["unacked"] >= config.FILE_ACK_EVERY
+                )
+            if not ack_now and not group_id and file_info["ack_timer"] is None:
+                file_info["ack_timer"] = schedule(
+                    config.FILE_ACK_DELAY, lambda: _flush_ack(fileid, my_info)
+                )
+    except OSError as e:
+        print_error(f"Failed to save file: {e}")
+        discard_incoming(fileid)
+        for sender in swarm.sources() if swarm else [user_id]:
+            send_file_received(fileid, sender, my_info, "ERROR", group_id)
+        return
+
+    if config.verbose_mode and new:
+        print_verbose(
+            f"\nTYPE: FILE_CHUNK\n"
+            f"FROM: {user_id}\n"
+            f"FILEID: {fileid}\n"
+            f"CHUNK_INDEX: {chunk_index}\n"
+            f"TOTAL_CHUNKS: {total_chunks}\n"
+            f"CHUNK_SIZE: {len(chunk_data)}\n"
+            f"TOKEN: {content.get('TOKEN', '')}\n\n"
+        )
+
+    if ack_now:
+        _flush_ack(fileid, my_info, force=True, source=user_id)
+
+    if not received.complete() or not new:
+        return
+
+    senders = [user_id]
+    if swarm:
+        swarm.stop()
+        senders = swarm.sources()
+        if config.verbose_mode:
+            summary = swarm.summary()
+            print_verbose(
+                f"Fetched {fileid} from {len(senders)} peers in {summary['elapsed']}s: "
+                + ", ".join(f"{peer} {rate} KB/s" for peer, rate in summary["sources"].items())
+            )
+    _complete_download(fileid, file_info, senders, my_info)
+
+
+def _complete_download(fileid: str, file_info: Dict, senders: List[str], my_info: Dict) -> None:
+    """Every chunk is in: verify and save the file and report the outcome to its senders"""
+    partial = file_info["file"]
+    group_id = file_info.get("group_id")
+    hasher = file_info["hasher"]
+    status = "COMPLETE"
+    try:
+        if hasher and not hasher.matches():
+            _integrity_stats["hash_failures"] += 1
+            raise ValueError(
+                f"file hash {hasher.digest()} does not match offered {file_info['hash']}"
+            )
+        if file_info.get("delta"):
+            try:
+                _apply_delta(file_info)
+            except ValueError as e:
+                print_error(f"Could not rebuild {file_info['filename']} from a delta ({e}); fetching it whole")
+                _accept_whole(fileid, file_info, my_info)
+                return
+        else:
+            partial.commit()
+        if hasher or file_info.get("delta"):
+            content_store.add(file_info["hash"], file_info["filename"])
+
+        if not config.verbose_mode:
+            print(f"\nFile transfer of {file_info['filename']} is complete\n")
+
+    except Exception as e:
+        print_error(f"Failed to save file: {e}")
+        partial.discard()
+        status = "ERROR"
+
+    # Send acknowledgment
+    for sender in senders:
+        send_file_received(fileid, sender, my_info, status, group_id)
+
+    # Clean up
+    checkpoint.remove(fileid, checkpoint.INCOMING)
+    if not group_id:
+        _finished_incoming[fileid] = (tuple(senders), file_info["received"].total)
+        while len(_finished_incoming) > config.FILE_HISTORY:
+            del _finished_incoming[next(iter(_finished_incoming))]
+    config.incoming_files.pop(fileid, None)
+
+
+def _bare_name(filename: str) -> str:
+    name = os.path.basename(filename.replace("\\", "/")).strip()
+    return "received" if name in ("", ".", "..") else name
+
+
+def delta_basis(filename: str) -> Optional[str]:
+    """The newest revision saved under an offered name (or its numbered copies), to build a delta on"""
+    name = _bare_name(filename)
+    stem, ext = os.path.splitext(name)
+    newest, newest_mtime = None, None
+    try:
+        entries = list(os.scandir(config.FILE_DOWNLOAD_DIR))
+    except OSError:
+        return None
+    for entry in entries:
+        number = entry.name[len(stem) + 2 : len(entry.name) - len(ext) - 1]
+        numbered = (
+            entry.name.startswith(f"{stem} (") and entry.name.endswith(f"){ext}") and number.isdigit()
+        )
+        if entry.name != name and not numbered:
+            continue
+        try:
+            if entry.is_file() and (newest_mtime is None or entry.stat().st_mtime > newest_mtime):
+                newest, newest_mtime = entry.path, entry.stat().st_mtime
+        except OSError:
+            continue
+    return newest
+
+
+def download_path(filename: str) -> str:
+    """
+    Where to save an offered file: its bare name under FILE_DOWNLOAD_DIR,
+    numbered if that name is taken by a file or another download. Only
+    names are checked; answer_from_store finds a copy we already have.
+    """
+    name = _bare_name(filename)
+    stem, ext = os.path.splitext(name)
+    taken = {os.path.abspath(info["filename"]) for info in list(config.incoming_files.values())}
+    path = os.path.join(config.FILE_DOWNLOAD_DIR, name)
+    number = 1
+    while os.path.abspath(path) in taken or os.path.exists(path):
+        path = os.path.join(config.FILE_DOWNLOAD_DIR, f"{stem} ({number}){ext}")
+        number += 1
+    return path
+
+
+def _existing_copy(filename: str, file_info: Dict) -> Optional[str]:
+    """The offered name under FILE_DOWNLOAD_DIR, if it already holds the offered content"""
+    path = os.path.join(config.FILE_DOWNLOAD_DIR, _bare_name(filename))
+    taken = {os.path.abspath(info["filename"]) for info in list(config.incoming_files.values())}
+    try:
+        if (
+            os.path.abspath(path) not in taken
+            and os.path.getsize(path) == file_info["filesize"]
+            and file_digest(path) == file_info["hash"]
+        ):
+            return path
+    except OSError:
+        pass
+    return None
+
+
+def answer_from_store(fileid: str, my_info: Dict, filename: str = None) -> bool:
+    """
+    Settle an offer of content we already have, saved under the offered
+    `filename` or kept in the content store, with FILE_RECEIVED STATUS HAVE
+    instead of a transfer. It may hash or copy a whole file, so it runs off
+    the listener thread.
+    """
+    file_info = config.incoming_files.get(fileid)
+    if not file_info or not file_info.get("hash"):
+        return False
+    destination = (filename and _existing_copy(filename, file_info)) or file_info["filename"]
+    if not content_store.materialize(file_info["hash"], file_info["filesize"], destination):
+        return False
+    file_info["filename"] = destination
+    config.incoming_files.pop(fileid, None)
+    send_file_received(fileid, file_info["from"], my_info, "HAVE", file_info.get("group_id"))
+    return True
+
+
+def _new_hasher(fileid: str, expected: str):
+    if not expected:
+        return None  # sender predates HASH in FILE_OFFER
+    try:
+        return PrefixHasher(expected)
+    except ValueError:
+        print_error(f"Cannot verify {fileid}: unsupported hash {expected.split(':')[0]}")
+        return None
+
+
+def accept_incoming(fileid: str, my_info: Dict) -> bool:
+    """Accept an offered file: tell its sender to start sending chunks"""
+    file_info = config.incoming_files.get(fileid)
+    if file_info is None:
+        return False
+    if file_info.get("accepted"):
+        return True
+    file_info["accepted"] = True
+    group_id = file_info.get("group_id")
+    if group_id:
+        # NACKs for the whole file stand in for a late accept that missed the stream
+        file_info["last_chunk_at"] = time.monotonic()
+        _watch_gaps(fileid, my_info)
+
+    def unanswered(*_) -> None:
+        if discard_incoming(fileid):
+            print_error(f"{file_info['from']} did not answer; dropped {file_info['filename']}")
+
+    block, parts = _basis_signatures(file_info)
+    # A delta is small enough for FILE_CHUNKs; a whole file comes faster over TCP
+    tcp = bool(config.FILE_TCP and file_info.get("tcp_port") and not parts and not group_id)
+    if not send_file_reply(
+        fileid,
+        file_info["from"],
+        my_info,
+        "ACCEPT",
+        on_give_up=unanswered,
+        group_id=group_id,
+        delta_block=block,
+        delta_parts=len(parts),
+        tcp=tcp,
+    ):
+        return False
+    for part, signatures in enumerate(parts):
+        send_file_signatures(fileid, file_info["from"], block, part, len(parts), signatures, my_info)
+    if tcp:
+        threading.Thread(target=_fetch_tcp, args=(fileid, my_info), daemon=True).start()
+    elif (
+        config.FILE_SWARM
+        and not parts
+        and not group_id
+        and file_info.get("hash")
+        and file_info["filesize"] >= config.FILE_SWARM_MIN_SIZE
+    ):
+        # Peers holding the same content answer FILE_HAVE, see handle_file_have
+        send_file_query(fileid, file_info["hash"], file_info["filesize"], my_info)
+    return True
+
+
+def _fetch_tcp(fileid: str, my_info: Dict) -> None:
+    """
+    Pull an accepted file from its sender's TCP listener, into the same
+    partial file and progress state FILE_CHUNKs would fill. If the stream
+    breaks, FILE_RESUME asks for the rest over UDP.
+    """
+    file_info = config.incoming_files.get(fileid)
+    if not file_info:
+        return
+    complete = False
+    try:
+        with _ack_lock:
+            if "received" not in file_info:
+                _open_incoming(fileid, file_info, my_info, get_peer_address(file_info["from"]))
+        received = file_info["received"]
+        partial = file_info["file"]
+        chunk_size = file_info["chunk_size"]
+        index = received.cumulative
+        offset = index * chunk_size
+        # Read in whole chunks, but many at a time: chunk sizes are set by UDP datagrams
+        pieces = tcp_transfer.fetch(
+            (file_info["sender_addr"][0], file_info["tcp_port"]),
+            fileid,
+            offset,
+            file_info["filesize"] - offset,
+            max(1, _TCP_PIECE // chunk_size) * chunk_size,
+            my_info,
+        )
+        for data in pieces:
+            with _ack_lock:
+                if config.incoming_files.get(fileid) is not file_info:
+                    return  # dropped, or finished by FILE_CHUNKs after a resume
+                # Chunks that came as FILE_CHUNKs meanwhile are rewritten with the same bytes
+                partial.write(index, data)
+                first = index
+                new = 0
+                for start in range(0, len(data), chunk_size):
+                    if received.add(index):
+                        new += min(chunk_size, len(data) - start)
+                    index += 1
+                if new and file_info["hasher"]:
+                    file_info["hasher"].advance(
+                        received.cumulative, first, data, partial.read, index - first
+                    )
+                if new:
+                    file_info["meter"].update(file_info["meter"].done + new)
+                    now = time.monotonic()
+                    file_info["last_chunk_at"] = now
+                    complete = received.complete()
+                    if (
+                        not complete
+                        and now - file_info["checkpointed_at"] >= config.FILE_CHECKPOINT_INTERVAL
+                    ):
+                        file_info["checkpointed_at"] = now
+                        _save_incoming(fileid, file_info)
+            if complete:
+                break
+    except OSError as e:
+        with _ack_lock:
+            if config.incoming_files.get(fileid) is not file_info or "received" not in file_info:
+                return
+            if file_info["received"].complete():
+                return
+            ranges = file_info["received"].ranges(config.FILE_RESUME_MAX_RANGES)
+            _save_incoming(fileid, file_info)
+        _tcp_stats["fallbacks"] += 1
+        if config.verbose_mode:
+            print_verbose(f"TCP transfer of {fileid} failed ({e}); continuing over UDP")
+        send_file_resume(
+            fileid,
+            file_info["from"],
+            file_info["sender_addr"],
+            file_info.get("hash") or "",
+            ranges,
+            my_info,
+        )
+        return
+    if complete:
+        _tcp_stats["received"] += 1
+        _complete_download(fileid, file_info, [file_info["from"]], my_info)
+
+
+def _basis_signatures(file_info: Dict) -> tuple:
+    """(block size, signature parts) of the older revision a delta would build on"""
+    basis = file_info.get("delta_basis")
+    if not basis or file_info.get("group_id") or not file_info.get("hash"):
+        return 0, []
+    try:
+        block = delta.block_size(
+            os.path.getsize(basis), config.FILE_DELTA_BLOCK_MIN, config.FILE_DELTA_MAX_BLOCKS
+        )
+        signatures = delta.signatures(basis, block)
+    except OSError:
+        return 0, []
+    # One part per datagram, the size of a chunk's data
+    step = max(1, file_info["chunk_size"] // delta.SIGNATURE_SIZE) * delta.SIGNATURE_SIZE
+    return block, [signatures[i:i + step] for i in range(0, len(signatures), step)]
+
+
+def handle_file_delta(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """The sender will stream a delta against our older revision instead of the file"""
+    file_info = config.incoming_files.get(content["FILEID"])
+    if not file_info or file_info["from"] != content["FROM"] or not file_info.get("delta_basis"):
+        return
+    with _ack_lock:
+        if "received" in file_info or file_info.get("delta"):
+            return  # the whole file is already on its way, or this is a repeat
+        file_info["delta"] = {"basis": file_info["delta_basis"], "filesize": file_info["filesize"]}
+        file_info["filesize"] = int(content["DELTA_SIZE"])
+
+
+def _apply_delta(file_info: Dict) -> None:
+    """Rebuild a delta download from its basis; ValueError unless it is the offered file"""
+    partial = file_info["file"]
+    directory = os.path.dirname(os.path.abspath(file_info["filename"]))
+    fd, temp = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(file_info['filename'])}.", suffix=".part"
+    )
+    os.close(fd)
+    try:
+        algorithm = file_info["hash"].partition(":")[0]
+        digest = delta.apply_delta(file_info["delta"]["basis"], partial.temp_path, temp, algorithm)
+        if digest != file_info["hash"].lower():
+            _integrity_stats["hash_failures"] += 1
+            raise ValueError(f"rebuilt file hash {digest} does not match offered {file_info['hash']}")
+        os.replace(temp, file_info["filename"])
+    except BaseException:
+        os.unlink(temp)
+        raise
+    partial.discard()
+
+
+def _accept_whole(fileid: str, file_info: Dict, my_info: Dict) -> None:
+    """A delta didn't rebuild the offered file: forget it and accept the file itself"""
+    with _ack_lock:
+        if file_info.get("ack_timer"):
+            file_info["ack_timer"].cancel()
+        file_info["file"].discard()
+        file_info["filesize"] = file_info.pop("delta")["filesize"]
+        # No second delta, and no TCP: the sender closed its listener once the delta started
+        for key in ("delta_basis", "tcp_port", "file", "received", "hasher", "meter", "highest"):
+            file_info.pop(key, None)
+        file_info["accepted"] = False
+    checkpoint.remove(fileid, checkpoint.INCOMING)
+    # An accept without DELTA_PARTS tells the sender to drop the delta, see handle_file_accept
+    if not accept_incoming(fileid, my_info) and discard_incoming(fileid):
+        send_file_received(fileid, file_info["from"], my_info, "ERROR")
+
+
+def reject_incoming(fileid: str, my_info: Dict) -> bool:
+    """Decline an offered file, or stop a download, and tell its sender"""
+    file_info = config.incoming_files.get(fileid)
+    if file_info is None or not discard_incoming(fileid):
+        return False
+    send_file_reply(fileid, file_info["from"], my_info, "REJECT", group_id=file_info.get("group_id"))
+    return True
+
+
+def discard_incoming(fileid: str) -> bool:
+    """Forget an offered or partly received file and delete its temp file"""
+    with _ack_lock:
+        file_info = config.incoming_files.pop(fileid, None)
+        if file_info is None:
+            return False
+        if file_info.get("ack_timer"):
+            file_info["ack_timer"].cancel()
+        if file_info.get("swarm"):
+            file_info["swarm"].stop()
+    if "file" in file_info:
+        file_info["file"].discard()
+    checkpoint.remove(fileid, checkpoint.INCOMING)
+    return True
+
+
+def _save_incoming(fileid: str, file_info: Dict) -> None:
+    # Chunk data isn't fsynced first: a killed process loses nothing the page
+    # cache holds, and after a power cut the file hash catches stale blocks
+    checkpoint.save(
+        fileid,
+        checkpoint.INCOMING,
+        {
+            "fileid": fileid,
+            "from": file_info["from"],
+            "sender_addr": list(file_info["sender_addr"]),
+            "filename": file_info["filename"],
+            "filesize": file_info["filesize"],
+            "chunk_size": file_info["chunk_size"],
+            "total_chunks": file_info["received"].total,
+            "hash": file_info.get("hash"),
+            "delta": file_info.get("delta"),
+            "temp_path": file_info["file"].temp_path,
+            "bitmap": base64.b64encode(bytes(file_info["received"].bits)).decode("ascii"),
+        },
+    )
+
+
+def _watch_idle(fileid: str, my_info: Dict) -> None:
+    """Ask for a resume whenever a download has gone FILE_RESUME_IDLE without a chunk"""
+    file_info = config.incoming_files.get(fileid)
+    if not file_info or "received" not in file_info or file_info["received"].complete():
+        return
+    idle = time.monotonic() - file_info["last_chunk_at"]
+    if idle < config.FILE_RESUME_IDLE:
+        schedule(config.FILE_RESUME_IDLE - idle, lambda: _watch_idle(fileid, my_info))
+        return
+    with _ack_lock:
+        swarm = file_info.pop("swarm", None)
+        if swarm:
+            # Every source went quiet: fall back to the sender alone
+            swarm.stop()
+        ranges = file_info["received"].ranges(config.FILE_RESUME_MAX_RANGES)
+        # Lets a restarted sender skip what we have even if this node dies again
+        _save_incoming(fileid, file_info)
+    send_file_resume(
+        fileid,
+        file_info["from"],
+        file_info["sender_addr"],
+        file_info.get("hash") or "",
+        ranges,
+        my_info,
+    )
+    schedule(config.FILE_RESUME_IDLE, lambda: _watch_idle(fileid, my_info))
+
+
+def _watch_gaps(fileid: str, my_info: Dict) -> None:
+    """NACK the chunks a group download is missing, every GROUP_FILE_NACK_INTERVAL or so"""
+    file_info = config.incoming_files.get(fileid)
+    if not file_info or not file_info.get("group_id"):
+        return
+    sender = file_info["from"]
+    group_id = file_info["group_id"]
+    idle = time.monotonic() - file_info["last_chunk_at"]
+    if idle >= config.GROUP_FILE_MEMBER_TIMEOUT:
+        print_error(f"{sender} stopped sending {file_info['filename']}; dropped it")
+        discard_incoming(fileid)
+        send_file_received(fileid, sender, my_info, "ERROR", group_id)
+        return
+    with _ack_lock:
+        received = file_info.get("received")
+        if received and received.complete():
+            return
+        total = received.total if received else -(-file_info["filesize"] // file_info["chunk_size"])
+        # Chunks past the highest one seen may just not be sent yet, unless the stream went quiet
+        if idle >= 2 * config.GROUP_FILE_NACK_INTERVAL:
+            end = total
+        else:
+            end = file_info.get("highest", -1) + 1
+        if received:
+            ranges = received.gaps(end, config.FILE_RESUME_MAX_RANGES)
+        else:
+            ranges = f"0-{end - 1}" if end else ""
+    if ranges:
+        send_file_nack(fileid, sender, group_id, ranges, my_info)
+    # Jittered so the members of a group don't NACK in lockstep
+    delay = config.GROUP_FILE_NACK_INTERVAL * random.uniform(0.75, 1.25)
+    schedule(delay, lambda: _watch_gaps(fileid, my_info))
+
+
+def handle_file_have(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """Another peer holds the content of a download: pull part of it from them"""
+    fileid = content["FILEID"]
+    source = content["FROM"]
+    file_info = config.incoming_files.get(fileid)
+    if (
+        not file_info
+        or not file_info.get("accepted")
+        or file_info.get("group_id")
+        or not file_info.get("hash")
+        or content.get("HASH") != file_info["hash"]
+        or source == file_info["from"]
+    ):
+        return
+    with _ack_lock:
+        if config.incoming_files.get(fileid) is not file_info:
+            return
+        swarm = file_info.get("swarm")
+        start = swarm is None
+        if start:
+            if "received" not in file_info:
+                try:
+                    _open_incoming(fileid, file_info, my_info, get_peer_address(file_info["from"]))
+                except OSError as e:
+                    print_error(f"Failed to save file: {e}")
+                    return
+            if file_info["received"].complete():
+                return
+
+            def request(peer: str, seq: int, ranges: str) -> None:
+                send_file_request(
+                    fileid,
+                    peer,
+                    file_info,
+                    seq,
+                    ranges,
+                    my_info,
+                    on_give_up=lambda *_: swarm.drop(peer),
+                )
+
+            swarm = SwarmDownload(
+                file_info["received"], file_info["chunk_size"], file_info["filesize"], request
+            )
+            swarm.add_source(file_info["from"])
+            file_info["swarm"] = swarm
+        added = swarm.add_source(source)
+    if config.verbose_mode and added:
+        print_verbose(f"{source} also holds {file_info['filename']}; fetching from it too")
+    if start:
+        swarm.start()
+
+
+def handle_file_cancel(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """The sender won't continue this file (e.g. it can't resume it)"""
+    fileid = content["FILEID"]
+    file_info = config.incoming_files.get(fileid)
+    if not file_info:
+        return
+    swarm = file_info.get("swarm")
+    if file_info["from"] != content["FROM"]:
+        if swarm and swarm.has_source(content["FROM"]):
+            # One of the extra sources can't serve us; the others take its blocks
+            swarm.drop(content["FROM"])
+        return
+    print_error(
+        f"{content['FROM']} cancelled {file_info['filename']}: {content.get('REASON', '')}"
+    )
+    discard_incoming(fileid)
+    if config.pending_file_offer and config.pending_file_offer["fileid"] == fileid:
+        config.pending_file_offer = None
+
+
+def _download_peers(file_info: Dict) -> str:
+    swarm = file_info.get("swarm")
+    extra = len(swarm.sources()) - 1 if swarm else 0
+    return f"{file_info['from']} +{extra} peers" if extra > 0 else file_info["from"]
+
+
+def get_transfer_status() -> List[Dict]:
+    """Progress, rate and ETA of every upload and download still in progress"""
+    rows = []
+    for fileid, transfer in list(config.active_file_transfers.items()):
+        window = transfer.get("window")
+        meter = transfer.get("meter")
+        listener = transfer.get("tcp")
+        if window:
+            state = window.state
+        elif listener and listener.state in ("serving", "sent", "failed"):
+            state = f"tcp {listener.state}"
+        else:
+            state = "offered"
+        rows.append(
+            {
+                "direction": "up",
+                "fileid": fileid,
+                "peer": transfer["recipient"],
+                "filename": transfer["filepath"],
+                "state": state,
+                "done": meter.done if meter else 0,
+                "total": transfer["filesize"],
+                "rate": meter.rate() if meter else 0.0,
+                "eta": meter.eta() if meter else None,
+            }
+        )
+    for fileid, file_info in list(config.incoming_files.items()):
+        meter = file_info.get("meter")
+        rows.append(
+            {
+                "direction": "down",
+                "fileid": fileid,
+                "peer": _download_peers(file_info),
+                "filename": file_info["filename"],
+                "state": "receiving"
+                if meter
+                else "accepted" if file_info.get("accepted") else "offered",
+                "done": meter.done if meter else 0,
+                "total": file_info["filesize"],
+                "rate": meter.rate() if meter else 0.0,
+                "eta": meter.eta() if meter else None,
+            }
+        )
+    return rows
+
+
+def get_transfer_stats() -> Dict:
+    stats = {
+        **_integrity_stats,
+        **{f"delta_{key}": value for key, value in _delta_stats.items()},
+        **{f"tcp_{key}": value for key, value in _tcp_stats.items()},
+    }
+    windows = [
+        (fileid, transfer["window"].summary())
+        for fileid, transfer in list(config.active_file_transfers.items())
+        if "window" in transfer and transfer["window"].state == "sending"
+    ]
+    for fileid, summary in list(_history) + windows:
+        stats[f"{fileid} {summary['state']}"] = (
+            f"{summary['chunks']} chunks, {summary['throughput_kbps']} KB/s, "
+            f"{summary['retransmit_rate']:.1%} resent, {summary['elapsed']}s"
+        )
+    return stats
+
+
+register_source("file_transfer", get_transfer_stats)
@@ -1,15 +1,105 @@
 # network/group_manager.py
 import time
 from typing import Dict, List, Set
-from network.message_sender import send_unicast, send_ack
-from network.peer_registry import get_peer
+from network.broadcast import advertise_capability, send_broadcast, send_multicast
+from network.message_sender import send_ack
+from network.metrics import register_source
+from network.peer_registry import get_peer, get_peer_addresses, get_peer_list
+from network.reliable import send_reliable_many
+from network.socket_manager import (
+    group_multicast_address,
+    join_group_address,
+    leave_group_address,
+)
 from network.token_utils import generate_token
-from ui.utils import print_info, print_error, print_success
+from ui.utils import print_info, print_error, print_success, print_verbose
 import config
 import secrets
 
+# Members that joined the multicast address of their groups
+GROUP_MULTICAST_CAPABILITY = "GROUP_MULTICAST"
+
 # Local storage for group information
-_groups: Dict[str, Dict] = {}  # GROUP_ID -> {name, creator, members, last_updated}
+_groups: Dict[str, Dict] = {}  # GROUP_ID -> {name, creator, members, last_updated, joined}
+
+# GROUP_MESSAGEs sent by each transport
+_stats = {"unicast": 0, "multicast": 0, "broadcast": 0}
+
+def _not_acknowledged(message_id: str, member: str) -> None:
+    print_error(f"{member} did not acknowledge group message {message_id}")
+
+def _choose_transport(addresses: Dict[str, tuple]):
+    """
+    How one GROUP_MESSAGE reaches `addresses`: (transport, the members the
+    first copy goes to that way). A broadcast is one datagram per port but
+    every node on the LAN has to parse and drop it, so it only pays once
+    the group is most of the LAN; a multicast reaches just the members that
+    joined the group's address. Small groups get unicasts, which need no
+    one-to-many route and are no slower to send.
+    """
+    transport = config.GROUP_MESSAGE_TRANSPORT
+    if transport == "auto":
+        if len(addresses) < config.GROUP_FANOUT_MIN_MEMBERS:
+            return "unicast", addresses
+        coverage = len(addresses) / max(len(get_peer_list()), 1)
+        transport = "broadcast" if coverage >= config.GROUP_BROADCAST_MIN_COVERAGE else "multicast"
+    if transport != "multicast":
+        return transport, addresses
+    # Older nodes never join a group address; they get a unicast instead
+    joined = {
+        member: addr
+        for member, addr in addresses.items()
+        if GROUP_MULTICAST_CAPABILITY in (get_peer(member) or {}).get("capabilities", ())
+    }
+    if config.GROUP_MESSAGE_TRANSPORT == "auto" and len(joined) < config.GROUP_FANOUT_MIN_MEMBERS:
+        return "unicast", addresses
+    return "multicast", joined
+
+def _send_to_members(
+    message_id: str, message: str, members, sender_id: str, what: str, group_id: str = None
+) -> str:
+    """
+    Fan one message out to every member but the sender: encoded once and
+    each member ACKs the same MESSAGE_ID. With a group_id the first copy may
+    go out as one broadcast or multicast (see _choose_transport); otherwise,
+    and for every retry, it is unicast back to back on one socket. Returns
+    the transport used.
+    """
+    recipients = [member for member in members if member != sender_id]
+    addresses = get_peer_addresses(recipients)
+    for member in recipients:
+        if member not in addresses:
+            print_error(f"Could not find peer {member} to send group {what}")
+
+    transport, targets = _choose_transport(addresses) if group_id else ("unicast", addresses)
+    if transport == "unicast":
+        send_reliable_many(message_id, addresses, message, on_give_up=_not_acknowledged)
+        return transport
+
+    # One datagram per port the members listen on, usually just the default one
+    ports = sorted({addr[1] for addr in targets.values()})
+    if transport == "broadcast":
+        transmit = lambda data: send_broadcast(data, ports)
+    else:
+        address = group_multicast_address(group_id)
+        transmit = lambda data: send_multicast(data, address, ports)
+    send_reliable_many(
+        message_id, targets, message, on_give_up=_not_acknowledged, transmit=transmit
+    )
+    rest = {member: addr for member, addr in addresses.items() if member not in targets}
+    if rest:
+        send_reliable_many(message_id, rest, message, on_give_up=_not_acknowledged)
+    return transport
+
+def _track_multicast(group_id: str, my_id: str) -> None:
+    """Join the group's multicast address while we are a member, leave it after"""
+    group = _groups[group_id]
+    member = my_id in group["members"]
+    if member and not group.get("joined"):
+        group["joined"] = join_group_address(group_multicast_address(group_id))
+    elif not member and group.get("joined"):
+        leave_group_address(group_multicast_address(group_id))
+        group["joined"] = False
 
 def create_group(group_id: str, group_name: str, members: List[str], creator_info: Dict) -> bool:
     """Create a new group with the specified members"""
@@ -29,6 +119,7 @@ def create_group(group_id: str, group_name: str, members: List[str], creator_inf
         "members": set(members),
         "last_updated": time.time()
     }
+    _track_multicast(group_id, creator_id)
 
     # Generate and send GROUP_CREATE message to all members
     timestamp = int(time.time())
@@ -46,15 +137,7 @@ def create_group(group_id: str, group_name: str, members: List[str], creator_inf
         f"TOKEN: {token}\n\n"
     )
 
-    # Send to each member
-    for member in members:
-        if member == creator_id:
-            continue  # No need to send to self
-        peer = get_peer(member)
-        if peer:
-            send_unicast(message, (peer["ip"], peer["port"]))
-        else:
-            print_error(f"Could not find peer {member} to send group invite")
+    _send_to_members(message_id, message, members, creator_id, "invite")
 
     print_success(f"Group {group_name} created with ID {group_id}")
     return True
@@ -84,6 +167,7 @@ def update_group(group_id: str, add_members: List[str], remove_members: List[str
             current_members.remove(member)
 
     group["last_updated"] = time.time()
+    _track_multicast(group_id, updater_info["user_id"])
 
     # Generate and send GROUP_UPDATE message to all members
     timestamp = int(time.time())
@@ -102,14 +186,7 @@ def update_group(group_id: str, add_members: List[str], remove_members: List[str
     )
 
     # Send to all current members (including new ones)
-    for member in current_members:
-        if member == updater_info["user_id"]:
-            continue  # No need to send to self
-        peer = get_peer(member)
-        if peer:
-            send_unicast(message, (peer["ip"], peer["port"]))
-        else:
-            print_error(f"Could not find peer {member} to send group update")
+    _send_to_members(message_id, message, current_members, updater_info["user_id"], "update")
 
     print_success(f"Group {group_id} membership updated")
     return True
@@ -139,15 +216,12 @@ def send_group_message(group_id: str, content: str, sender_info: Dict) -> bool:
         f"TOKEN: {token}\n\n"
     )
 
-    # Send to each member except sender
-    for member in members:
-        if member == sender_info["user_id"]:
-            continue
-        peer = get_peer(member)
-        if peer:
-            send_unicast(message, (peer["ip"], peer["port"]))
-        else:
-            print_error(f"Could not find peer {member} to send group message")
+    transport = _send_to_members(
+        message_id, message, members, sender_info["user_id"], "message", group_id
+    )
+    _stats[transport] += 1
+    if config.verbose_mode:
+        print_verbose(f"GROUP_MESSAGE {message_id} to {len(members) - 1} members by {transport}")
 
     print_success(f"Message sent to group {group_id}")
     return True
@@ -174,12 +248,15 @@ def handle_group_create(content: Dict, addr: tuple, my_info: Dict) -> None:
     creator = content["FROM"]
 
     # Add to local group registry
+    joined = _groups.get(group_id, {}).get("joined", False)
     _groups[group_id] = {
         "name": group_name,
         "creator": creator,
         "members": set(members),
-        "last_updated": time.time()
+        "last_updated": time.time(),
+        "joined": joined,
     }
+    _track_multicast(group_id, my_info["user_id"])
 
     print_info(f"\nYou've been added to group '{group_name}' (ID: {group_id}) by {creator}")
     print_info(f"Members: {', '.join(members)}\n")
@@ -203,6 +280,7 @@ def handle_group_update(content: Dict, addr: tuple, my_info: Dict) -> None:
     updated_members = current_members.union(added) - set(removed)
     _groups[group_id]["members"] = updated_members
     _groups[group_id]["last_updated"] = time.time()
+    _track_multicast(group_id, my_info["user_id"])
 
     print_info(f"\nGroup '{_groups[group_id]['name']}' membership updated:")
     if added:
@@ -215,11 +293,23 @@ def handle_group_update(content: Dict, addr: tuple, my_info: Dict) -> None:
     if "MESSAGE_ID" in content:
         send_ack(content["MESSAGE_ID"], content["FROM"])
 
+def is_group_recipient(content: Dict, my_info: Dict) -> bool:
+    """
+    Whether a GROUP_MESSAGE is for a group that both we and its sender are
+    in. Broadcast ones reach every node, so this runs before anything else.
+    """
+    group = _groups.get(content.get("GROUP_ID"))
+    return (
+        group is not None
+        and content.get("FROM") in group["members"]
+        and my_info["user_id"] in group["members"]
+    )
+
 def handle_group_message(content: Dict, addr: tuple, my_info: Dict) -> None:
     """Handle incoming GROUP_MESSAGE"""
-    group_id = content["GROUP_ID"]
-    if group_id not in _groups or content["FROM"] not in _groups[group_id]["members"]:
+    if not is_group_recipient(content, my_info):
         return
+    group_id = content["GROUP_ID"]
 
     sender = content["FROM"]
     group_name = _groups[group_id]["name"]
@@ -229,4 +319,10 @@ def handle_group_message(content: Dict, addr: tuple, my_info: Dict) -> None:
 
     # Send ACK if message has MESSAGE_ID
     if "MESSAGE_ID" in content:
-        send_ack(content["MESSAGE_ID"], sender)
\ No newline at end of file
+        send_ack(content["MESSAGE_ID"], sender)
+
+def get_group_stats() -> Dict:
+    return {f"messages_{transport}": count for transport, count in _stats.items()}
+
+advertise_capability(GROUP_MULTICAST_CAPABILITY)
+register_source("groups", get_group_stats)
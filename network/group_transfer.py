@@ -0,0 +1,483 @@
+# network/group_transfer.py
+"""
+One file to every member of a group in a single stream. Chunks are broadcast
+(or multicast) once, tagged with GROUP_ID and FILEID; members NACK only the
+chunk ranges they missed, and a missing chunk is resent once per repair
+round however many members asked for it.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List
+
+import config
+from network.broadcast import broadcast_address, get_mime_type
+from network.file_transfer import DELIVERED, range_indices
+from network.group_manager import get_group_members
+from network.integrity import file_digest
+from network.message_sender import FileChunkSender, send_file_cancel
+from network.metrics import register_source
+from network.peer_registry import get_peer, get_peer_address
+from network.reliable import schedule, send_reliable
+from network.socket_manager import MULTICAST_GROUP
+from network.token_utils import generate_token
+from network.transfer_scheduler import RateMeter, get_scheduler
+from ui.utils import print_error, print_success, print_verbose
+
+
+class GroupUpload:
+    """
+    Sender state of one group transfer. Until started it collects answers to
+    the FILE_OFFER; then new chunks and repairs share a pacing budget of
+    `rate` bytes/s, fed through the transfer scheduler so FILE_RATE_LIMIT
+    still caps all uploads together. While some member NACKs more than
+    GROUP_FILE_LOSS_TARGET of the recently sent chunks the rate backs off,
+    otherwise it creeps back up. Loss is judged per member: members losing
+    different chunks at random does not add up to congestion.
+    """
+
+    def __init__(
+        self,
+        fileid: str,
+        group_id: str,
+        filepath: str,
+        members: set,
+        chunk_size: int,
+        digest: str,
+        sender_info: Dict,
+        clock: Callable = time.monotonic,
+    ):
+        self.fileid = fileid
+        self.group_id = group_id
+        self.filepath = filepath
+        self.filesize = os.path.getsize(filepath)
+        self.chunk_size = chunk_size
+        self.total = -(-self.filesize // chunk_size)
+        self.hash = digest
+        self.sender_info = sender_info
+        self.members = set(members)
+        self.pending = set(members)  # no answer to the offer yet
+        self.accepted = set()
+        self.finished: Dict[str, str] = {}  # member -> FILE_RECEIVED status
+        self.state = "offered"
+        self.rate = float(config.GROUP_FILE_RATE)
+        self.next_chunk = 0  # first chunk of the initial pass not yet queued
+        self.repairs = deque()
+        self.meter = RateMeter(self.filesize, clock)
+        self.stats = {"chunks_sent": 0, "repairs_sent": 0, "nacks": 0, "chunks_nacked": 0}
+        self.started_at = None
+        self.finished_at = None
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._chunks = None
+        self._timers = []
+        self._repairing = set()  # queued for repair and not yet sent
+        self._repaired_at: Dict[int, float] = {}
+        self._credit = 0.0
+        self._queued = 0  # chunks handed to the scheduler and not yet sent
+        self._ticked_at = 0.0
+        self._active_at = 0.0  # last chunk queued or NACK received
+        self._nacked: Dict[str, set] = {}  # member -> chunks NACKed since _adapt_from
+        self._adapt_from = 0
+        self._period_from = 0
+        self._period_at = 0.0
+
+    # --- answers to the offer ---
+
+    def on_answer(self, member: str, accepted: bool) -> None:
+        with self._lock:
+            if member not in self.members:
+                return
+            self.pending.discard(member)
+            first = accepted and not self.accepted
+            if accepted:
+                self.accepted.add(member)
+            else:
+                self.accepted.discard(member)
+            state = self.state
+            undecided = bool(self.pending)
+            nobody = not self.accepted
+            # Members that already had the file need nothing sent either
+            outcome = "complete" if self.finished else "rejected"
+        if state == "sending":
+            if nobody:
+                self.finish(outcome)
+            else:
+                self._chunks.set_targets(self._targets())
+        elif state == "offered":
+            if not undecided:
+                if nobody:
+                    self.finish(outcome)
+                else:
+                    self.start()
+            elif first:
+                # Don't hold the rest of the group hostage to one silent member
+                self._timers.append(schedule(config.GROUP_FILE_START_WAIT, self.start))
+
+    def expire(self) -> None:
+        """The offer timed out: start for whoever accepted, or give up"""
+        with self._lock:
+            if self.state != "offered":
+                return
+            silent = set(self.pending)
+            nobody = not self.accepted
+        for member in silent:
+            send_file_cancel(self.fileid, member, "EXPIRED", self.sender_info)
+        if nobody:
+            self.finish("expired")
+        else:
+            self.start()
+
+    # --- sending ---
+
+    def _targets(self) -> List[tuple]:
+        """One destination per port that an unfinished accepting member listens on"""
+        if config.GROUP_FILE_TRANSPORT == "multicast":
+            address = MULTICAST_GROUP
+        else:
+            address = broadcast_address()
+        ports = set()
+        for member in self.accepted - set(self.finished):
+            peer_addr = get_peer_address(member)
+            if peer_addr:
+                ports.add(peer_addr[1])
+        return [(address, port) for port in sorted(ports)]
+
+    def start(self) -> None:
+        with self._lock:
+            if self.state != "offered" or not self.accepted:
+                return
+            try:
+                self._chunks = FileChunkSender(
+                    self.fileid,
+                    self.sender_info,
+                    transfer={
+                        "group_id": self.group_id,
+                        "filepath": self.filepath,
+                        "chunk_size": self.chunk_size,
+                        "total_chunks": self.total,
+                    },
+                    targets=self._targets(),
+                )
+            except OSError as e:
+                print_error(f"Failed to start group transfer {self.fileid}: {e}")
+                self.state = "failed"
+            else:
+                self.state = "sending"
+                now = self._clock()
+                self.started_at = self._ticked_at = self._active_at = self._period_at = now
+        if self.state == "failed":
+            self.finish("failed")
+            return
+        get_scheduler().add_flow(self.fileid, self._transmit)
+        if config.verbose_mode:
+            print_verbose(
+                f"Sending {self.fileid} to {len(self.accepted)} members of {self.group_id}"
+            )
+        self._tick()
+
+    def _chunk_bytes(self, index: int) -> int:
+        return min(self.chunk_size, self.filesize - index * self.chunk_size)
+
+    def _tick(self) -> None:
+        scheduler = get_scheduler()
+        with self._lock:
+            if self.state != "sending":
+                return
+            now = self._clock()
+            tick_bytes = self.rate * config.TIMER_WHEEL_TICK
+            self._credit = min(
+                self._credit + (now - self._ticked_at) * self.rate,
+                max(2 * tick_bytes, self.chunk_size),
+            )
+            self._ticked_at = now
+            # Enough queued to cover two ticks; the rest waits so repairs can jump ahead
+            limit = max(4, int(2 * tick_bytes / self.chunk_size))
+            while self._credit > 0 and self._queued < limit:
+                if self.repairs:
+                    index = self.repairs.popleft()
+                    repair = True
+                elif self.next_chunk < self.total:
+                    index = self.next_chunk
+                    self.next_chunk += 1
+                    repair = False
+                else:
+                    break
+                size = self._chunk_bytes(index)
+                self._credit -= size
+                self._queued += 1
+                self._active_at = now
+                scheduler.enqueue(self.fileid, (index, repair), size)
+            self.meter.update(min(self.filesize, self.next_chunk * self.chunk_size))
+            if now - self._period_at >= 1.0:
+                self._adapt(now)
+            outcome = self._outcome(now)
+        if outcome:
+            self.finish(outcome)
+        else:
+            schedule(config.TIMER_WHEEL_TICK, self._tick)
+
+    def _adapt(self, now: float) -> None:
+        # NACKs lag the chunks they report, so loss is judged over two periods
+        sent = self.next_chunk - self._adapt_from
+        if sent:
+            lost = max(
+                (sum(1 for index in nacked if index >= self._adapt_from) for nacked in self._nacked.values()),
+                default=0,
+            ) / sent
+            if lost > config.GROUP_FILE_LOSS_TARGET:
+                self.rate = max(config.GROUP_FILE_RATE_MIN, self.rate * 0.7)
+            else:
+                self.rate = min(config.GROUP_FILE_RATE_MAX, self.rate + config.GROUP_FILE_RATE_MIN)
+        self._adapt_from = self._period_from
+        self._period_from = self.next_chunk
+        self._period_at = now
+        self._nacked = {
+            member: {index for index in nacked if index >= self._adapt_from}
+            for member, nacked in self._nacked.items()
+        }
+
+    def _outcome(self, now: float):
+        if not self.accepted:
+            return "rejected"
+        if all(member in self.finished for member in self.accepted):
+            return "complete"
+        idle = (
+            self.next_chunk == self.total
+            and not self.repairs
+            and not self._queued
+            and now - self._active_at >= config.GROUP_FILE_LINGER
+        )
+        return "partial" if idle else None
+
+    def _transmit(self, item) -> bool:
+        index, repair = item
+        with self._lock:
+            self._queued -= 1
+            chunks = self._chunks
+        sent = chunks.send(index)
+        with self._lock:
+            if repair:
+                self._repairing.discard(index)
+                self._repaired_at[index] = self._clock()
+            if sent:
+                self.stats["repairs_sent" if repair else "chunks_sent"] += 1
+        return sent
+
+    # --- feedback from members ---
+
+    def on_nack(self, member: str, ranges: str) -> None:
+        with self._lock:
+            if member not in self.accepted or self.state != "sending":
+                return
+            try:
+                wanted = range_indices(ranges, self.total)
+            except ValueError:
+                return
+            now = self._clock()
+            self.stats["nacks"] += 1
+            self._active_at = now
+            nacked = self._nacked.setdefault(member, set())
+            for index in wanted:
+                if index >= self.next_chunk:
+                    break  # not sent yet; the initial pass will get there
+                nacked.add(index)
+                if index in self._repairing:
+                    continue  # another member already asked for it
+                if now - self._repaired_at.get(index, -1e9) < config.GROUP_FILE_NACK_INTERVAL:
+                    continue  # sent again just now; this NACK predates it
+                self._repairing.add(index)
+                self.repairs.append(index)
+                self.stats["chunks_nacked"] += 1
+
+    def on_received(self, member: str, status: str) -> None:
+        with self._lock:
+            had = status == "HAVE" and member in self.pending
+            if member not in self.accepted and not had:
+                return
+            self.finished[member] = status
+            chunks = self._chunks
+        if had:
+            # Answered the offer with its own copy instead of FILE_ACCEPT
+            self.on_answer(member, False)
+            return
+        if status not in DELIVERED:
+            print_error(f"{member} could not receive {os.path.basename(self.filepath)}: {status}")
+        if chunks:
+            chunks.set_targets(self._targets())
+
+    def finish(self, state: str) -> None:
+        with self._lock:
+            if self.finished_at is not None:
+                return
+            self.state = state
+            self.finished_at = self._clock()
+            chunks = self._chunks
+            timers = list(self._timers)
+        for timer in timers:
+            timer.cancel()
+        get_scheduler().remove_flow(self.fileid)
+        if chunks:
+            chunks.close()
+        _uploads.pop(self.fileid, None)
+        _history.append((self.fileid, self.summary()))
+
+        filename = os.path.basename(self.filepath)
+        complete = [m for m, status in self.finished.items() if status in DELIVERED]
+        if state in ("complete", "partial"):
+            missing = sorted(self.accepted - set(complete))
+            if missing:
+                print_error(f"{filename} did not reach {', '.join(missing)} in {self.group_id}")
+            if complete:
+                print_success(f"Sent {filename} to {len(complete)} members of {self.group_id}")
+        else:
+            print_error(f"Group transfer of {filename} to {self.group_id} {state}")
+
+    def summary(self) -> Dict:
+        end = self.finished_at if self.finished_at is not None else self._clock()
+        elapsed = end - self.started_at if self.started_at is not None else 0.0
+        sent = self.stats["chunks_sent"] + self.stats["repairs_sent"]
+        return {
+            "state": self.state,
+            "members": f"{len(self.finished)}/{len(self.accepted)}",
+            "chunks": self.total,
+            "chunk_size": self.chunk_size,
+            "sent": sent,
+            "repair_rate": self.stats["repairs_sent"] / sent if sent else 0.0,
+            "rate_kbps": round(self.rate / 1024),
+            "elapsed": round(elapsed, 3),
+            **self.stats,
+        }
+
+
+_uploads: Dict[str, GroupUpload] = {}
+_history = deque(maxlen=config.FILE_HISTORY)
+
+
+def send_group_file(group_id: str, filepath: str, description: str, sender_info: Dict) -> bool:
+    """Offer a file to every member of a group, to be sent once to all who accept"""
+    me = sender_info["user_id"]
+    members = get_group_members(group_id)
+    if me not in members:
+        print_error(f"Group {group_id} not found or you're not a member")
+        return False
+    members = set(members) - {me}
+    if not members:
+        print_error(f"Group {group_id} has no other members")
+        return False
+    if not os.path.exists(filepath):
+        print_error(f"File not found: {filepath}")
+        return False
+    try:
+        digest = file_digest(filepath)
+    except OSError as e:
+        print_error(f"Failed to read {filepath}: {e}")
+        return False
+
+    # Every member has to take the same chunks, so the oldest peer decides
+    peers = [get_peer(member) for member in members]
+    if all(peer and peer.get("max_datagram") for peer in peers):
+        chunk_size = config.GROUP_FILE_CHUNK_SIZE
+    else:
+        chunk_size = config.FILE_LEGACY_CHUNK_SIZE
+
+    fileid = secrets.token_hex(4)
+    upload = GroupUpload(fileid, group_id, filepath, members, chunk_size, digest, sender_info)
+    message_id = secrets.token_hex(4)
+    message = (
+        "TYPE: FILE_OFFER\n"
+        f"FROM: {me}\n"
+        f"GROUP_ID: {group_id}\n"
+        f"FILENAME: {os.path.basename(filepath)}\n"
+        f"FILESIZE: {upload.filesize}\n"
+        f"FILETYPE: {get_mime_type(filepath)}\n"
+        f"FILEID: {fileid}\n"
+        f"DESCRIPTION: {description}\n"
+        f"CHUNK_SIZE: {chunk_size}\n"
+        f"HASH: {digest}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"MESSAGE_ID: {message_id}\n"
+        f"TOKEN: {generate_token(me, 'file')}\n\n"
+    )
+
+    _uploads[fileid] = upload
+    upload._timers.append(schedule(config.FILE_OFFER_TIMEOUT, upload.expire))
+    for member in members:
+        addr = get_peer_address(member)
+        # Every member ACKs the same MESSAGE_ID, as with other group messages
+        if not addr or not send_reliable(
+            message_id,
+            member,
+            message,
+            addr,
+            on_give_up=lambda mid, who: upload.on_answer(who, False),
+        ):
+            upload.on_answer(member, False)
+    return True
+
+
+def _find(content: Dict):
+    upload = _uploads.get(content["FILEID"])
+    if upload and upload.group_id == content.get("GROUP_ID"):
+        return upload
+    return None
+
+
+def handle_group_file_answer(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """FILE_ACCEPT or FILE_REJECT from a member, for a file offered to its group"""
+    upload = _find(content)
+    accepted = content["TYPE"] == "FILE_ACCEPT"
+    if upload is None:
+        if accepted:
+            send_file_cancel(content["FILEID"], content["FROM"], "UNKNOWN", my_info)
+        return
+    upload.on_answer(content["FROM"], accepted)
+
+
+def handle_file_nack(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """A member lists the chunk ranges of a group transfer it is missing"""
+    upload = _find(content)
+    if upload:
+        upload.on_nack(content["FROM"], content.get("RANGES", ""))
+
+
+def handle_group_file_received(content: Dict, addr: tuple, my_info: Dict) -> None:
+    upload = _find(content)
+    if upload:
+        upload.on_received(content["FROM"], content["STATUS"])
+
+
+def get_group_upload_status() -> List[Dict]:
+    """Rows for `file status`, in the shape of get_transfer_status()"""
+    rows = []
+    for fileid, upload in list(_uploads.items()):
+        rows.append(
+            {
+                "direction": "up",
+                "fileid": fileid,
+                "peer": f"group {upload.group_id} ({len(upload.accepted)})",
+                "filename": upload.filepath,
+                "state": upload.state,
+                "done": upload.meter.done,
+                "total": upload.filesize,
+                "rate": upload.meter.rate(),
+                "eta": upload.meter.eta(),
+            }
+        )
+    return rows
+
+
+def get_group_transfer_stats() -> Dict:
+    stats = {}
+    uploads = [(fileid, upload.summary()) for fileid, upload in list(_uploads.items())]
+    for fileid, summary in list(_history) + uploads:
+        stats[f"{fileid} {summary['state']}"] = (
+            f"{summary['members']} members, {summary['sent']} chunks sent for "
+            f"{summary['chunks']}, {summary['repair_rate']:.1%} repairs, {summary['elapsed']}s"
+        )
+    return stats
+
+
+register_source("group_transfer", get_group_transfer_stats)
@@ -0,0 +1,71 @@
+# network/integrity.py
+import hashlib
+import os
+import threading
+import zlib
+from typing import Dict
+
+HASH_ALGORITHM = "sha256"
+_READ_BLOCK = 1 << 20
+
+# (path, size, mtime) -> digest, so re-offering an unchanged file is free
+_digests: Dict[tuple, str] = {}
+_digests_lock = threading.Lock()
+
+
+def chunk_crc(data) -> str:
+    """CRC32 of one chunk as sent in FILE_CHUNK's CRC32 field"""
+    return f"{zlib.crc32(data) & 0xFFFFFFFF:08x}"
+
+
+def file_digest(path: str) -> str:
+    """'sha256:<hex>' of a whole file, as announced in FILE_OFFER's HASH field"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        if key in _digests:
+            return _digests[key]
+    hasher = hashlib.new(HASH_ALGORITHM)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_READ_BLOCK), b""):
+            hasher.update(block)
+    digest = f"{HASH_ALGORITHM}:{hasher.hexdigest()}"
+    with _digests_lock:
+        _digests[key] = digest
+    return digest
+
+
+class PrefixHasher:
+    """
+    Hashes a download as its contiguous prefix grows, so the digest is ready
+    the moment the last chunk lands. Chunks that arrive in order are hashed
+    from the datagram; ones that filled a gap are read back from the partial
+    file, which the page cache still holds.
+    """
+
+    def __init__(self, expected: str):
+        algorithm, _, self.expected = expected.partition(":")
+        if not self.expected:
+            algorithm, self.expected = HASH_ALGORITHM, expected
+        self._hasher = hashlib.new(algorithm)
+        self.algorithm = algorithm
+        self.chunks = 0  # chunks below this are hashed
+
+    def advance(self, cumulative: int, index: int, data, read_chunk, count: int = 1) -> None:
+        """
+        Hash every chunk below `cumulative`; `data` holds the `count` chunks
+        from `index` on, just received
+        """
+        while self.chunks < cumulative:
+            if self.chunks == index and index + count <= cumulative:
+                self._hasher.update(data)
+                self.chunks += count
+                continue
+            self._hasher.update(read_chunk(self.chunks))
+            self.chunks += 1
+
+    def matches(self) -> bool:
+        return self._hasher.hexdigest() == self.expected.lower()
+
+    def digest(self) -> str:
+        return f"{self.algorithm}:{self._hasher.hexdigest()}"
@@ -0,0 +1,143 @@
+# network/liveness.py
+import random
+import threading
+import time
+from typing import Callable, Dict, List
+
+import config
+from network.broadcast import send_ping
+from network.metrics import register_source
+from network.peer_registry import get_peer_list, remove_peer
+from ui.utils import print_verbose
+
+ALIVE = "alive"
+SUSPECT = "suspect"
+DEAD = "dead"
+
+
+def heartbeat_interval(peer_count: int) -> float:
+    """
+    Seconds between our PINGs. Every node uses the same rule, so the LAN as
+    a whole sends about HEARTBEAT_LAN_RATE PINGs per second whatever its size.
+    """
+    interval = (peer_count + 1) / config.HEARTBEAT_LAN_RATE
+    return min(
+        config.HEARTBEAT_MAX_INTERVAL, max(config.HEARTBEAT_MIN_INTERVAL, interval)
+    )
+
+
+class LivenessMonitor:
+    """Tracks alive -> suspect -> dead from the time since a peer was last heard"""
+
+    def __init__(self, clock: Callable = time.time):
+        self._clock = clock
+        self._states: Dict[str, str] = {}
+        self._listeners: List[Callable] = []
+        self._lock = threading.Lock()
+        self.transitions = 0
+
+    def subscribe(self, listener: Callable) -> None:
+        """Call listener(peer, old_state, new_state) on every transition"""
+        self._listeners.append(listener)
+
+    def get_state(self, user_id: str) -> str:
+        return self._states.get(user_id, ALIVE)
+
+    def forget(self, user_id: str) -> None:
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def sweep(self, peers: List[Dict]) -> List[Dict]:
+        """Re-evaluate every peer, notify listeners and return the dead ones"""
+        now = self._clock()
+        interval = heartbeat_interval(len(peers))
+        suspect_after = interval * config.HEARTBEAT_SUSPECT_MISSES
+        dead_after = interval * config.HEARTBEAT_DEAD_MISSES
+
+        changed = []
+        dead = []
+        with self._lock:
+            for peer in peers:
+                silent = now - peer["last_seen"]
+                if silent < suspect_after:
+                    state = ALIVE
+                elif silent < dead_after:
+                    state = SUSPECT
+                else:
+                    state = DEAD
+                    dead.append(peer)
+
+                old = self._states.get(peer["user_id"], ALIVE)
+                if state != old:
+                    self._states[peer["user_id"]] = state
+                    self.transitions += 1
+                    changed.append((peer, old, state))
+
+        for peer, old, state in changed:
+            for listener in self._listeners:
+                listener(peer, old, state)
+        return dead
+
+    def counts(self, peers: List[Dict]) -> Dict[str, int]:
+        result = {ALIVE: 0, SUSPECT: 0, DEAD: 0}
+        for peer in peers:
+            result[self.get_state(peer["user_id"])] += 1
+        return result
+
+
+_monitor = LivenessMonitor()
+_heartbeat = {"sent": 0}
+
+
+def on_peer_state(listener: Callable) -> None:
+    """Subscribe to peer transitions: listener(peer, old_state, new_state)"""
+    _monitor.subscribe(listener)
+
+
+def get_peer_state(user_id: str) -> str:
+    return _monitor.get_state(user_id)
+
+
+def _log_transition(peer: Dict, old: str, new: str) -> None:
+    if config.verbose_mode:
+        print_verbose(f"Peer {peer['user_id']} is now {new} (was {old})")
+
+
+def _heartbeat_loop(my_info: Dict) -> None:
+    peers = get_peer_list(exclude_user_id=my_info["user_id"])
+    next_ping = time.time() + heartbeat_interval(len(peers))
+
+    while True:
+        now = time.time()
+        peers = get_peer_list(exclude_user_id=my_info["user_id"])
+
+        if now >= next_ping:
+            send_ping(my_info, probe=config.BROADCAST_PROBE_BATCH)
+            _heartbeat["sent"] += 1
+            jitter = random.uniform(-config.HEARTBEAT_JITTER, config.HEARTBEAT_JITTER)
+            next_ping = now + heartbeat_interval(len(peers)) * (1 + jitter)
+
+        for peer in _monitor.sweep(peers):
+            remove_peer(peer["user_id"])
+            _monitor.forget(peer["user_id"])
+
+        time.sleep(min(config.LIVENESS_SWEEP_INTERVAL, max(0.0, next_ping - now)))
+
+
+def start_heartbeat(my_info: Dict) -> None:
+    """Send adaptive heartbeats and track peer liveness on a background thread"""
+    threading.Thread(target=_heartbeat_loop, args=(my_info,), daemon=True).start()
+
+
+def get_liveness_stats() -> Dict:
+    peers = get_peer_list()
+    return {
+        "heartbeat_interval": heartbeat_interval(len(peers)),
+        "heartbeats_sent": _heartbeat["sent"],
+        "transitions": _monitor.transitions,
+        **_monitor.counts(peers),
+    }
+
+
+on_peer_state(_log_transition)
+register_source("liveness", get_liveness_stats)
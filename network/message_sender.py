@@ -1,7 +1,10 @@
 # network/message_sender.py
 import os
 from network.peer_registry import get_peer_list, get_peer
-from network.broadcast import send_broadcast, get_mime_type
+from network.broadcast import my_info, send_broadcast, get_mime_type
+from network.integrity import chunk_crc, file_digest
+from network.reliable import schedule, send_reliable
+from network.tcp_transfer import FileListener
 from network.token_utils import generate_token
 import socket
 import config
@@ -9,15 +12,19 @@ from typing import Dict
 import time
 import secrets
 import base64
+import binascii
+import mmap
+import threading
 from ui.utils import print_error, print_verbose
 
 DEFAULT_TTL = 3600  # 1 hour default TTL per RFC
 
 
 def send_unicast(message, recipient_addr):
+    data = message if isinstance(message, bytes) else message.encode("utf-8")
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.sendto(message.encode("utf-8"), recipient_addr)
+            sock.sendto(data, recipient_addr)
         return True
     except Exception as e:
         print_error(f"Failed to send message: {e}")
@@ -150,7 +157,10 @@ def send_unfollow(user_id_to_unfollow, sender_info):
 
 
 def send_ack(message_id: str, recipient_user_id: str):
-    config.received_acks.add(message_id)
+    # Remembered so a retransmission of this message is only re-ACKed
+    config.received_acks[message_id] = None
+    if len(config.received_acks) > config.RECEIVED_ACKS_MAX:
+        del config.received_acks[next(iter(config.received_acks))]
     peer = get_peer(recipient_user_id)
     if not peer:
         try:
@@ -175,6 +185,7 @@ def send_ack(message_id: str, recipient_user_id: str):
 
     ack_message = (
         "TYPE: ACK\n"
+        f"FROM: {my_info['user_id']}\n"
         f"MESSAGE_ID: {message_id}\n"
         "STATUS: RECEIVED\n\n"
     )
@@ -227,6 +238,29 @@ def send_like(post_timestamp: int, sender_info: Dict, action: str = "LIKE") -> b
     return True
 
 
+def chunk_size_for(payload: int, header_size: int) -> int:
+    """Largest chunk whose base64 DATA plus headers fits in `payload` bytes"""
+    return max(config.FILE_CHUNK_MIN, (payload - header_size) // 4 * 3)
+
+
+def _chunk_header_size(sender_id: str, recipient_id: str, fileid: str, filesize: int) -> int:
+    # Worst case: index, total and size fields as wide as the file size
+    digits = len(str(filesize))
+    token = generate_token(sender_id, "file")
+    return len(
+        "TYPE: FILE_CHUNK\n"
+        f"FROM: {sender_id}\n"
+        f"TO: {recipient_id}\n"
+        f"FILEID: {fileid}\n"
+        f"CHUNK_INDEX: {'9' * digits}\n"
+        f"TOTAL_CHUNKS: {'9' * digits}\n"
+        f"CHUNK_SIZE: {'9' * digits}\n"
+        f"CRC32: {chunk_crc(b'')}\n"
+        f"TOKEN: {token}\n"
+        "DATA: \n\n"
+    )
+
+
 def send_file_offer(
     recipient_id: str, filepath: str, description: str, sender_info: Dict
 ) -> bool:
@@ -240,13 +274,65 @@ def send_file_offer(
         print_error(f"Recipient {recipient_id} not found")
         return False
 
+    try:
+        stat = os.stat(filepath)
+        digest = file_digest(filepath)
+    except OSError as e:
+        print_error(f"Failed to read {filepath}: {e}")
+        return False
+    # What a resume checks the file against instead of hashing it again
+    file_stat = [stat.st_size, stat.st_mtime_ns]
+
+    fileid = secrets.token_hex(4)
+    if not peer.get("max_datagram"):
+        # Peer predates MAX_DATAGRAM: keep the chunk size every node reads
+        return _send_file_offer(
+            peer,
+            fileid,
+            filepath,
+            description,
+            sender_info,
+            config.FILE_LEGACY_CHUNK_SIZE,
+            digest,
+            file_stat,
+        )
+
+    def offer(payload: int) -> None:
+        header_size = _chunk_header_size(
+            sender_info["user_id"], recipient_id, fileid, os.path.getsize(filepath)
+        )
+        chunk_size = min(config.FILE_CHUNK_MAX, chunk_size_for(payload, header_size))
+        _send_file_offer(
+            peer, fileid, filepath, description, sender_info, chunk_size, digest, file_stat
+        )
+
+    # Imported here: pmtu builds on the registry and timers this module uses
+    from network.pmtu import probe_path
+
+    probe_path(recipient_id, sender_info, offer)
+    return True
+
+
+def _send_file_offer(
+    peer: Dict,
+    fileid: str,
+    filepath: str,
+    description: str,
+    sender_info: Dict,
+    chunk_size: int,
+    digest: str,
+    file_stat: list = None,
+) -> bool:
+    recipient_id = peer["user_id"]
+    listener = None
     try:
         filename = os.path.basename(filepath)
         filesize = os.path.getsize(filepath)
         filetype = get_mime_type(filepath)
-        fileid = secrets.token_hex(4)
+        message_id = secrets.token_hex(4)
         timestamp = int(time.time())
         token = generate_token(sender_info["user_id"], "file")
+        listener = _tcp_listener(fileid, filesize)
 
         message = (
             "TYPE: FILE_OFFER\n"
@@ -257,111 +343,505 @@ def send_file_offer(
             f"FILETYPE: {filetype}\n"
             f"FILEID: {fileid}\n"
             f"DESCRIPTION: {description}\n"
-            f"TIMESTAMP: {timestamp}\n"
+            f"CHUNK_SIZE: {chunk_size}\n"
+            f"HASH: {digest}\n"
+            + ("DELTA: 1\n" if config.FILE_DELTA and filesize >= config.FILE_DELTA_MIN_SIZE else "")
+            + (f"TCP_PORT: {listener.port}\n" if listener else "")
+            + f"TIMESTAMP: {timestamp}\n"
+            f"MESSAGE_ID: {message_id}\n"
             f"TOKEN: {token}\n\n"
         )
 
-        # Parse port from user_id (canonical)
-        try:
-            _, address = peer["user_id"].split("@")
-            _, port = address.split(":")
-            peer_port = int(port)
-        except Exception:
-            peer_port = peer["port"]
-
-        peer_ip = peer["ip"]
+        peer_ip, peer_port = _peer_address(peer)
 
         if config.verbose_mode:
             print_verbose(
                 f"Sending FILE_OFFER to {peer_ip}:{peer_port}\n"
                 f" - File: {filename} ({filesize} bytes)\n"
                 f" - ID: {fileid}\n"
+                f" - Chunk size: {chunk_size}\n"
             )
 
-        if send_unicast(message, (peer_ip, peer_port)):
-            # Store file info for chunking
-            config.active_file_transfers[fileid] = {
-                "filepath": filepath,
-                "recipient": recipient_id,
-                "chunk_size": 1024,  # 1KB chunks
-                "total_chunks": (filesize // 1024) + (1 if filesize % 1024 else 0),
-                "next_chunk": 0,
-                "sender_info": sender_info,
-            }
+        # Store file info for chunking before FILE_ACCEPT can start the transfer
+        transfer = config.active_file_transfers[fileid] = {
+            "filepath": filepath,
+            "recipient": recipient_id,
+            "chunk_size": chunk_size,
+            "total_chunks": (filesize // chunk_size) + (1 if filesize % chunk_size else 0),
+            "filesize": filesize,
+            "next_chunk": 0,
+            "sender_info": sender_info,
+            "hash": digest,
+            "file_stat": file_stat,
+            "tcp": listener,
+        }
+        # Chunks only flow once the recipient sends FILE_ACCEPT. Armed before the
+        # offer goes out: an answer (e.g. HAVE) can settle it before send returns
+        transfer["offer_timer"] = schedule(
+            config.FILE_OFFER_TIMEOUT,
+            lambda: _withdraw_offer(
+                fileid,
+                f"Offer of {filename} to {recipient_id} expired unanswered",
+                cancel=True,
+            ),
+        )
+        if send_reliable(
+            message_id,
+            recipient_id,
+            message,
+            (peer_ip, peer_port),
+            on_give_up=lambda *_: _withdraw_offer(
+                fileid, f"{recipient_id} did not answer the offer for {filename}"
+            ),
+        ):
             return True
+        transfer["offer_timer"].cancel()
+        if config.active_file_transfers.get(fileid) is transfer:
+            del config.active_file_transfers[fileid]
+        if listener:
+            listener.close()
         return False
 
     except Exception as e:
         print_error(f"Failed to send file offer: {e}")
+        if listener:
+            listener.close()
         return False
 
 
-def send_file_chunk(fileid: str, chunk_index: int, sender_info: Dict) -> bool:
-    """Send a single file chunk"""
-    if fileid not in config.active_file_transfers:
-        print_error(f"No active transfer for file ID {fileid}")
-        return False
+def _tcp_listener(fileid: str, filesize: int):
+    """A TCP listener the receiver of a large enough file can pull it from, or None"""
+    if not config.FILE_TCP or filesize < config.FILE_TCP_MIN_SIZE:
+        return None
+    # Imported here: file_transfer builds on this module
+    from network.file_transfer import serve_tcp
+
+    try:
+        return FileListener(lambda conn, addr, request: serve_tcp(fileid, conn, addr, request))
+    except OSError as e:
+        if config.verbose_mode:
+            print_verbose(f"No TCP listener for {fileid}, sending over UDP only: {e}")
+        return None
 
-    transfer = config.active_file_transfers[fileid]
-    filepath = transfer["filepath"]
-    recipient_id = transfer["recipient"]
-    chunk_size = transfer["chunk_size"]
-    total_chunks = transfer["total_chunks"]
 
+def _peer_address(peer: Dict) -> tuple:
+    # Parse port from user_id (canonical)
+    try:
+        _, address = peer["user_id"].split("@")
+        _, port = address.split(":")
+        return peer["ip"], int(port)
+    except Exception:
+        return peer["ip"], peer["port"]
+
+
+class FileChunkSender:
+    """
+    Sends the chunks of one outgoing file. The file is memory-mapped once,
+    chunks are encoded straight from the mapping, and the token, headers,
+    socket and destination are set up once per transfer instead of per chunk.
+
+    Given a group_id and targets, each chunk carries GROUP_ID instead of TO
+    and goes to every (broadcast or multicast address, port) in targets.
+    """
+
+    def __init__(
+        self, fileid: str, sender_info: Dict, transfer: Dict = None, targets: list = None
+    ):
+        transfer = transfer or config.active_file_transfers[fileid]
+        self.fileid = fileid
+        self.chunk_size = transfer["chunk_size"]
+        self.total_chunks = transfer["total_chunks"]
+        if transfer.get("group_id"):
+            self.targets = list(targets or [])
+            destination = f"GROUP_ID: {transfer['group_id']}\n"
+        else:
+            peer = get_peer(transfer["recipient"])
+            if not peer:
+                raise LookupError(f"Recipient {transfer['recipient']} not found")
+            self.targets = [_peer_address(peer)]
+            destination = f"TO: {transfer['recipient']}\n"
+        self._user_id = sender_info["user_id"]
+        self._token = None
+        self._token_refresh = 0.0
+        self._prefix = (
+            "TYPE: FILE_CHUNK\n"
+            f"FROM: {self._user_id}\n"
+            f"{destination}"
+            f"FILEID: {fileid}\n"
+        ).encode("utf-8")
+        self._lock = threading.Lock()
+
+        # A delta transfer sends its delta stream instead of the file itself
+        self._file = open(transfer.get("stream") or transfer["filepath"], "rb")
+        self.filesize = os.fstat(self._file.fileno()).st_size
+        self._map = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.filesize
+            else None
+        )
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if transfer.get("group_id"):
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def set_targets(self, targets: list) -> None:
+        """Change where a group transfer's chunks go, e.g. when a member joins late"""
+        with self._lock:
+            self.targets = list(targets)
+
+    def _current_token(self) -> str:
+        now = time.time()
+        if self._token is None or now >= self._token_refresh:
+            self._token = generate_token(self._user_id, "file")
+            # Reissue at half-life so a long transfer never sends a stale token
+            self._token_refresh = now + config.TOKEN_TTL.get("file", 3600) / 2
+        return self._token
+
+    def send(self, chunk_index: int) -> bool:
+        with self._lock:
+            if self._sock is None:
+                return False
+            start = chunk_index * self.chunk_size
+            end = min(start + self.chunk_size, self.filesize)
+            if start >= end:
+                return False
+            with memoryview(self._map) as view:
+                chunk = view[start:end]
+                encoded = binascii.b2a_base64(chunk, newline=False)
+                crc = chunk_crc(chunk)
+                chunk.release()
+            headers = (
+                f"CHUNK_INDEX: {chunk_index}\n"
+                f"TOTAL_CHUNKS: {self.total_chunks}\n"
+                f"CHUNK_SIZE: {end - start}\n"
+                f"CRC32: {crc}\n"
+                f"TOKEN: {self._current_token()}\n"
+                "DATA: "
+            ).encode("utf-8")
+
+            if config.verbose_mode:
+                print_verbose(
+                    f"Sending FILE_CHUNK {chunk_index+1}/{self.total_chunks} for {self.fileid} "
+                    f"to {', '.join(f'{ip}:{port}' for ip, port in self.targets)}"
+                )
+            parts = [self._prefix, headers, encoded, b"\n\n"]
+            for addr in self.targets:
+                if hasattr(self._sock, "sendmsg"):
+                    # Gathered by the kernel: the encoded chunk is never copied again
+                    self._sock.sendmsg(parts, (), 0, addr)
+                else:
+                    self._sock.sendto(b"".join(parts), addr)
+            return bool(self.targets)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._sock is None:
+                return
+            self._sock.close()
+            self._sock = None
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+
+
+def _withdraw_offer(fileid: str, reason: str, cancel: bool = False) -> None:
+    """Free an offer that was never accepted; a transfer already under way is left alone"""
+    transfer = config.active_file_transfers.get(fileid)
+    if not transfer or "window" in transfer:
+        return
+    del config.active_file_transfers[fileid]
+    if transfer.get("offer_timer"):
+        transfer["offer_timer"].cancel()
+    if transfer.get("tcp"):
+        transfer["tcp"].close()
+    print_error(reason)
+    if cancel:
+        send_file_cancel(fileid, transfer["recipient"], "EXPIRED", transfer["sender_info"])
+
+
+def send_file_reply(
+    fileid: str,
+    recipient_id: str,
+    sender_info: Dict,
+    action: str = "ACCEPT",
+    on_give_up=None,
+    group_id: str = None,
+    delta_block: int = 0,
+    delta_parts: int = 0,
+    tcp: bool = False,
+) -> bool:
+    """
+    Answer a FILE_OFFER with FILE_ACCEPT or FILE_REJECT. An accept with
+    delta_parts announces that many FILE_SIGNATURES of our older revision;
+    one with tcp says we will fetch the file from the offer's TCP_PORT.
+    """
     peer = get_peer(recipient_id)
     if not peer:
         print_error(f"Recipient {recipient_id} not found")
         return False
 
+    message_id = secrets.token_hex(4)
+    message = (
+        f"TYPE: FILE_{action}\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        + (f"GROUP_ID: {group_id}\n" if group_id else "")
+        + f"FILEID: {fileid}\n"
+        + (f"DELTA_BLOCK: {delta_block}\nDELTA_PARTS: {delta_parts}\n" if delta_parts else "")
+        + ("TCP: 1\n" if tcp else "")
+        + f"TIMESTAMP: {int(time.time())}\n"
+        f"MESSAGE_ID: {message_id}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+    addr = _peer_address(peer)
+    if config.verbose_mode:
+        print_verbose(f"Sending FILE_{action} for {fileid} to {addr[0]}:{addr[1]}")
+    return send_reliable(message_id, recipient_id, message, addr, on_give_up=on_give_up)
+
+
+def send_file_ack(
+    fileid: str,
+    recipient_id: str,
+    cumulative: int,
+    sack: str,
+    sender_info: Dict,
+    seq: int = None,
+) -> bool:
+    """
+    Report received chunks: all below CUMULATIVE, plus the SACK bitmap after
+    it. A source of a swarm download gets the SEQ of the FILE_REQUEST the
+    report was made against.
+    """
+    peer = get_peer(recipient_id)
+    if not peer:
+        return False
+
+    message = (
+        "TYPE: FILE_ACK\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        f"FILEID: {fileid}\n"
+        f"CUMULATIVE: {cumulative}\n"
+        f"SACK: {sack}\n"
+        + (f"SEQ: {seq}\n" if seq is not None else "")
+        + f"TIMESTAMP: {int(time.time())}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+
     try:
-        with open(filepath, "rb") as f:
-            f.seek(chunk_index * chunk_size)
-            chunk_data = f.read(chunk_size)
+        _, address = peer["user_id"].split("@")
+        _, port = address.split(":")
+        peer_port = int(port)
+    except Exception:
+        peer_port = peer["port"]
 
-        if not chunk_data:
-            return False  # No more data to send
+    return send_unicast(message, (peer["ip"], peer_port))
 
-        encoded_data = base64.b64encode(chunk_data).decode("utf-8")
-        timestamp = int(time.time())
-        token = generate_token(sender_info["user_id"], "file")
 
-        message = (
-            "TYPE: FILE_CHUNK\n"
-            f"FROM: {sender_info['user_id']}\n"
-            f"TO: {recipient_id}\n"
-            f"FILEID: {fileid}\n"
-            f"CHUNK_INDEX: {chunk_index}\n"
-            f"TOTAL_CHUNKS: {total_chunks}\n"
-            f"CHUNK_SIZE: {len(chunk_data)}\n"
-            f"TOKEN: {token}\n"
-            f"DATA: {encoded_data}\n\n"
-        )
+def send_file_resume(
+    fileid: str,
+    recipient_id: str,
+    addr: tuple,
+    digest: str,
+    ranges: str,
+    sender_info: Dict,
+    on_give_up=None,
+) -> bool:
+    """Ask the sender of a partly received file to send only what is missing"""
+    peer = get_peer(recipient_id)
+    if peer:
+        addr = _peer_address(peer)
+    message_id = secrets.token_hex(4)
+    message = (
+        "TYPE: FILE_RESUME\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        f"FILEID: {fileid}\n"
+        f"HASH: {digest}\n"
+        f"RANGES: {ranges}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"MESSAGE_ID: {message_id}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+    if config.verbose_mode:
+        print_verbose(f"Sending FILE_RESUME for {fileid} to {addr[0]}:{addr[1]}")
+    return send_reliable(message_id, recipient_id, message, addr, on_give_up=on_give_up)
 
-        # Parse port from user_id (canonical)
-        try:
-            _, address = peer["user_id"].split("@")
-            _, port = address.split(":")
-            peer_port = int(port)
-        except Exception:
-            peer_port = peer["port"]
 
-        peer_ip = peer["ip"]
+def send_file_query(fileid: str, digest: str, filesize: int, sender_info: Dict) -> None:
+    """Ask the LAN who else holds the content of a download, to fetch it from them too"""
+    message = (
+        "TYPE: FILE_QUERY\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"FILEID: {fileid}\n"
+        f"HASH: {digest}\n"
+        f"FILESIZE: {filesize}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+    send_broadcast(message)
 
-        if config.verbose_mode:
-            print_verbose(
-                f"Sending FILE_CHUNK {chunk_index+1}/{total_chunks} "
-                f"for {fileid} to {peer_ip}:{peer_port}"
-            )
 
-        return send_unicast(message, (peer_ip, peer_port))
+def send_file_have(fileid: str, recipient_id: str, digest: str, sender_info: Dict) -> bool:
+    """Answer a FILE_QUERY for content we hold"""
+    peer = get_peer(recipient_id)
+    if not peer:
+        return False
 
-    except Exception as e:
-        print_error(f"Failed to send file chunk: {e}")
+    message = (
+        "TYPE: FILE_HAVE\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        f"FILEID: {fileid}\n"
+        f"HASH: {digest}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+    return send_unicast(message, _peer_address(peer))
+
+
+def send_file_request(
+    fileid: str,
+    recipient_id: str,
+    file_info: Dict,
+    seq: int,
+    ranges: str,
+    sender_info: Dict,
+    on_give_up=None,
+) -> bool:
+    """Ask one source of a swarm download to send the chunk RANGES (and only those)"""
+    peer = get_peer(recipient_id)
+    if not peer:
         return False
 
+    message_id = secrets.token_hex(4)
+    message = (
+        "TYPE: FILE_REQUEST\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        f"FILEID: {fileid}\n"
+        f"HASH: {file_info['hash']}\n"
+        f"FILESIZE: {file_info['filesize']}\n"
+        f"CHUNK_SIZE: {file_info['chunk_size']}\n"
+        f"SEQ: {seq}\n"
+        f"RANGES: {ranges}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"MESSAGE_ID: {message_id}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+    addr = _peer_address(peer)
+    if config.verbose_mode:
+        print_verbose(f"Sending FILE_REQUEST {seq} for {fileid} to {addr[0]}:{addr[1]}: {ranges}")
+    return send_reliable(message_id, recipient_id, message, addr, on_give_up=on_give_up)
+
+
+def send_file_signatures(
+    fileid: str,
+    recipient_id: str,
+    block: int,
+    part: int,
+    parts: int,
+    signatures: bytes,
+    sender_info: Dict,
+) -> bool:
+    """One part of the block signatures of our older revision of an offered file"""
+    peer = get_peer(recipient_id)
+    if not peer:
+        return False
+
+    message_id = secrets.token_hex(4)
+    message = (
+        "TYPE: FILE_SIGNATURES\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        f"FILEID: {fileid}\n"
+        f"BLOCK: {block}\n"
+        f"PART: {part}\n"
+        f"PARTS: {parts}\n"
+        f"SIGS: {base64.b64encode(signatures).decode('ascii')}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"MESSAGE_ID: {message_id}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+    return send_reliable(message_id, recipient_id, message, _peer_address(peer))
+
+
+def send_file_delta(
+    fileid: str,
+    recipient_id: str,
+    delta_size: int,
+    sender_info: Dict,
+    on_delivered=None,
+    on_give_up=None,
+) -> bool:
+    """Announce that the chunks of `fileid` will carry a DELTA_SIZE-byte delta stream"""
+    peer = get_peer(recipient_id)
+    if not peer:
+        return False
+
+    message_id = secrets.token_hex(4)
+    message = (
+        "TYPE: FILE_DELTA\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        f"FILEID: {fileid}\n"
+        f"DELTA_SIZE: {delta_size}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"MESSAGE_ID: {message_id}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+    addr = _peer_address(peer)
+    if config.verbose_mode:
+        print_verbose(f"Sending FILE_DELTA for {fileid} to {addr[0]}:{addr[1]}: {delta_size} bytes")
+    return send_reliable(
+        message_id, recipient_id, message, addr, on_delivered=on_delivered, on_give_up=on_give_up
+    )
+
+
+def send_file_cancel(fileid: str, recipient_id: str, reason: str, sender_info: Dict) -> bool:
+    """Tell a receiver that a transfer won't continue, e.g. when it can't be resumed"""
+    peer = get_peer(recipient_id)
+    if not peer:
+        return False
+
+    message = (
+        "TYPE: FILE_CANCEL\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        f"FILEID: {fileid}\n"
+        f"REASON: {reason}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+    return send_unicast(message, _peer_address(peer))
+
+
+def send_file_nack(
+    fileid: str, recipient_id: str, group_id: str, ranges: str, sender_info: Dict
+) -> bool:
+    """Ask the sender of a group transfer to repeat the chunk RANGES we missed"""
+    peer = get_peer(recipient_id)
+    if not peer:
+        return False
+
+    message = (
+        "TYPE: FILE_NACK\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        f"GROUP_ID: {group_id}\n"
+        f"FILEID: {fileid}\n"
+        f"RANGES: {ranges}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    )
+    return send_unicast(message, _peer_address(peer))
+
 
 def send_file_received(
-    fileid: str, recipient_id: str, sender_info: Dict, status: str = "COMPLETE"
+    fileid: str,
+    recipient_id: str,
+    sender_info: Dict,
+    status: str = "COMPLETE",
+    group_id: str = None,
 ) -> bool:
     """Send FILE_RECEIVED acknowledgment"""
     peer = get_peer(recipient_id)
@@ -377,7 +857,8 @@ def send_file_received(
         f"TO: {recipient_id}\n"
         f"FILEID: {fileid}\n"
         f"STATUS: {status}\n"
-        f"TIMESTAMP: {timestamp}\n\n"
+        + (f"GROUP_ID: {group_id}\n" if group_id else "")
+        + f"TIMESTAMP: {timestamp}\n\n"
     )
 
     # Parse port from user_id (canonical)
@@ -0,0 +1,20 @@
+# network/metrics.py
+from typing import Callable, Dict
+
+# Subsystem name -> function returning its current counters/timings
+_sources: Dict[str, Callable[[], Dict]] = {}
+
+
+def register_source(name: str, collect: Callable[[], Dict]) -> None:
+    """Expose a subsystem's stats through the 'stats' command"""
+    _sources[name] = collect
+
+
+def collect_metrics() -> Dict[str, Dict]:
+    result = {}
+    for name, collect in list(_sources.items()):
+        try:
+            result[name] = collect()
+        except Exception as e:
+            result[name] = {"error": str(e)}
+    return result
@@ -1,8 +1,9 @@
 # network/peer_registry.py
 import time
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 _peer_registry: Dict[str, Dict] = {}
+_new_peer_listeners: List[Callable[[Dict], None]] = []
 
 
 def _normalize_user_id_and_port(user_id: str, port_hint: int = None):
@@ -38,6 +39,38 @@ def get_peer(user_id: str) -> Dict:
     return _peer_registry.get(user_id)
 
 
+def get_peer_address(user_id: str):
+    """Return (ip, port) for a peer, preferring the port in its canonical user_id"""
+    peer = _peer_registry.get(user_id)
+    if peer:
+        _, port = _normalize_user_id_and_port(peer["user_id"], peer["port"])
+        return peer["ip"], int(port)
+    try:
+        _, address = user_id.split("@")
+        ip, port = address.split(":")
+        return ip.strip(), int(port.strip())
+    except Exception:
+        return None
+
+
+def get_peer_addresses(user_ids) -> Dict[str, tuple]:
+    """(ip, port) of every known peer in user_ids, in one pass; unknown ones are left out"""
+    registry = _peer_registry
+    addresses = {}
+    for user_id in user_ids:
+        peer = registry.get(user_id)
+        if not peer:
+            continue
+        # The port is whatever the peer announced; leave out one that isn't a port
+        try:
+            port = int(peer["port"])
+        except (TypeError, ValueError):
+            continue
+        if 0 < port < 65536:
+            addresses[user_id] = (peer["ip"], port)
+    return addresses
+
+
 def add_peer(
     user_id: str,
     ip: str,
@@ -45,6 +78,8 @@ def add_peer(
     display_name: str = None,
     avatar_data: str = None,
     avatar_type: str = None,
+    capabilities: set = None,
+    max_datagram: int = None,
 ) -> None:
     canonical_user_id, canonical_port = _normalize_user_id_and_port(user_id, port)
     if canonical_port is None:
@@ -68,9 +103,29 @@ def add_peer(
             if avatar_type
             else existing.get("avatar_type") if existing else None
         ),
+        "capabilities": (
+            capabilities
+            if capabilities is not None
+            else existing.get("capabilities", set()) if existing else set()
+        ),
+        # Largest datagram the peer reads; None for peers that don't say
+        "max_datagram": (
+            max_datagram
+            if max_datagram is not None
+            else existing.get("max_datagram") if existing else None
+        ),
     }
     _peer_registry[canonical_user_id] = entry
 
+    if existing is None:
+        for listener in _new_peer_listeners:
+            listener(entry)
+
+
+def on_new_peer(listener: Callable[[Dict], None]) -> None:
+    """Call listener(entry) whenever a previously unknown peer is added"""
+    _new_peer_listeners.append(listener)
+
 
 def remove_peer(user_id: str) -> None:
     _peer_registry.pop(user_id, None)
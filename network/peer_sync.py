@@ -0,0 +1,195 @@
+# network/peer_sync.py
+import hashlib
+import time
+import zlib
+from typing import Dict, Iterable, List
+
+import config
+from network.broadcast import advertise_capability
+from network.message_sender import send_unicast
+from network.metrics import register_source
+from network.peer_registry import add_peer, get_peer, get_peer_address, get_peer_list
+from network.token_utils import generate_token
+from ui.utils import print_verbose
+
+PEERS_SYNC_CAPABILITY = "PEERS_SYNC"
+DIGEST_BUCKETS = 16
+
+_state = {"last_sync": 0.0}
+_asked: Dict[str, float] = {}  # user_id -> when we last sent it our digest
+_stats = {"digests_sent": 0, "syncs_sent": 0, "entries_learned": 0}
+
+
+def _bucket(user_id: str) -> int:
+    return zlib.crc32(user_id.encode("utf-8")) % DIGEST_BUCKETS
+
+
+def _known_ids(my_info: Dict) -> List[str]:
+    # Our own id is never in our registry but is in everyone else's
+    return [peer["user_id"] for peer in get_peer_list()] + [my_info["user_id"]]
+
+
+def registry_digest(user_ids: Iterable[str]):
+    """Return (overall digest, per-bucket digests) of a set of user ids"""
+    buckets = [[] for _ in range(DIGEST_BUCKETS)]
+    for user_id in user_ids:
+        buckets[_bucket(user_id)].append(user_id)
+    bucket_hashes = [
+        hashlib.sha1("\n".join(sorted(ids)).encode("utf-8")).hexdigest()[:8]
+        for ids in buckets
+    ]
+    overall = hashlib.sha1(",".join(bucket_hashes).encode("utf-8")).hexdigest()[:16]
+    return overall, bucket_hashes
+
+
+def _encode_entry(user_id: str, display_name: str) -> str:
+    name = display_name.replace("|", " ").replace(";", " ")
+    return f"{user_id}|{name}"
+
+
+def pack_entries(entries: List[str], limit: int) -> List[str]:
+    """Group encoded entries into ';'-joined batches of at most `limit` bytes"""
+    batches = []
+    current = []
+    size = 0
+    for entry in entries:
+        if current and size + len(entry) + 1 > limit:
+            batches.append(";".join(current))
+            current = []
+            size = 0
+        current.append(entry)
+        size += len(entry) + 1
+    if current:
+        batches.append(";".join(current))
+    return batches
+
+
+def send_digest(recipient_id: str, my_info: Dict, reply: bool = False) -> bool:
+    """Send our registry digest to one neighbour by unicast"""
+    addr = get_peer_address(recipient_id)
+    if not addr:
+        return False
+
+    ids = _known_ids(my_info)
+    overall, bucket_hashes = registry_digest(ids)
+    message = (
+        "TYPE: PEERS_DIGEST\n"
+        f"FROM: {my_info['user_id']}\n"
+        f"TO: {recipient_id}\n"
+        f"DIGEST: {overall}\n"
+        f"BUCKETS: {','.join(bucket_hashes)}\n"
+        f"COUNT: {len(ids)}\n"
+        f"REPLY: {1 if reply else 0}\n"
+        f"TIMESTAMP: {int(time.time())}\n"
+        f"TOKEN: {generate_token(my_info['user_id'], 'broadcast')}\n\n"
+    )
+    if config.verbose_mode:
+        print_verbose(f"Sending PEERS_DIGEST ({len(ids)} peers) to {recipient_id}")
+    _stats["digests_sent"] += 1
+    # Only a neighbour we sent our digest to has reason to send us PEERS_SYNC
+    now = time.time()
+    for user_id, sent in list(_asked.items()):
+        if now - sent > config.PEERS_SYNC_INTERVAL:
+            del _asked[user_id]
+    _asked[recipient_id] = now
+    return send_unicast(message, addr)
+
+
+def maybe_sync(user_id: str, my_info: Dict) -> None:
+    """Start a digest exchange with a capable peer, at most once per interval"""
+    peer = get_peer(user_id)
+    if not peer or PEERS_SYNC_CAPABILITY not in peer.get("capabilities", ()):
+        return
+    now = time.time()
+    if now - _state["last_sync"] < config.PEERS_SYNC_INTERVAL:
+        return
+    _state["last_sync"] = now
+    send_digest(user_id, my_info)
+
+
+def _signed_by_sender(content: Dict) -> bool:
+    """The TOKEN (scope and IP checked in main) was issued to the FROM it came with"""
+    return bool(content.get("FROM")) and content.get("TOKEN", "").split("|")[0] == content["FROM"]
+
+
+def handle_peers_digest(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """Send the entries a neighbour may be missing, and our digest if we differ"""
+    if not _signed_by_sender(content):
+        return
+    sender = content["FROM"]
+    remote_buckets = content.get("BUCKETS", "").split(",")
+    if len(remote_buckets) != DIGEST_BUCKETS:
+        return
+
+    ids = _known_ids(my_info)
+    overall, bucket_hashes = registry_digest(ids)
+    if overall == content.get("DIGEST"):
+        return
+
+    differing = {i for i in range(DIGEST_BUCKETS) if bucket_hashes[i] != remote_buckets[i]}
+    entries = []
+    for peer in get_peer_list(exclude_user_id=sender):
+        if _bucket(peer["user_id"]) in differing:
+            entries.append(_encode_entry(peer["user_id"], peer["display_name"]))
+    if _bucket(my_info["user_id"]) in differing:
+        entries.append(_encode_entry(my_info["user_id"], my_info["username"]))
+
+    target = get_peer_address(sender) or addr
+    batches = pack_entries(entries, config.PEERS_SYNC_DATAGRAM_SIZE)
+    for part, batch in enumerate(batches, 1):
+        message = (
+            "TYPE: PEERS_SYNC\n"
+            f"FROM: {my_info['user_id']}\n"
+            f"TO: {sender}\n"
+            f"PART: {part}/{len(batches)}\n"
+            f"PEERS: {batch}\n"
+            f"TIMESTAMP: {int(time.time())}\n"
+            f"TOKEN: {generate_token(my_info['user_id'], 'broadcast')}\n\n"
+        )
+        send_unicast(message, target)
+        _stats["syncs_sent"] += 1
+
+    if config.verbose_mode:
+        print_verbose(
+            f"Sent {len(entries)} peer entries in {len(batches)} PEERS_SYNC to {sender}"
+        )
+
+    # The neighbour may also know peers we don't; let it push them back once
+    if content.get("REPLY") != "1":
+        send_digest(sender, my_info, reply=True)
+
+
+def handle_peers_sync(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """Add peers learned from a neighbour's PEERS_SYNC"""
+    if not _signed_by_sender(content):
+        return
+    sender = content["FROM"]
+    if time.time() - _asked.get(sender, 0.0) > config.PEERS_SYNC_INTERVAL:
+        if config.verbose_mode:
+            print_verbose(f"Ignoring unsolicited PEERS_SYNC from {sender}")
+        return
+    learned = 0
+    for entry in content.get("PEERS", "").split(";"):
+        if "|" not in entry:
+            continue
+        user_id, display_name = entry.split("|", 1)
+        if user_id == my_info["user_id"] or get_peer(user_id):
+            continue
+        try:
+            _, address = user_id.split("@", 1)
+            ip, port = address.split(":", 1)
+            add_peer(user_id=user_id, ip=ip, port=int(port), display_name=display_name)
+        except ValueError:
+            continue
+        learned += 1
+
+    _stats["entries_learned"] += learned
+    if config.verbose_mode:
+        print_verbose(
+            f"\nTYPE: PEERS_SYNC\nFROM: {content.get('FROM', '')}\n"
+            f"PART: {content.get('PART', '')}\nLEARNED: {learned}\n\n"
+        )
+
+
+advertise_capability(PEERS_SYNC_CAPABILITY)
+register_source("peer_sync", lambda: dict(_stats))
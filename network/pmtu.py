@@ -0,0 +1,252 @@
+# network/pmtu.py
+import errno
+import secrets
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import config
+from network.broadcast import advertise_capability
+from network.metrics import register_source
+from network.peer_registry import get_peer, get_peer_address
+from network.reliable import schedule
+from network.rtt import get_srtt
+from ui.utils import print_verbose
+
+PMTU_CAPABILITY = "PMTU_PROBE"
+UDP_IP_HEADERS = 28  # IPv4 + UDP header bytes inside the link MTU
+
+# Linux values; other platforms send without DF and rely on probe loss
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+IP_PMTUDISC_PROBE = getattr(socket, "IP_PMTUDISC_PROBE", 3)
+IP_MTU = getattr(socket, "IP_MTU", 14)
+
+_sock = None
+_sock_lock = threading.Lock()
+_paths: Dict[str, tuple] = {}  # user_id -> (payload bytes, measured at)
+_probes: Dict[str, "PathProbe"] = {}
+_stats = {"probes_sent": 0, "probes_lost": 0, "too_big_local": 0, "searches": 0}
+
+
+def _probe_socket() -> socket.socket:
+    """Socket whose datagrams carry DF, so oversize probes are dropped, not fragmented"""
+    global _sock
+    with _sock_lock:
+        if _sock is None:
+            _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                _sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+            except OSError:
+                pass
+        return _sock
+
+
+def link_payload(addr: tuple) -> Optional[int]:
+    """Largest unfragmented UDP payload the local route to addr allows, if known"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect(addr)
+            return sock.getsockopt(socket.IPPROTO_IP, IP_MTU) - UDP_IP_HEADERS
+    except OSError:
+        return None
+
+
+def _pad(header: str, size: int) -> bytes:
+    # "PAD: " + filler + "\n\n" brings the datagram to exactly `size` bytes
+    filler = max(0, size - len(header) - len("PAD: \n\n"))
+    return (header + "PAD: " + "x" * filler + "\n\n").encode("ascii")
+
+
+class PathProbe:
+    """
+    Binary search for the largest datagram that reaches one peer, between
+    PMTU_BASE (assumed to always fit) and a ceiling. Each size gets
+    PMTU_PROBE_TRIES chances, so a single lost probe doesn't shrink the
+    result; a size the local link refuses outright fails immediately.
+    """
+
+    def __init__(
+        self,
+        peer: str,
+        ceiling: int,
+        send_probe: Callable,
+        on_done: Callable,
+        timeout: Callable = None,
+        schedule: Callable = schedule,
+    ):
+        self.peer = peer
+        self.low = min(config.PMTU_BASE, ceiling)
+        self.high = ceiling
+        self._send_probe = send_probe  # (probe_id, size) -> False if refused locally
+        self._on_done = [on_done]
+        self._timeout = timeout or (
+            lambda: max(config.PMTU_PROBE_TIMEOUT, 2 * (get_srtt(peer) or 0.0))
+        )
+        self._schedule = schedule
+        self._lock = threading.Lock()
+        self._size = None
+        self._probe_id = None
+        self._tries = 0
+        self._timer = None
+        self.done = False
+
+    def add_callback(self, on_done: Callable) -> None:
+        self._on_done.append(on_done)
+
+    def start(self) -> None:
+        self._next()
+
+    def _next(self) -> None:
+        while True:
+            with self._lock:
+                if self.high - self.low <= config.PMTU_PRECISION:
+                    self.done = True
+                    callbacks, self._on_done = self._on_done, []
+                    break
+                if self._size is None:
+                    self._size = (self.low + self.high + 1) // 2
+                    self._tries = 0
+                self._tries += 1
+                self._probe_id = secrets.token_hex(4)
+                probe_id, size = self._probe_id, self._size
+
+            if self._send_probe(probe_id, size):
+                with self._lock:
+                    if self._probe_id == probe_id:
+                        self._timer = self._schedule(
+                            self._timeout(), lambda: self._expired(probe_id)
+                        )
+                return
+            with self._lock:
+                self._too_big()
+
+        for callback in callbacks:
+            callback(self.low)
+
+    def _too_big(self) -> None:
+        self.high = self._size - 1
+        self._size = None
+
+    def on_ack(self, probe_id: str) -> None:
+        with self._lock:
+            if probe_id != self._probe_id or self._size is None:
+                return
+            if self._timer:
+                self._timer.cancel()
+            self.low = self._size
+            self._size = None
+            self._probe_id = None
+        self._next()
+
+    def _expired(self, probe_id: str) -> None:
+        with self._lock:
+            if probe_id != self._probe_id:
+                return
+            _stats["probes_lost"] += 1
+            if self._tries >= config.PMTU_PROBE_TRIES:
+                self._too_big()
+        self._next()
+
+
+def _send_probe(recipient: str, addr: tuple, my_info: Dict, probe_id: str, size: int) -> bool:
+    header = (
+        "TYPE: PMTU_PROBE\n"
+        f"FROM: {my_info['user_id']}\n"
+        f"TO: {recipient}\n"
+        f"PROBE_ID: {probe_id}\n"
+        f"SIZE: {size}\n"
+    )
+    try:
+        _probe_socket().sendto(_pad(header, size), addr)
+        _stats["probes_sent"] += 1
+        return True
+    except OSError as e:
+        # EMSGSIZE: bigger than the local link allows with DF set
+        if e.errno == errno.EMSGSIZE:
+            _stats["too_big_local"] += 1
+        return False
+
+
+def get_path_payload(user_id: str) -> Optional[int]:
+    """Largest datagram known to reach this peer, or None if not measured recently"""
+    known = _paths.get(user_id)
+    if known and time.time() - known[1] < config.PMTU_TTL:
+        return known[0]
+    return None
+
+
+def probe_path(user_id: str, my_info: Dict, on_done: Callable) -> None:
+    """
+    Call on_done(payload) with the largest datagram that reaches the peer,
+    probing first unless a recent result is cached. Peers that can't answer
+    probes get PMTU_BASE capped by what they advertised.
+    """
+    peer = get_peer(user_id)
+    addr = get_peer_address(user_id)
+    advertised = peer.get("max_datagram") if peer else None
+    known = get_path_payload(user_id)
+    if known is not None:
+        on_done(known)
+        return
+    if not addr or not advertised or PMTU_CAPABILITY not in peer.get("capabilities", ()):
+        on_done(min(config.PMTU_BASE, advertised or config.PMTU_BASE))
+        return
+
+    ceiling = advertised
+    link = link_payload(addr)
+    if link:
+        ceiling = min(ceiling, link)
+
+    running = _probes.get(user_id)
+    if running and not running.done:
+        running.add_callback(on_done)
+        return
+
+    def finished(payload: int) -> None:
+        _paths[user_id] = (payload, time.time())
+        _probes.pop(user_id, None)
+        if config.verbose_mode:
+            print_verbose(f"Path to {user_id} carries {payload}-byte datagrams")
+
+    probe = PathProbe(
+        user_id,
+        ceiling,
+        send_probe=lambda probe_id, size: _send_probe(user_id, addr, my_info, probe_id, size),
+        on_done=finished,
+    )
+    probe.add_callback(on_done)
+    _probes[user_id] = probe
+    _stats["searches"] += 1
+    probe.start()
+
+
+def handle_pmtu_probe(content: Dict, addr: tuple, my_info: Dict, size: int) -> None:
+    """Tell the prober how large a datagram arrived"""
+    sender = content["FROM"]
+    reply = (
+        "TYPE: PMTU_ACK\n"
+        f"FROM: {my_info['user_id']}\n"
+        f"TO: {sender}\n"
+        f"PROBE_ID: {content.get('PROBE_ID', '')}\n"
+        f"SIZE: {size}\n\n"
+    )
+    target = get_peer_address(sender) or addr
+    _probe_socket().sendto(reply.encode("ascii"), target)
+
+
+def handle_pmtu_ack(content: Dict, addr: tuple, my_info: Dict) -> None:
+    probe = _probes.get(content["FROM"])
+    if probe:
+        probe.on_ack(content.get("PROBE_ID", ""))
+
+
+def get_pmtu_stats() -> Dict:
+    stats = dict(_stats)
+    for user_id, (payload, _) in list(_paths.items()):
+        stats[f"{user_id} payload"] = payload
+    return stats
+
+
+advertise_capability(PMTU_CAPABILITY)
+register_source("pmtu", get_pmtu_stats)
@@ -0,0 +1,175 @@
+# network/presence.py
+import random
+import threading
+import time
+from typing import Callable, Dict
+
+import config
+from network.broadcast import (
+    build_profile,
+    send_profile,
+    last_profile_broadcast,
+    my_info,
+)
+from network.message_sender import send_unicast
+from network.metrics import register_source
+from network.peer_registry import get_peer_address
+from ui.utils import print_verbose
+
+
+def _start_timer(delay: float, fn: Callable) -> None:
+    timer = threading.Timer(delay, fn)
+    timer.daemon = True
+    timer.start()
+
+
+class TokenBucket:
+    """Byte budget refilled at `rate` bytes/s, holding at most `capacity`"""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable = time.time):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self._stamp = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def try_consume(self, amount: int) -> bool:
+        # A message bigger than the whole bucket may still go out when the
+        # bucket is full; the debt is paid back before anything else is sent.
+        self._refill()
+        if self.tokens < min(amount, self.capacity):
+            return False
+        self.tokens -= amount
+        return True
+
+    def wait_time(self, amount: int) -> float:
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+
+class PresenceScheduler:
+    """
+    Answers PINGs without every peer re-broadcasting its PROFILE.
+
+    A PING is answered with a unicast PROFILE when we broadcast one only
+    moments ago, otherwise with a broadcast delayed by a random jitter so
+    that PINGs arriving close together share a single broadcast. A pending
+    broadcast is dropped if a PROFILE went out after it was requested (for
+    example from discovery or 'send hello'). Everything is paid for from one
+    presence byte budget; when it runs dry the reply becomes a broadcast at
+    the end of the suppression window.
+    """
+
+    def __init__(
+        self,
+        profile: Callable,
+        broadcast: Callable,
+        unicast: Callable,
+        last_broadcast: Callable = lambda: 0.0,
+        clock: Callable = time.time,
+        schedule: Callable = _start_timer,
+        rng: random.Random = None,
+    ):
+        self._profile = profile  # () -> encoded PROFILE bytes
+        self._broadcast = broadcast  # (bytes) -> None
+        self._unicast = unicast  # (bytes, addr) -> None
+        self._external_last = last_broadcast
+        self._clock = clock
+        self._schedule = schedule
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._last_broadcast = 0.0
+        self._pending_since = None  # request time of the scheduled broadcast
+        self.budget = TokenBucket(
+            config.PRESENCE_BUDGET_BPS, config.PRESENCE_BUDGET_BURST, clock
+        )
+        self.stats: Dict[str, int] = {
+            "pings": 0,
+            "broadcasts": 0,
+            "unicasts": 0,
+            "coalesced": 0,
+            "cancelled": 0,
+            "bytes": 0,
+        }
+
+    def _recent_broadcast(self) -> float:
+        return max(self._last_broadcast, self._external_last())
+
+    def on_ping(self, addr) -> None:
+        with self._lock:
+            self.stats["pings"] += 1
+            now = self._clock()
+
+            if self._pending_since is not None:
+                self.stats["coalesced"] += 1
+                return
+
+            since_last = now - self._recent_broadcast()
+            if since_last < config.PROFILE_SUPPRESS_WINDOW:
+                data = self._profile()
+                if addr and self.budget.try_consume(len(data)):
+                    self._unicast(data, addr)
+                    self.stats["unicasts"] += 1
+                    self.stats["bytes"] += len(data)
+                    return
+                delay = config.PROFILE_SUPPRESS_WINDOW - since_last
+            else:
+                delay = 0.0
+
+            self._pending_since = now
+            delay += self._rng.uniform(0, config.PROFILE_JITTER_MAX)
+        self._schedule(delay, self._fire)
+
+    def _fire(self) -> None:
+        with self._lock:
+            requested = self._pending_since
+            if requested is None:
+                return
+            if self._recent_broadcast() >= requested:
+                self._pending_since = None
+                self.stats["cancelled"] += 1
+                return
+
+            data = self._profile()
+            if not self.budget.try_consume(len(data)):
+                delay = self.budget.wait_time(len(data))
+            else:
+                self._pending_since = None
+                self._last_broadcast = self._clock()
+                self.stats["broadcasts"] += 1
+                self.stats["bytes"] += len(data)
+                delay = None
+
+        if delay is not None:
+            self._schedule(delay, self._fire)
+        else:
+            self._broadcast(data)
+
+
+_scheduler = PresenceScheduler(
+    profile=lambda: build_profile(my_info),
+    broadcast=lambda data: send_profile(my_info),
+    unicast=lambda data, addr: send_unicast(data, addr),
+    last_broadcast=last_profile_broadcast,
+)
+
+
+def handle_ping(user_id: str) -> None:
+    """Schedule our PROFILE reply to a PING from user_id"""
+    addr = get_peer_address(user_id)
+    if config.verbose_mode:
+        print_verbose(f"Scheduling PROFILE reply to PING from {user_id}")
+    _scheduler.on_ping(addr)
+
+
+def get_presence_stats() -> Dict[str, int]:
+    return dict(_scheduler.stats)
+
+
+register_source("presence", get_presence_stats)
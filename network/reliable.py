@@ -0,0 +1,380 @@
+# network/reliable.py
+import socket
+import threading
+import time
+from typing import Callable, Dict
+
+import config
+from network.metrics import register_source
+from network.rtt import RttEstimator, get_estimator
+from ui.utils import print_error, print_verbose
+
+
+class _Timer:
+    __slots__ = ("deadline", "callback", "cancelled")
+
+    def __init__(self, deadline: int, callback: Callable):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: one thread, O(1) schedule and cancel.
+
+    A timer due at absolute tick T lives in slot T % slots; each tick only
+    that slot is scanned, and entries due in a later lap are left in place.
+    """
+
+    def __init__(self, tick: float = None, slots: int = None, clock: Callable = time.monotonic):
+        self.tick = tick or config.TIMER_WHEEL_TICK
+        self._slots = [[] for _ in range(slots or config.TIMER_WHEEL_SLOTS)]
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._last_tick = int(clock() / self.tick)
+        self._thread = None
+
+    def schedule(self, delay: float, callback: Callable) -> _Timer:
+        with self._cond:
+            deadline = int((self._clock() + delay) / self.tick) + 1
+            deadline = max(deadline, self._last_tick + 1)
+            timer = _Timer(deadline, callback)
+            self._slots[deadline % len(self._slots)].append(timer)
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return timer
+
+    def advance(self) -> None:
+        """Fire every timer due up to now"""
+        due = []
+        with self._cond:
+            now_tick = int(self._clock() / self.tick)
+            while self._last_tick < now_tick:
+                self._last_tick += 1
+                slot = self._slots[self._last_tick % len(self._slots)]
+                if not slot:
+                    continue
+                keep = []
+                for timer in slot:
+                    if timer.cancelled:
+                        self._pending -= 1
+                    elif timer.deadline <= self._last_tick:
+                        self._pending -= 1
+                        due.append(timer)
+                    else:
+                        keep.append(timer)
+                slot[:] = keep
+        for timer in due:
+            try:
+                timer.callback()
+            except Exception as e:
+                print_error(f"Timer callback failed: {e}")
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                    # Nothing ran while idle; skip the empty ticks
+                    self._last_tick = max(
+                        self._last_tick, int(self._clock() / self.tick) - 1
+                    )
+            time.sleep(self.tick)
+            self.advance()
+
+
+class _Outstanding:
+    __slots__ = (
+        "data", "addr", "attempts", "sent_at", "timer", "shared", "on_delivered", "on_give_up"
+    )
+
+
+class ReliableSender:
+    """
+    Tracks unacknowledged messages by (MESSAGE_ID, recipient) and retransmits
+    them from a single timer wheel until an ACK arrives or retries run out.
+    Each recipient's timeout comes from its measured RTT and doubles on
+    every retry. A message fanned out to many recipients with send_many
+    shares one timer per call, set by the slowest of them, and resends to
+    whoever hasn't ACKed yet in one pass.
+    """
+
+    def __init__(
+        self, send: Callable = None, wheel: TimerWheel = None, rtt: RttEstimator = None
+    ):
+        self._send = send or self._udp_send
+        self._wheel = wheel or TimerWheel()
+        self._rtt = rtt or get_estimator()
+        self._sock = None
+        self._lock = threading.Lock()
+        # MESSAGE_ID -> recipient user_id -> entry; group messages share an id
+        self._outstanding: Dict[str, Dict[str, _Outstanding]] = {}
+        self.stats = {"sent": 0, "delivered": 0, "retransmits": 0, "given_up": 0}
+
+    def _udp_send(self, data: bytes, addr: tuple) -> None:
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.sendto(data, addr)
+
+    def _send_all(self, data: bytes, addrs: list) -> None:
+        """The same datagram to every address, back to back on the shared socket"""
+        send = self._send
+        if send == self._udp_send:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            send = self._sock.sendto
+        for addr in addrs:
+            try:
+                send(data, addr)
+            except OSError as e:
+                # Left outstanding: the retry timer sends it again
+                print_error(f"Failed to send message to {addr[0]}:{addr[1]}: {e}")
+
+    def send(
+        self,
+        message_id: str,
+        recipient: str,
+        message,
+        addr: tuple,
+        on_delivered: Callable = None,
+        on_give_up: Callable = None,
+    ) -> bool:
+        """Send now and keep retrying until recipient ACKs message_id"""
+        entry = _Outstanding()
+        entry.data = message if isinstance(message, bytes) else message.encode("utf-8")
+        entry.addr = addr
+        entry.attempts = 1
+        entry.sent_at = time.monotonic()
+        entry.on_delivered = on_delivered
+        entry.on_give_up = on_give_up
+        entry.shared = None
+
+        with self._lock:
+            self._outstanding.setdefault(message_id, {})[recipient] = entry
+            entry.timer = self._wheel.schedule(
+                self._rtt.rto(recipient), lambda: self._expire(message_id, recipient)
+            )
+            self.stats["sent"] += 1
+        try:
+            self._send(entry.data, addr)
+            return True
+        except Exception as e:
+            print_error(f"Failed to send message: {e}")
+            return False
+
+    def send_many(
+        self,
+        message_id: str,
+        recipients: Dict[str, tuple],
+        message,
+        on_delivered: Callable = None,
+        on_give_up: Callable = None,
+        transmit: Callable[[bytes], None] = None,
+    ) -> None:
+        """
+        Send one message to every recipient -> addr, each of which ACKs the
+        same message_id; encoded once and retried by one shared timer.
+        `transmit(data)` replaces the first round of unicasts, e.g. with one
+        broadcast; retries always go to each recipient's own address.
+        """
+        data = message if isinstance(message, bytes) else message.encode("utf-8")
+        now = time.monotonic()
+        batch = object()
+        with self._lock:
+            waiting = self._outstanding.setdefault(message_id, {})
+            for recipient, addr in recipients.items():
+                entry = _Outstanding()
+                entry.data = data
+                entry.addr = addr
+                entry.attempts = 1
+                entry.sent_at = now
+                entry.timer = None
+                entry.shared = batch
+                entry.on_delivered = on_delivered
+                entry.on_give_up = on_give_up
+                waiting[recipient] = entry
+            self.stats["sent"] += len(recipients)
+            if recipients:
+                self._wheel.schedule(
+                    self._rtt.max_rto(recipients),
+                    lambda: self._expire_many(message_id, batch, 1),
+                )
+        if not recipients:
+            return
+        if transmit is None:
+            self._send_all(data, list(recipients.values()))
+            return
+        try:
+            transmit(data)
+        except OSError as e:
+            # Left outstanding: the retry timer sends it again
+            print_error(f"Failed to send message: {e}")
+
+    def ack(self, message_id: str, sender: str = None, ip: str = None) -> bool:
+        """Match an incoming ACK; returns False if nothing was waiting for it"""
+        with self._lock:
+            waiting = self._outstanding.get(message_id)
+            if not waiting:
+                return False
+            recipient = sender if sender in waiting else None
+            if sender is None:
+                # Peers that don't put FROM in their ACKs: match by address
+                for candidate, entry in waiting.items():
+                    if ip is None or entry.addr[0] == ip:
+                        recipient = candidate
+                        break
+            if recipient is None:
+                return False
+            entry = waiting.pop(recipient)
+            if not waiting:
+                del self._outstanding[message_id]
+            if entry.timer:
+                # A shared timer finds nothing left to resend and stops by itself
+                entry.timer.cancel()
+            self.stats["delivered"] += 1
+
+        # Karn's rule: an ACK for a resent message can't tell which copy it answers
+        if entry.attempts == 1:
+            self._rtt.observe(recipient, time.monotonic() - entry.sent_at)
+
+        if entry.on_delivered:
+            entry.on_delivered(message_id, recipient)
+        return True
+
+    def _expire(self, message_id: str, recipient: str) -> None:
+        with self._lock:
+            entry = self._outstanding.get(message_id, {}).get(recipient)
+            if entry is None:
+                return
+            if entry.attempts > config.RELIABLE_RETRIES:
+                del self._outstanding[message_id][recipient]
+                if not self._outstanding[message_id]:
+                    del self._outstanding[message_id]
+                self.stats["given_up"] += 1
+                give_up = True
+            else:
+                # Back off per message so one lossy burst doesn't inflate the
+                # peer's RTO for everything else in flight
+                timeout = min(
+                    config.RTO_MAX, self._rtt.rto(recipient) * 2**entry.attempts
+                )
+                entry.attempts += 1
+                entry.timer = self._wheel.schedule(
+                    timeout, lambda: self._expire(message_id, recipient)
+                )
+                self.stats["retransmits"] += 1
+                give_up = False
+
+        if give_up:
+            if config.verbose_mode:
+                print_verbose(f"DROP ! no ACK for {message_id} from {recipient}")
+            if entry.on_give_up:
+                entry.on_give_up(message_id, recipient)
+            return
+
+        if config.verbose_mode:
+            print_verbose(
+                f"RETRY {entry.attempts - 1}/{config.RELIABLE_RETRIES} "
+                f"MESSAGE_ID {message_id} to {recipient}"
+            )
+        try:
+            self._send(entry.data, entry.addr)
+        except Exception as e:
+            print_error(f"Failed to resend message: {e}")
+
+    def _expire_many(self, message_id: str, batch: object, attempts: int) -> None:
+        """The shared timer of a send_many: resend to every recipient still silent"""
+        with self._lock:
+            waiting = self._outstanding.get(message_id, {})
+            pending = {
+                recipient: entry for recipient, entry in waiting.items() if entry.shared is batch
+            }
+            if not pending:
+                return
+            give_up = attempts > config.RELIABLE_RETRIES
+            if give_up:
+                for recipient in pending:
+                    del waiting[recipient]
+                if not waiting:
+                    del self._outstanding[message_id]
+                self.stats["given_up"] += len(pending)
+            else:
+                for entry in pending.values():
+                    entry.attempts += 1
+                timeout = min(config.RTO_MAX, self._rtt.max_rto(pending) * 2**attempts)
+                self._wheel.schedule(
+                    timeout, lambda: self._expire_many(message_id, batch, attempts + 1)
+                )
+                self.stats["retransmits"] += len(pending)
+
+        if give_up:
+            for recipient, entry in pending.items():
+                if config.verbose_mode:
+                    print_verbose(f"DROP ! no ACK for {message_id} from {recipient}")
+                if entry.on_give_up:
+                    entry.on_give_up(message_id, recipient)
+            return
+
+        if config.verbose_mode:
+            print_verbose(
+                f"RETRY {attempts}/{config.RELIABLE_RETRIES} "
+                f"MESSAGE_ID {message_id} to {len(pending)} recipients"
+            )
+        data = next(iter(pending.values())).data
+        self._send_all(data, [entry.addr for entry in pending.values()])
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(len(waiting) for waiting in self._outstanding.values())
+
+
+_wheel = TimerWheel()
+_sender = ReliableSender(wheel=_wheel)
+
+
+def schedule(delay: float, callback: Callable) -> _Timer:
+    """Run callback after delay seconds on the shared timer wheel"""
+    return _wheel.schedule(delay, callback)
+
+
+def send_reliable(
+    message_id: str,
+    recipient: str,
+    message,
+    addr: tuple,
+    on_delivered: Callable = None,
+    on_give_up: Callable = None,
+) -> bool:
+    """Send a message that the recipient must ACK, retrying until it does"""
+    return _sender.send(message_id, recipient, message, addr, on_delivered, on_give_up)
+
+
+def send_reliable_many(
+    message_id: str,
+    recipients: Dict[str, tuple],
+    message,
+    on_delivered: Callable = None,
+    on_give_up: Callable = None,
+    transmit: Callable[[bytes], None] = None,
+) -> None:
+    """Send one message to many recipients (user_id -> addr) that must each ACK it"""
+    _sender.send_many(message_id, recipients, message, on_delivered, on_give_up, transmit)
+
+
+def handle_ack(message_id: str, sender: str = None, ip: str = None) -> bool:
+    return _sender.ack(message_id, sender, ip)
+
+
+def get_reliable_stats() -> Dict:
+    return {**_sender.stats, "in_flight": _sender.in_flight()}
+
+
+register_source("reliable", get_reliable_stats)
@@ -0,0 +1,144 @@
+# network/rtt.py
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+import config
+from network.liveness import DEAD, on_peer_state
+from network.metrics import register_source
+
+ALPHA = 1 / 8  # SRTT gain
+BETA = 1 / 4  # RTTVAR gain
+K = 4  # RTTVAR multiplier in the RTO
+
+
+def _clamp(rto: float) -> float:
+    return min(config.RTO_MAX, max(config.RTO_MIN, rto))
+
+
+def percentile(sorted_samples, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence"""
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+class RttEstimator:
+    """
+    Per-peer smoothed RTT and retransmission timeout (Jacobson/Karels, as in
+    RFC 6298). Callers must only report samples from messages that were
+    sent once (Karn's rule).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._peers: Dict[str, Dict] = {}
+
+    def _state(self, peer: str) -> Dict:
+        state = self._peers.get(peer)
+        if state is None:
+            state = {
+                "srtt": None,
+                "rttvar": None,
+                "rto": _clamp(config.RELIABLE_TIMEOUT),
+                "samples": deque(maxlen=config.RTT_SAMPLES),
+            }
+            self._peers[peer] = state
+        return state
+
+    def observe(self, peer: str, rtt: float) -> None:
+        with self._lock:
+            state = self._state(peer)
+            if state["srtt"] is None:
+                state["srtt"] = rtt
+                state["rttvar"] = rtt / 2
+            else:
+                state["rttvar"] = (1 - BETA) * state["rttvar"] + BETA * abs(
+                    state["srtt"] - rtt
+                )
+                state["srtt"] = (1 - ALPHA) * state["srtt"] + ALPHA * rtt
+            state["rto"] = _clamp(state["srtt"] + K * state["rttvar"])
+            state["samples"].append(rtt)
+
+    def rto(self, peer: str) -> float:
+        with self._lock:
+            state = self._peers.get(peer)
+            return state["rto"] if state else _clamp(config.RELIABLE_TIMEOUT)
+
+    def max_rto(self, peers) -> float:
+        """The longest timeout among `peers`, for one message they all answer"""
+        default = _clamp(config.RELIABLE_TIMEOUT)
+        with self._lock:
+            return max(
+                (self._peers[peer]["rto"] if peer in self._peers else default for peer in peers),
+                default=default,
+            )
+
+    def srtt(self, peer: str) -> Optional[float]:
+        with self._lock:
+            state = self._peers.get(peer)
+            return state["srtt"] if state else None
+
+    def percentiles(self, peer: str) -> Optional[Dict[str, float]]:
+        """p50/p90/p99 of the peer's recent RTT samples, in seconds"""
+        with self._lock:
+            state = self._peers.get(peer)
+            samples = sorted(state["samples"]) if state else []
+        if not samples:
+            return None
+        return {
+            "p50": percentile(samples, 0.5),
+            "p90": percentile(samples, 0.9),
+            "p99": percentile(samples, 0.99),
+        }
+
+    def forget(self, peer: str) -> None:
+        with self._lock:
+            self._peers.pop(peer, None)
+
+    def peers(self):
+        with self._lock:
+            return list(self._peers)
+
+
+_estimator = RttEstimator()
+
+
+def get_estimator() -> RttEstimator:
+    return _estimator
+
+
+def get_rto(peer: str) -> float:
+    return _estimator.rto(peer)
+
+
+def get_srtt(peer: str) -> Optional[float]:
+    return _estimator.srtt(peer)
+
+
+def get_rtt_percentiles(peer: str) -> Optional[Dict[str, float]]:
+    return _estimator.percentiles(peer)
+
+
+def format_rtt(peer: str) -> str:
+    """'p50/p90/p99 ms' for display, or '-' before the first sample"""
+    result = _estimator.percentiles(peer)
+    if not result:
+        return "-"
+    return "/".join(f"{result[p] * 1000:.1f}" for p in ("p50", "p90", "p99"))
+
+
+def get_rtt_stats() -> Dict:
+    stats = {}
+    for peer in _estimator.peers():
+        stats[f"{peer} rtt p50/p90/p99 ms"] = format_rtt(peer)
+        stats[f"{peer} rto ms"] = round(_estimator.rto(peer) * 1000, 1)
+    return stats
+
+
+def _forget_dead(peer: Dict, old: str, new: str) -> None:
+    if new == DEAD:
+        _estimator.forget(peer["user_id"])
+
+
+on_peer_state(_forget_dead)
+register_source("rtt", get_rtt_stats)
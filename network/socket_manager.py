@@ -1,9 +1,21 @@
 import socket
+import sys
 import threading
+import zlib
+from collections import Counter
 
-BUFFER_SIZE = 4096
+BUFFER_SIZE = 65535  # any UDP datagram; advertised to peers as MAX_DATAGRAM
+MAX_DATAGRAM = 65507  # largest IPv4 UDP payload
+RECV_BUFFER = 1 << 20  # kernel receive buffer, room for a full transfer window
 BASE_PORT = 50999  # Default starting port
 MAX_PORT_ATTEMPTS = 100  # Max ports to try (50999 to 51098)
+MULTICAST_GROUP = "239.255.80.99"  # site-local group every node joins, for group file transfers
+GROUP_MULTICAST_PREFIX = "239.255.81."  # per-group addresses for GROUP_MESSAGEs, .1 to .254
+IP_MULTICAST_ALL = 49  # Linux only; the socket module doesn't export it
+
+_listen_sock = None
+_joined = Counter()  # group address -> groups of ours that use it
+_joined_lock = threading.Lock()
 
 
 def is_port_in_use(port):
@@ -21,7 +33,50 @@ def is_port_in_use(port):
             return True
 
 
+def join_multicast(sock, address: str = MULTICAST_GROUP) -> bool:
+    """Receive datagrams sent to a multicast address (MULTICAST_GROUP) on the socket's port"""
+    membership = socket.inet_aton(address) + socket.inet_aton("0.0.0.0")
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        return True
+    except (AttributeError, OSError):
+        return False  # no multicast route: only broadcast group transfers reach this node
+
+
+def group_multicast_address(group_id: str) -> str:
+    """Where multicast GROUP_MESSAGEs of a group go; unrelated groups may share one"""
+    return f"{GROUP_MULTICAST_PREFIX}{zlib.crc32(group_id.encode('utf-8')) % 254 + 1}"
+
+
+def join_group_address(address: str) -> bool:
+    """Have the listening socket receive `address`, once however many groups use it"""
+    with _joined_lock:
+        if _listen_sock is None:
+            return False
+        if not _joined[address] and not join_multicast(_listen_sock, address):
+            return False
+        _joined[address] += 1
+        return True
+
+
+def leave_group_address(address: str) -> None:
+    """Undo one join_group_address; the last group using the address drops it"""
+    with _joined_lock:
+        if not _joined[address]:
+            return
+        _joined[address] -= 1
+        if _joined[address]:
+            return
+        del _joined[address]
+        membership = socket.inet_aton(address) + socket.inet_aton("0.0.0.0")
+        try:
+            _listen_sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, membership)
+        except OSError:
+            pass
+
+
 def start_listening(callback):
+    global _listen_sock
     sock = None
     port = BASE_PORT
 
@@ -35,6 +90,10 @@ def start_listening(callback):
                 sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             except AttributeError:
                 pass  # Not available on all platforms
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+            except OSError:
+                pass
 
             if is_port_in_use(port):
                 print(f"Port {port} in use, trying next...")
@@ -44,6 +103,14 @@ def start_listening(callback):
             sock.bind(("0.0.0.0", port))
 
             print(f"Listening on UDP port {port}")
+            if sys.platform.startswith("linux"):
+                try:
+                    # Only the groups joined on this socket, not every one the host joined
+                    sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+                except OSError:
+                    pass
+            join_multicast(sock)
+            _listen_sock = sock
             break
         except OSError as e:
             print(f"Port {port} in use, trying next... ({e})")
@@ -0,0 +1,309 @@
+# network/swarm.py
+"""
+Downloads pulled from every peer holding the same content. A receiver asks
+the LAN who holds the HASH of a file it accepted (FILE_QUERY); holders
+answer FILE_HAVE and are sent FILE_REQUESTs for parts of the file, which
+they stream as ordinary FILE_CHUNKs under the download's FILEID.
+"""
+import bisect
+import heapq
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import config
+from network import content_store
+from network.message_sender import send_file_have
+from network.reliable import schedule
+from network.transfer_scheduler import RateMeter
+
+
+class _Source:
+    __slots__ = ("peer", "blocks", "seq", "delivered", "meter", "progress_at", "retried", "active", "unacked")
+
+    def __init__(self, peer: str, now: float, clock: Callable):
+        self.peer = peer
+        self.blocks: List[int] = []  # unfinished blocks assigned to it, ascending
+        self.seq = 0  # FILE_REQUEST generation its FILE_ACKs refer to
+        self.delivered = 0  # bytes of new chunks
+        self.meter = RateMeter(0, clock)
+        self.progress_at = now
+        self.retried = False
+        self.active = True
+        self.unacked = 0
+
+
+class SwarmDownload:
+    """
+    Splits a download into blocks of FILE_SWARM_BLOCK bytes and keeps each
+    source FILE_SWARM_HORIZON seconds of work ahead at the rate it has
+    actually delivered, so fast sources end up sending most of the file.
+    A source that delivers nothing for FILE_SWARM_STALL seconds is asked
+    once more and then loses its blocks to the others. Once every block is
+    handed out, a source that runs dry takes over the last block of the one
+    that would finish last, or shares its final block with it.
+
+    Each source only hears about its own share: its FILE_ACKs count every
+    chunk outside its blocks as done, which is also how a block taken away
+    from a source stops being sent by it.
+    """
+
+    def __init__(
+        self,
+        received,
+        chunk_size: int,
+        filesize: int,
+        request: Callable,
+        clock: Callable = time.monotonic,
+        schedule: Callable = schedule,
+    ):
+        self.received = received  # ReceivedChunks shared with the download
+        self.chunk_size = chunk_size
+        self.filesize = filesize
+        self._request = request  # (peer, seq, ranges) -> None
+        self._clock = clock
+        self._schedule = schedule
+        self._lock = threading.Lock()
+        self.block_chunks = max(1, config.FILE_SWARM_BLOCK // chunk_size)
+        count = -(-received.total // self.block_chunks)
+        self._left = [self._missing(block) for block in range(count)]
+        self._owners = [set() for _ in range(count)]
+        self._first = [block * self.block_chunks for block in range(count)]  # no gap before
+        self._free = [block for block in range(count) if self._left[block]]  # heap
+        self._sources: Dict[str, _Source] = {}
+        self.state = "idle"
+        self.started_at = None
+        self.stats = {"requests": 0, "moved": 0, "shared": 0, "dropped": 0}
+
+    def _span(self, block: int) -> range:
+        first = block * self.block_chunks
+        return range(first, min(first + self.block_chunks, self.received.total))
+
+    def _missing(self, block: int) -> int:
+        return sum(1 for index in self._span(block) if index not in self.received)
+
+    def _chunk_bytes(self, index: int) -> int:
+        return max(0, min(self.chunk_size, self.filesize - index * self.chunk_size))
+
+    # --- sources ---
+
+    def add_source(self, peer: str) -> bool:
+        with self._lock:
+            if peer in self._sources or self.state == "stopped":
+                return False
+            if sum(source.active for source in self._sources.values()) >= config.FILE_SWARM_MAX_SOURCES:
+                return False
+            self._sources[peer] = _Source(peer, self._clock(), self._clock)
+            return True
+
+    def has_source(self, peer: str) -> bool:
+        return peer in self._sources
+
+    def sources(self) -> List[str]:
+        return list(self._sources)
+
+    def _drop(self, source: _Source) -> None:
+        source.active = False
+        for block in source.blocks:
+            self._owners[block].discard(source.peer)
+            if not self._owners[block] and self._left[block]:
+                heapq.heappush(self._free, block)
+        source.blocks = []
+        self.stats["dropped"] += 1
+
+    def drop(self, peer: str) -> None:
+        """The source can't serve us, e.g. it answered FILE_CANCEL"""
+        with self._lock:
+            source = self._sources.get(peer)
+            if source and source.active:
+                self._drop(source)
+
+    # --- progress ---
+
+    def on_chunk(self, peer: str, index: int, new: bool) -> int:
+        """Record a chunk from `peer`; returns how many it sent since its last FILE_ACK"""
+        with self._lock:
+            source = self._sources.get(peer)
+            if new:
+                block = index // self.block_chunks
+                self._left[block] -= 1
+                if not self._left[block]:
+                    for owner in self._owners[block]:
+                        self._sources[owner].blocks.remove(block)
+                    self._owners[block].clear()
+            if source is None:
+                return 0
+            if new:
+                source.delivered += self._chunk_bytes(index)
+                source.meter.update(source.delivered)
+                source.progress_at = self._clock()
+                source.retried = False
+            source.unacked += 1
+            return source.unacked
+
+    def _ack(self, source: _Source) -> tuple:
+        cumulative = self.received.total
+        for block in source.blocks:
+            first, stop = self._first[block], self._span(block).stop
+            while first < stop and first in self.received:
+                first += 1
+            self._first[block] = first
+            if first < stop:
+                cumulative = first
+                break
+        return (
+            source.peer,
+            cumulative,
+            self.received.sack(config.FILE_SACK_BITS, cumulative),
+            source.seq,
+        )
+
+    def acks(self, peer: str = None) -> List[tuple]:
+        """(peer, cumulative, sack, seq) for every source with chunks to ack, and for `peer`"""
+        with self._lock:
+            result = []
+            for source in self._sources.values():
+                if source.active and (source.unacked or source.peer == peer):
+                    source.unacked = 0
+                    result.append(self._ack(source))
+            return result
+
+    # --- assignment ---
+
+    def _outstanding(self, source: _Source) -> int:
+        return sum(self._left[block] for block in source.blocks) * self.chunk_size
+
+    def _finish_time(self, source: _Source) -> float:
+        rate = source.meter.rate()
+        outstanding = self._outstanding(source)
+        return outstanding / rate if rate > 0 else float("inf")
+
+    def _assign(self, source: _Source, block: int) -> None:
+        self._owners[block].add(source.peer)
+        bisect.insort(source.blocks, block)
+
+    def _top_up(self, source: _Source, active: List[_Source]) -> bool:
+        rate = source.meter.rate()
+        block_bytes = self.block_chunks * self.chunk_size
+        want = max(block_bytes, rate * config.FILE_SWARM_HORIZON)
+        outstanding = self._outstanding(source)
+        if outstanding >= want / 2:
+            return False
+        changed = False
+        while outstanding < want and self._free:
+            block = heapq.heappop(self._free)
+            if not self._left[block] or self._owners[block]:
+                continue
+            self._assign(source, block)
+            outstanding += self._left[block] * self.chunk_size
+            changed = True
+        if changed or outstanding or rate <= 0:
+            return changed
+        # Nothing left to hand out: help whoever would finish last
+        others = [other for other in active if other is not source and other.blocks]
+        if not others:
+            return False
+        victim = max(others, key=self._finish_time)
+        block = victim.blocks[-1]
+        mine = self._left[block] * self.chunk_size / rate
+        if len(victim.blocks) > 1 and self._finish_time(victim) > mine:
+            victim.blocks.remove(block)
+            self._owners[block].discard(victim.peer)
+            self.stats["moved"] += 1
+        elif len(self._owners[block]) == 1 and self._finish_time(victim) > 2 * mine:
+            self.stats["shared"] += 1
+        else:
+            return False
+        self._assign(source, block)
+        return True
+
+    def _wanted(self, source: _Source) -> str:
+        runs = []
+        for block in source.blocks:
+            span = self._span(block)
+            index = self._first[block]
+            while index < span.stop and len(runs) < config.FILE_RESUME_MAX_RANGES:
+                if index in self.received:
+                    index += 1
+                    continue
+                first = index
+                while index < span.stop and index not in self.received:
+                    index += 1
+                runs.append(f"{first}-{index - 1}")
+        return ",".join(runs)
+
+    def _request_args(self, source: _Source) -> tuple:
+        source.seq += 1
+        self.stats["requests"] += 1
+        return source.peer, source.seq, self._wanted(source)
+
+    def start(self) -> None:
+        with self._lock:
+            if self.state != "idle":
+                return
+            self.state = "running"
+            self.started_at = self._clock()
+        self._tick()
+
+    def stop(self) -> None:
+        with self._lock:
+            self.state = "stopped"
+
+    def _tick(self) -> None:
+        requests = []
+        with self._lock:
+            if self.state != "running":
+                return
+            now = self._clock()
+            active = [source for source in self._sources.values() if source.active]
+            for source in active:
+                if source.blocks and now - source.progress_at >= config.FILE_SWARM_STALL:
+                    if source.retried:
+                        self._drop(source)
+                        continue
+                    # Maybe only the FILE_REQUEST or its ACKs went missing
+                    source.retried = True
+                    source.progress_at = now
+                    requests.append(self._request_args(source))
+            active = [source for source in active if source.active]
+            # The fastest source gets the first pick of the blocks left
+            for source in sorted(active, key=lambda s: s.meter.rate(), reverse=True):
+                if self._top_up(source, active):
+                    requests.append(self._request_args(source))
+        for args in requests:
+            self._request(*args)
+        self._schedule(config.FILE_SWARM_TICK, self._tick)
+
+    def summary(self) -> Dict:
+        end = self._clock()
+        elapsed = end - self.started_at if self.started_at is not None else 0.0
+        return {
+            "sources": {
+                peer: round(source.delivered / elapsed / 1024, 1) if elapsed else 0.0
+                for peer, source in self._sources.items()
+            },
+            "elapsed": round(elapsed, 3),
+            **self.stats,
+        }
+
+
+def held_file(digest: str) -> Optional[str]:
+    """Path of a file with this content, in the content store or being sent"""
+    if not digest:
+        return None
+    path = content_store.lookup(digest)
+    if path:
+        return path
+    for transfer in list(config.active_file_transfers.values()):
+        if transfer.get("hash") == digest and os.path.exists(transfer["filepath"]):
+            return transfer["filepath"]
+    return None
+
+
+def handle_file_query(content: Dict, addr: tuple, my_info: Dict) -> None:
+    """Someone is downloading content we hold: offer to be one of its sources"""
+    if content["FILEID"] in config.active_file_transfers:
+        return  # we are the sender of that download already
+    if held_file(content.get("HASH", "")):
+        send_file_have(content["FILEID"], content["FROM"], content["HASH"], my_info)
@@ -0,0 +1,147 @@
+# network/tcp_transfer.py
+"""
+Bulk file data over a TCP side channel. A FILE_OFFER may carry TCP_PORT, a
+listener the sender opened for that one file; the receiver connects, names
+the file and identifies itself with the same FILEID and file-scope TOKEN
+its UDP messages carry, and the sender streams the raw bytes with
+socket.sendfile from OFFSET on. The kernel copies the file straight to the
+socket and does the pacing and loss repair that FILE_CHUNKs do in Python.
+Whatever goes wrong, the transfer carries on as FILE_CHUNKs over UDP.
+
+Request, the only thing the receiver sends:
+    TYPE: FILE_FETCH / FROM / FILEID / OFFSET / TOKEN
+"""
+import socket
+import threading
+from typing import Callable, Dict, Iterator
+
+import config
+from network.token_utils import generate_token
+
+_MAX_REQUEST = 4096
+
+
+def request_message(fileid: str, offset: int, sender_info: Dict) -> bytes:
+    return (
+        "TYPE: FILE_FETCH\n"
+        f"FROM: {sender_info['user_id']}\n"
+        f"FILEID: {fileid}\n"
+        f"OFFSET: {offset}\n"
+        f"TOKEN: {generate_token(sender_info['user_id'], 'file')}\n\n"
+    ).encode("utf-8")
+
+
+def _read_request(conn: socket.socket) -> Dict:
+    data = b""
+    while b"\n\n" not in data:
+        piece = conn.recv(_MAX_REQUEST - len(data))
+        if not piece or len(data) + len(piece) >= _MAX_REQUEST:
+            raise ConnectionError("incomplete FILE_FETCH")
+        data += piece
+    content = {}
+    for line in data.decode("utf-8", errors="ignore").splitlines():
+        if ":" in line:
+            key, value = line.split(":", 1)
+            content[key.strip()] = value.strip()
+    return content
+
+
+class FileListener:
+    """
+    Listens on an ephemeral port for the receiver of one offered file.
+    `handler(conn, addr, request)` authorizes and serves a connection; once
+    it has taken one, or close() is called, the port is closed. Connections
+    it refuses are dropped and the listener keeps waiting.
+    """
+
+    def __init__(self, handler: Callable[[socket.socket, tuple, Dict], bool]):
+        self._handler = handler
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self._sock.bind(("0.0.0.0", 0))
+            self._sock.listen(4)
+            # Polled, so close() from another thread ends the accept loop
+            self._sock.settimeout(0.5)
+        except OSError:
+            self._sock.close()
+            raise
+        self.port = self._sock.getsockname()[1]
+        self.state = "listening"  # then "serving", "sent", "failed" or "closed"
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self) -> None:
+        while self.state == "listening":
+            try:
+                conn, addr = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                conn.settimeout(config.FILE_TCP_TIMEOUT)
+                taken = self._handler(conn, addr, _read_request(conn))
+            except OSError:
+                taken = False
+            conn.close()
+            if taken:
+                break
+        self._sock.close()
+
+    def close(self) -> None:
+        """Stop waiting for a connection; one already being served carries on"""
+        if self.state == "listening":
+            self.state = "closed"
+
+
+def serve_file(
+    conn: socket.socket,
+    path: str,
+    offset: int,
+    count: int,
+    progress: Callable[[int], None],
+    pace: Callable[[int], None] = None,
+    segment: int = None,
+) -> None:
+    """
+    Send `count` bytes of `path` from `offset` in `segment`-byte sendfile
+    calls (FILE_TCP_SEGMENT), reporting each one sent. `pace(size)` is
+    called before each and blocks until that many bytes may go.
+    """
+    segment = segment or config.FILE_TCP_SEGMENT
+    with open(path, "rb") as f:
+        end = offset + count
+        while offset < end:
+            size = min(segment, end - offset)
+            if pace:
+                pace(size)
+            sent = conn.sendfile(f, offset, size)
+            if not sent:
+                raise ConnectionError(f"{path} ended early")
+            offset += sent
+            progress(sent)
+    # Let the receiver read everything before the connection is closed
+    conn.shutdown(socket.SHUT_WR)
+
+
+def fetch(
+    addr: tuple, fileid: str, offset: int, count: int, piece: int, sender_info: Dict
+) -> Iterator[memoryview]:
+    """
+    Connect to a sender's listener and yield the `count` bytes from `offset`
+    in pieces of `piece` bytes (the last may be shorter). Each piece is only
+    valid until the next one is read. Raises OSError if the stream breaks.
+    """
+    with socket.create_connection(addr, timeout=config.FILE_TCP_TIMEOUT) as conn:
+        conn.sendall(request_message(fileid, offset, sender_info))
+        buffer = bytearray(piece)
+        view = memoryview(buffer)
+        while count:
+            want = min(piece, count)
+            filled = 0
+            while filled < want:
+                received = conn.recv_into(view[filled:want])
+                if not received:
+                    raise ConnectionError(f"connection closed with {count - filled} bytes to go")
+                filled += received
+            count -= want
+            yield view[:want]
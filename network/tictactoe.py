@@ -2,8 +2,9 @@
 import time
 import secrets
 from ui.utils import print_info, print_error, print_success
-from network.message_sender import send_unicast, send_ack
+from network.message_sender import send_ack
 from network.peer_registry import get_peer
+from network.reliable import send_reliable
 
 WINNING_COMBINATIONS = [
     (0, 1, 2),
@@ -19,6 +20,13 @@ WINNING_COMBINATIONS = [
 games = {}  # GAMEID -> {board, players, turn, symbol_map, last_turn_received}
 
 
+def _give_up(what):
+    def callback(message_id, recipient):
+        print_error(f"{recipient} did not acknowledge {what}")
+
+    return callback
+
+
 def format_board(board):
     def symbol(pos):
         return board[pos] if board[pos] else str(pos)
@@ -62,7 +70,13 @@ def send_invite(recipient_id, symbol, sender_info):
         f"TOKEN: {token}\n\n"
     )
 
-    send_unicast(message, (peer["ip"], int(peer["port"])))
+    send_reliable(
+        message_id,
+        recipient_id,
+        message,
+        (peer["ip"], int(peer["port"])),
+        on_give_up=_give_up(f"the invite to game {game_id}"),
+    )
 
     games[game_id] = {
         "board": [None] * 9,
@@ -125,7 +139,13 @@ def send_move(game_id, position, sender_info):
         f"TOKEN: {token}\n\n"
     )
 
-    send_unicast(message, (peer["ip"], int(peer["port"])))
+    send_reliable(
+        message_id,
+        peer_id,
+        message,
+        (peer["ip"], int(peer["port"])),
+        on_give_up=_give_up(f"your move {turn} in game {game_id}"),
+    )
 
     print_info(f"You played at position {position} in game {game_id}")
     print(format_board(game["board"]))
@@ -164,7 +184,13 @@ def send_result(game_id, result, winning_line, sender_info):
         f"TIMESTAMP: {int(time.time())}\n\n"
     )
 
-    send_unicast(message, (peer["ip"], int(peer["port"])))
+    send_reliable(
+        message_id,
+        peer_id,
+        message,
+        (peer["ip"], int(peer["port"])),
+        on_give_up=_give_up(f"the result of game {game_id}"),
+    )
     print_success(f"Game {game_id} ended: {result}")
 
 
@@ -198,7 +224,7 @@ def handle_move(content, addr, my_info):
 
     if game_id not in games:
         print_error(f"Move for unknown game {game_id}")
-    return
+        return
 
     game = games[game_id]
     if (game_id, turn) in game["last_turn_received"]:
@@ -0,0 +1,186 @@
+# network/transfer_scheduler.py
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+import config
+from network.metrics import register_source
+from ui.utils import print_error
+
+
+class RateMeter:
+    """Progress of one transfer over the last FILE_RATE_WINDOW seconds"""
+
+    def __init__(self, total: int, clock: Callable = time.monotonic):
+        self.total = total
+        self.done = 0
+        self._clock = clock
+        self.started_at = clock()
+        self._samples = deque([(self.started_at, 0)])
+
+    def update(self, done: int) -> None:
+        now = self._clock()
+        self.done = done
+        self._samples.append((now, done))
+        while len(self._samples) > 2 and now - self._samples[1][0] > config.FILE_RATE_WINDOW:
+            self._samples.popleft()
+
+    def rate(self) -> float:
+        """Bytes per second over the window, counting the idle time since the last update"""
+        first_at, first_done = self._samples[0]
+        elapsed = self._clock() - first_at
+        return (self.done - first_done) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        rate = self.rate()
+        if self.done >= self.total:
+            return 0.0
+        return (self.total - self.done) / rate if rate > 0 else None
+
+
+class _Flow:
+    __slots__ = ("key", "transmit", "queue", "deficit", "bytes_sent")
+
+    def __init__(self, key: str, transmit: Callable):
+        self.key = key
+        self.transmit = transmit  # (item) -> bool, False if nothing was sent
+        self.queue = deque()  # (item, size)
+        self.deficit = 0
+        self.bytes_sent = 0
+
+
+class TransferScheduler:
+    """
+    Sends the chunks of every upload from one thread. Uploads take turns in
+    deficit round-robin by bytes, so a transfer with large chunks gets no
+    more bandwidth than one with small chunks. A token bucket caps the total
+    at FILE_RATE_LIMIT bytes/s and leaves the rest of the link to chat and
+    game traffic. Sending here also keeps bursts of chunks off the listener
+    thread.
+    """
+
+    def __init__(
+        self,
+        rate: float = None,
+        quantum: int = None,
+        clock: Callable = time.monotonic,
+    ):
+        self.rate = config.FILE_RATE_LIMIT if rate is None else rate
+        self.quantum = quantum or config.FILE_DRR_QUANTUM
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._flows: Dict[str, _Flow] = {}
+        self._active = deque()  # keys of flows with queued chunks, in turn order
+        self._tokens = 0.0
+        self._refilled_at = clock()
+        self._thread = None
+        self.stats = {"chunks_sent": 0, "bytes_sent": 0, "skipped": 0, "throttled": 0}
+
+    def add_flow(self, key: str, transmit: Callable) -> None:
+        with self._cond:
+            self._flows[key] = _Flow(key, transmit)
+
+    def remove_flow(self, key: str) -> None:
+        """Forget a finished upload along with anything it still had queued"""
+        with self._cond:
+            self._flows.pop(key, None)
+
+    def enqueue(self, key: str, item, size: int) -> None:
+        with self._cond:
+            flow = self._flows.get(key)
+            if flow is None:
+                return
+            if not flow.queue:
+                self._active.append(key)
+            flow.queue.append((item, size))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def queued(self) -> int:
+        with self._cond:
+            return sum(len(flow.queue) for flow in self._flows.values())
+
+    def flows(self) -> int:
+        with self._cond:
+            return len(self._flows)
+
+    def _refill(self, now: float, size: int) -> None:
+        # A burst of up to one quantum (or one chunk) after idling; no more
+        self._tokens = min(
+            float(max(self.quantum, size)),
+            self._tokens + (now - self._refilled_at) * self.rate,
+        )
+        self._refilled_at = now
+
+    def _next(self):
+        """Wait for the next chunk due under DRR and the rate cap, and claim it"""
+        with self._cond:
+            while True:
+                while self._active and self._active[0] not in self._flows:
+                    self._active.popleft()
+                if not self._active:
+                    self._cond.wait()
+                    continue
+                flow = self._flows[self._active[0]]
+                if not flow.queue:
+                    self._active.popleft()
+                    flow.deficit = 0
+                    continue
+                item, size = flow.queue[0]
+                if flow.deficit < size:
+                    # Turn over: top up and go to the back of the line
+                    flow.deficit += self.quantum
+                    self._active.rotate(-1)
+                    continue
+                if self.rate:
+                    now = self._clock()
+                    self._refill(now, size)
+                    if self._tokens < size:
+                        self.stats["throttled"] += 1
+                        self._cond.wait((size - self._tokens) / self.rate)
+                        continue
+                    self._tokens -= size
+                flow.queue.popleft()
+                flow.deficit -= size
+                if not flow.queue:
+                    self._active.popleft()
+                    flow.deficit = 0
+                return flow, item, size
+
+    def _run(self) -> None:
+        while True:
+            flow, item, size = self._next()
+            try:
+                sent = flow.transmit(item)
+            except Exception as e:
+                print_error(f"Failed to send chunk {item} of {flow.key}: {e}")
+                sent = False
+            with self._cond:
+                if sent:
+                    flow.bytes_sent += size
+                    self.stats["chunks_sent"] += 1
+                    self.stats["bytes_sent"] += size
+                else:
+                    self.stats["skipped"] += 1
+
+
+_scheduler = TransferScheduler()
+
+
+def get_scheduler() -> TransferScheduler:
+    return _scheduler
+
+
+def get_scheduler_stats() -> Dict:
+    return {
+        **_scheduler.stats,
+        "uploads": _scheduler.flows(),
+        "queued": _scheduler.queued(),
+        "rate_limit": _scheduler.rate or "none",
+    }
+
+
+register_source("transfer_scheduler", get_scheduler_stats)
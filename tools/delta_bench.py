@@ -0,0 +1,107 @@
+# tools/delta_bench.py
+"""
+Bytes on the wire for a new revision of a file: sent whole vs as a delta
+against the revision the receiver already has, for typical kinds of edit.
+
+The wire cost of a delta is the receiver's block signatures plus the delta
+stream; build is the sender's search for matching blocks and apply is the
+receiver's rebuild and hash check. Every rebuilt file is checked against
+the digest of the new revision.
+
+    python -m tools.delta_bench --size-mb 16
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import config
+from network import delta
+from network.integrity import HASH_ALGORITHM, file_digest
+
+
+def _edits(base: bytes, rng: random.Random) -> dict:
+    size = len(base)
+    middle = size // 2
+
+    def scattered(count: int) -> bytes:
+        data = bytearray(base)
+        for _ in range(count):
+            at = rng.randrange(size - 64)
+            data[at:at + 64] = rng.randbytes(64)
+        return bytes(data)
+
+    return {
+        "identical": base,
+        "append 64K": base + rng.randbytes(64 * 1024),
+        "overwrite 4K": base[:middle] + rng.randbytes(4096) + base[middle + 4096:],
+        "insert start": rng.randbytes(1000) + base,
+        "insert middle": base[:middle] + rng.randbytes(1000) + base[middle:],
+        "delete 256K": base[:middle] + base[middle + 256 * 1024:],
+        "scattered 16": scattered(16),
+        "scattered 256": scattered(256),
+        "rewrite": rng.randbytes(size),
+    }
+
+
+def run(basis: str, new: str, work: str) -> dict:
+    basis_size = os.path.getsize(basis)
+    size = os.path.getsize(new)
+    block = delta.block_size(basis_size, config.FILE_DELTA_BLOCK_MIN, config.FILE_DELTA_MAX_BLOCKS)
+    signatures = delta.signatures(basis, block)
+
+    stream = os.path.join(work, "delta")
+    start = time.perf_counter()
+    result = delta.make_delta(new, block, signatures, stream, config.FILE_DELTA_SCAN_LIMIT)
+    built = time.perf_counter() - start
+
+    rebuilt = os.path.join(work, "rebuilt")
+    start = time.perf_counter()
+    digest = delta.apply_delta(basis, stream, rebuilt, HASH_ALGORITHM)
+    applied = time.perf_counter() - start
+
+    wire = len(signatures) + result["delta_size"]
+    sent = "delta" if result["delta_size"] <= size * config.FILE_DELTA_MAX_RATIO else "whole"
+    return {
+        "block": block,
+        "sigs KB": round(len(signatures) / 1024, 1),
+        "delta KB": round(result["delta_size"] / 1024, 1),
+        "full KB": round(size / 1024, 1),
+        "saving": f"{1 - wire / size:.1%}",
+        "sent": sent,
+        "build s": round(built, 2),
+        "apply s": round(applied, 2),
+        "ok": digest == file_digest(new),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delta vs whole-file transfer of a new revision")
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    base = rng.randbytes(int(args.size_mb * 2**20))
+    work = tempfile.mkdtemp()
+    basis = os.path.join(work, "basis")
+    with open(basis, "wb") as f:
+        f.write(base)
+
+    columns = ["block", "sigs KB", "delta KB", "full KB", "saving", "sent", "build s", "apply s", "ok"]
+    print(f"{'edit':>14}  " + "  ".join(f"{c:>9}" for c in columns))
+    try:
+        for number, (name, data) in enumerate(_edits(base, rng).items()):
+            new = os.path.join(work, f"new{number}")
+            with open(new, "wb") as f:
+                f.write(data)
+            result = run(basis, new, work)
+            print(f"{name:>14}  " + "  ".join(f"{str(result[c]):>9}" for c in columns))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# tools/group_delivery_bench.py
+"""
+Where broadcast and multicast start to beat unicast for one GROUP_MESSAGE.
+
+Measures, on this host:
+  - the sender's call for n members: a unicast per member vs one datagram
+    to a broadcast or multicast address (ACK tracking is the same for all
+    three and included)
+  - what one GROUP_MESSAGE costs a node through main.handle_message: a
+    member handling it, and a non-member dropping it with the early filter
+    and without it (the path every message took before)
+
+and from those, per LAN size L, the smallest group for which a one-to-many
+send costs the LAN less CPU than n unicasts, using a straight-line fit of
+each sender's cost against n. A broadcast also costs each of the L - n
+non-members a drop; a multicast costs them nothing, since their kernel
+filters it. Members' own handling is the same either way and is left out.
+GROUP_FANOUT_MIN_MEMBERS and GROUP_BROADCAST_MIN_COVERAGE in config.py come
+from this table.
+
+    python -m tools.group_delivery_bench --lan 20 50 100 200
+"""
+import argparse
+import contextlib
+import io
+import socket
+import statistics
+import time
+
+import config
+from network.broadcast import broadcast_address, my_info, send_broadcast, send_multicast
+from network.peer_registry import add_peer
+from network.reliable import ReliableSender, TimerWheel
+from network.socket_manager import group_multicast_address
+from network.token_utils import generate_token
+
+_RUNS = 200
+
+
+def _median_us(times: list) -> float:
+    return statistics.median(times) * 1e6
+
+
+def _sinks(count: int) -> tuple:
+    sinks, addresses = [], {}
+    for number in range(count):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(("127.0.0.1", 0))
+        sink.setblocking(False)
+        port = sink.getsockname()[1]
+        sinks.append(sink)
+        addresses[f"m{number}@127.0.0.1:{port}"] = ("127.0.0.1", port)
+    return sinks, addresses
+
+
+def _drain(sinks: list) -> None:
+    for sink in sinks:
+        try:
+            while sink.recv(65535):
+                pass
+        except BlockingIOError:
+            pass
+
+
+def sender_us(members: int, transport: str) -> float:
+    """Median µs of the sender's call to reach `members` members"""
+    sinks, addresses = _sinks(members)
+    # One port, as on a LAN where every node listens on the default one
+    port = next(iter(addresses.values()))[1]
+    if transport == "broadcast":
+        target = broadcast_address()
+        transmit = lambda data: send_broadcast(data, [port])
+    elif transport == "multicast":
+        target = group_multicast_address("bench")
+        transmit = lambda data: send_multicast(data, target, [port])
+    else:
+        transmit = None
+    sender = ReliableSender(wheel=TimerWheel(tick=3600))
+    message = "TYPE: GROUP_MESSAGE\nGROUP_ID: bench\nCONTENT: hello\nMESSAGE_ID: {}\n\n"
+    times = []
+    try:
+        for number in range(_RUNS):
+            message_id = f"{number:08x}"
+            start = time.perf_counter()
+            sender.send_many(message_id, addresses, message.format(message_id), transmit=transmit)
+            times.append(time.perf_counter() - start)
+            for member in addresses:
+                sender.ack(message_id, member)
+            _drain(sinks)
+    finally:
+        for sink in sinks:
+            sink.close()
+    return _median_us(times)
+
+
+def receiver_us() -> dict:
+    """Median µs for a node to handle one GROUP_MESSAGE, as member and non-member"""
+    import main
+    from network.group_manager import _groups
+
+    ack_sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ack_sink.bind(("127.0.0.1", 0))
+    ack_sink.setblocking(False)
+    sender_id = f"tx@127.0.0.1:{ack_sink.getsockname()[1]}"
+    me = "rx@127.0.0.1:1"
+    my_info.update({"user_id": me, "username": "rx"})
+    add_peer(sender_id, "127.0.0.1", ack_sink.getsockname()[1])
+    _groups["ours"] = {"name": "ours", "creator": sender_id, "members": {sender_id, me}}
+    _groups["theirs"] = {"name": "theirs", "creator": sender_id, "members": {sender_id}}
+    token = generate_token(sender_id, "group")
+
+    def handle(group_id: str, runs: int = _RUNS) -> float:
+        times = []
+        for number in range(runs):
+            message = (
+                f"TYPE: GROUP_MESSAGE\nFROM: {sender_id}\nGROUP_ID: {group_id}\n"
+                f"CONTENT: hello\nTIMESTAMP: {int(time.time())}\n"
+                f"MESSAGE_ID: {group_id}{number:08x}\nTOKEN: {token}\n\n"
+            )
+            start = time.perf_counter()
+            main.handle_message(message, ("127.0.0.1", 9))
+            times.append(time.perf_counter() - start)
+            _drain([ack_sink])
+        return _median_us(times)
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = {"member": handle("ours"), "drop": handle("theirs")}
+            early = main.is_group_recipient
+            main.is_group_recipient = lambda content, info: True
+            try:
+                result["drop, no early filter"] = handle("theirs")
+            finally:
+                main.is_group_recipient = early
+    finally:
+        ack_sink.close()
+        for group_id in ("ours", "theirs"):
+            _groups.pop(group_id, None)
+    return result
+
+
+def crossover(unicast: tuple, other: tuple, drop: float, lan: int) -> int:
+    """
+    Smallest group of a LAN of `lan` nodes for which `other` costs less than
+    unicast; each cost is a (µs per member, fixed µs) fit of the sender
+    """
+    # other_fixed + other_slope*n + (lan - n)*drop < unicast_fixed + unicast_slope*n
+    saving = unicast[0] - other[0] + drop
+    if saving <= 0:
+        return None
+    members = int((other[1] - unicast[1] + lan * drop) / saving) + 1
+    return max(members, 1) if members <= lan else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Unicast vs broadcast vs multicast group messages")
+    parser.add_argument("--members", type=int, nargs="+", default=[2, 4, 8, 16, 32, 64, 128, 256])
+    parser.add_argument("--lan", type=int, nargs="+", default=[20, 50, 100, 200])
+    args = parser.parse_args()
+    config.verbose_mode = False
+
+    receive = receiver_us()
+    print("per node, µs: " + ", ".join(f"{name} {us:.1f}" for name, us in receive.items()))
+
+    sends = {transport: {} for transport in ("unicast", "broadcast", "multicast")}
+    print(f"\n{'members':>7}  " + "  ".join(f"{t + ' µs':>12}" for t in sends))
+    for members in args.members:
+        for transport in sends:
+            sends[transport][members] = sender_us(members, transport)
+        print(f"{members:>7}  " + "  ".join(f"{sends[t][members]:>12.1f}" for t in sends))
+
+    fits = {
+        transport: tuple(statistics.linear_regression(list(costs), list(costs.values())))
+        for transport, costs in sends.items()
+    }
+    print(
+        "\nfit, µs: "
+        + ", ".join(f"{t} {fixed:.1f} + {slope:.2f}/member" for t, (slope, fixed) in fits.items())
+    )
+
+    drop = receive["drop"]
+    print(f"\n{'LAN':>5}  {'multicast from':>14}  {'broadcast from':>14}  {'coverage':>8}")
+    for lan in args.lan:
+        multicast = crossover(fits["unicast"], fits["multicast"], 0, lan)
+        broadcast = crossover(fits["unicast"], fits["broadcast"], drop, lan)
+        coverage = f"{broadcast / lan:.0%}" if broadcast else "-"
+        print(f"{lan:>5}  {str(multicast or '-'):>14}  {str(broadcast or '-'):>14}  {coverage:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# tools/group_fanout_bench.py
+"""
+Cost of fanning one group message out to N members on loopback: a
+reliable send per member (look the peer up, encode, schedule its own
+retry timer, sendto) vs one send_reliable_many (one address pass, one
+encoding, one shared timer, a tight sendto loop on one socket).
+
+"send ms" is the sender's call; "ack ms" is matching every member's ACK
+against the outstanding entries. Every member binds its own socket, and
+each run checks that all of them received the datagram.
+
+    python -m tools.group_fanout_bench --members 10 50 200 --runs 50
+"""
+import argparse
+import socket
+import statistics
+import time
+
+from network.peer_registry import add_peer, get_peer, get_peer_addresses
+from network.reliable import ReliableSender, TimerWheel
+
+
+def _members(count: int) -> tuple:
+    sinks, ids = [], []
+    for number in range(count):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(("127.0.0.1", 0))
+        sink.setblocking(False)
+        port = sink.getsockname()[1]
+        user_id = f"m{number}@127.0.0.1:{port}"
+        add_peer(user_id, "127.0.0.1", port)
+        sinks.append(sink)
+        ids.append(user_id)
+    return sinks, ids
+
+
+def _drain(sinks: list) -> int:
+    """How many members received something"""
+    reached = 0
+    for sink in sinks:
+        got = False
+        try:
+            while sink.recv(65535):
+                got = True
+        except BlockingIOError:
+            pass
+        reached += got
+    return reached
+
+
+def per_member(sender: ReliableSender, message_id: str, ids: list, message: str) -> None:
+    for member in ids:
+        peer = get_peer(member)
+        sender.send(message_id, member, message, (peer["ip"], peer["port"]))
+
+
+def fanout(sender: ReliableSender, message_id: str, ids: list, message: str) -> None:
+    sender.send_many(message_id, get_peer_addresses(ids), message)
+
+
+def run(path, count: int, runs: int) -> dict:
+    sinks, ids = _members(count)
+    # A wheel that never ticks: no retries fire while timing
+    sender = ReliableSender(wheel=TimerWheel(tick=3600))
+    sends, acks, reached = [], [], 0
+    try:
+        for number in range(runs):
+            message_id = f"{number:08x}"
+            message = (
+                "TYPE: GROUP_MESSAGE\nFROM: bench@127.0.0.1:1\nGROUP_ID: g\n"
+                f"CONTENT: {'hello ' * 10}\nMESSAGE_ID: {message_id}\n\n"
+            )
+            start = time.perf_counter()
+            path(sender, message_id, ids, message)
+            sends.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            for member in ids:
+                sender.ack(message_id, member)
+            acks.append(time.perf_counter() - start)
+            reached += _drain(sinks) == count
+    finally:
+        for sink in sinks:
+            sink.close()
+    return {
+        "send ms": round(statistics.median(sends) * 1000, 3),
+        "best ms": round(min(sends) * 1000, 3),
+        "ack ms": round(statistics.median(acks) * 1000, 3),
+        "us/member": round(statistics.median(sends) / count * 1e6, 2),
+        "reached": f"{reached}/{runs}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-member sends vs one fanout for a group message")
+    parser.add_argument("--members", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    columns = ["send ms", "best ms", "ack ms", "us/member", "reached"]
+    print(f"{'members':>7}  {'path':>10}  " + "  ".join(f"{c:>9}" for c in columns))
+    for count in args.members:
+        results = {}
+        for name, path in (("per-member", per_member), ("fanout", fanout)):
+            results[name] = run(path, count, args.runs)
+            row = results[name]
+            print(f"{count:>7}  {name:>10}  " + "  ".join(f"{str(row[c]):>9}" for c in columns))
+        speedup = results["per-member"]["send ms"] / results["fanout"]["send ms"]
+        print(f"{'':>7}  {'speedup':>10}  {speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+# tools/group_transfer_bench.py
+"""
+One file to N group members: a unicast transfer per member vs one group
+transfer broadcast to all of them with NACK repair.
+
+Each member runs as a child process with its own UDP port and drops each
+FILE_CHUNK it receives with probability --loss, independently of the other
+members (the worst case for repair, since no two members miss the same
+chunk). Both modes go through the real offer, accept and completion
+messages. On this host every member listens on its own port, so the group
+sender puts one copy of each chunk on the wire per member port; on a LAN
+where nodes share the default port that is a single datagram.
+
+    python -m tools.group_transfer_bench --members 8 --loss 0.01
+"""
+import argparse
+import contextlib
+import filecmp
+import io
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import config
+from network.broadcast import my_info
+from network.peer_registry import add_peer
+from network.socket_manager import MAX_DATAGRAM
+
+def _parse(data: bytes) -> dict:
+    content = {}
+    for line in data.decode("utf-8", errors="ignore").splitlines():
+        if ":" in line:
+            key, value = line.split(":", 1)
+            content[key.strip()] = value.strip()
+    return content
+
+
+def _serve(sock: socket.socket, handle) -> None:
+    while True:
+        try:
+            data, addr = sock.recvfrom(65535)
+        except OSError:
+            return
+        handle(_parse(data), addr)
+
+
+def member(args) -> None:
+    """Child process: accept every offer and save what arrives under args.out"""
+    from network.file_transfer import accept_incoming, handle_file_cancel, handle_file_chunk
+    from network.group_manager import handle_group_create
+    from network.message_sender import send_ack
+    from network.reliable import handle_ack
+
+    config.GROUP_FILE_TRANSPORT = args.transport
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sock.bind(("0.0.0.0", args.port))
+    if args.transport == "multicast":
+        from network.socket_manager import join_multicast
+
+        join_multicast(sock)
+    info = {"user_id": f"m{args.port}@127.0.0.1:{args.port}"}
+    my_info.update(info)
+    add_peer(args.tx_id, "127.0.0.1", int(args.tx_id.rsplit(":", 1)[1]), max_datagram=MAX_DATAGRAM)
+    rng = random.Random(args.port)
+
+    def handle(content, addr):
+        kind = content.get("TYPE")
+        if kind == "FILE_CHUNK":
+            if rng.random() >= args.loss:
+                handle_file_chunk(content, addr, info)
+        elif kind == "FILE_OFFER":
+            send_ack(content["MESSAGE_ID"], content["FROM"])
+            fileid = content["FILEID"]
+            if fileid not in config.incoming_files:
+                config.incoming_files[fileid] = {
+                    "from": content["FROM"],
+                    "filename": os.path.join(args.out, f"{fileid}-{args.port}.bin"),
+                    "filesize": int(content["FILESIZE"]),
+                    "chunk_size": int(content["CHUNK_SIZE"]),
+                    "hash": content.get("HASH"),
+                    "group_id": content.get("GROUP_ID"),
+                    "accepted": False,
+                }
+                accept_incoming(fileid, info)
+        elif kind == "ACK":
+            handle_ack(content.get("MESSAGE_ID", ""), content.get("FROM"), addr[0])
+        elif kind == "GROUP_CREATE":
+            handle_group_create(content, addr, info)
+        elif kind == "FILE_CANCEL":
+            handle_file_cancel(content, addr, info)
+
+    print("ready", flush=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _serve(sock, handle)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run(path: str, members: int, loss: float, transport: str) -> dict:
+    from network.file_transfer import handle_file_accept, handle_file_ack, stop_transfer
+    from network.group_manager import create_group
+    from network.group_transfer import (
+        _history,
+        handle_file_nack,
+        handle_group_file_answer,
+        handle_group_file_received,
+        send_group_file,
+    )
+    from network.message_sender import send_ack, send_file_offer
+    from network.reliable import handle_ack
+
+    config.GROUP_FILE_TRANSPORT = transport
+    work = tempfile.mkdtemp()
+    config.FILE_CHECKPOINT_DIR = os.path.join(work, "state")
+
+    tx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tx_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    tx_sock.bind(("127.0.0.1", 0))
+    tx_id = f"tx@127.0.0.1:{tx_sock.getsockname()[1]}"
+    tx_info = {"user_id": tx_id}
+    my_info.update(tx_info)
+
+    children = []
+    member_ids = []
+    for _ in range(members):
+        port = _free_port()
+        member_ids.append(f"m{port}@127.0.0.1:{port}")
+        add_peer(member_ids[-1], "127.0.0.1", port, max_datagram=MAX_DATAGRAM)
+        child = subprocess.Popen(
+            [
+                sys.executable, "-m", "tools.group_transfer_bench", "--member",
+                "--port", str(port), "--tx-id", tx_id, "--out", work,
+                "--loss", str(loss), "--transport", transport,
+            ],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        child.stdout.readline()
+        children.append(child)
+
+    unicast_done = {}
+    unicast_windows = []
+    all_unicast = threading.Event()
+
+    def handle(content, addr):
+        kind = content.get("TYPE")
+        if kind == "ACK":
+            handle_ack(content.get("MESSAGE_ID", ""), content.get("FROM"), addr[0])
+        elif kind in ("FILE_ACCEPT", "FILE_REJECT"):
+            send_ack(content["MESSAGE_ID"], content["FROM"])
+            if "GROUP_ID" in content:
+                handle_group_file_answer(content, addr, tx_info)
+            else:
+                handle_file_accept(content, addr, tx_info)
+        elif kind == "FILE_NACK":
+            handle_file_nack(content, addr, tx_info)
+        elif kind == "FILE_ACK":
+            handle_file_ack(content, addr, tx_info)
+        elif kind == "FILE_RECEIVED":
+            if "GROUP_ID" in content:
+                handle_group_file_received(content, addr, tx_info)
+                return
+            fileid = content["FILEID"]
+            stop_transfer(fileid, content["STATUS"])
+            transfer = config.active_file_transfers.pop(fileid, None)
+            if transfer and "window" in transfer:
+                unicast_windows.append((transfer["window"], transfer["chunk_size"]))
+            unicast_done[fileid] = content["STATUS"]
+            if len(unicast_done) == members:
+                all_unicast.set()
+
+    threading.Thread(target=_serve, args=(tx_sock, handle), daemon=True).start()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Unicast: one offer, one window and one full stream per member
+        start = time.perf_counter()
+        for member_id in member_ids:
+            send_file_offer(member_id, path, "bench", tx_info)
+        all_unicast.wait(600)
+        unicast_elapsed = time.perf_counter() - start
+
+        group_id = f"bench{members}-{tx_sock.getsockname()[1]}"
+        create_group(group_id, "bench", list(member_ids), tx_info)
+        time.sleep(0.5)  # GROUP_CREATE delivered
+        history = len(_history)
+        start = time.perf_counter()
+        sent = send_group_file(group_id, path, "bench", tx_info)
+        deadline = time.time() + (600 if sent else 0)
+        while len(_history) == history and time.time() < deadline:
+            time.sleep(0.01)
+        group_elapsed = time.perf_counter() - start
+
+    for child in children:
+        child.kill()
+        child.wait()
+    tx_sock.close()
+
+    received = [name for name in os.listdir(work) if name.endswith(".bin")]
+    intact = sum(
+        filecmp.cmp(path, os.path.join(work, name), shallow=False) for name in received
+    )
+    shutil.rmtree(work, ignore_errors=True)
+
+    unicast_bytes = sum(window.stats["chunks_sent"] * size for window, size in unicast_windows)
+    summary = _history[-1][1] if len(_history) > history else {}
+    group_sent = summary.get("sent", 0)
+    group_bytes = group_sent * summary.get("chunk_size", 0)
+    return {
+        "members": members,
+        "loss": loss,
+        "unicast MB": round(unicast_bytes / 2**20, 1),
+        "unicast s": round(unicast_elapsed, 2),
+        "group MB": round(group_bytes / 2**20, 1),
+        "group s": round(group_elapsed, 2),
+        "repairs": f"{summary.get('repair_rate', 0):.1%}",
+        "nacks": summary.get("nacks", 0),
+        "saving": f"{unicast_bytes / max(1, group_bytes):.1f}x",
+        "intact": f"{intact}/{2 * members}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group vs per-member unicast file distribution")
+    parser.add_argument("--size-mb", type=float, default=16)
+    parser.add_argument("--members", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--loss", type=float, nargs="+", default=[0, 0.01, 0.03])
+    parser.add_argument("--transport", choices=["broadcast", "multicast"], default="broadcast")
+    parser.add_argument("--member", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--tx-id", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.member:
+        args.loss = args.loss[0]
+        member(args)
+        return
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        remaining = int(args.size_mb * 2**20)
+        while remaining:
+            block = min(remaining, 2**20)
+            f.write(os.urandom(block))
+            remaining -= block
+        path = f.name
+
+    columns = [
+        "members", "loss", "unicast MB", "unicast s", "group MB", "group s",
+        "repairs", "nacks", "saving", "intact",
+    ]
+    print("  ".join(f"{c:>10}" for c in columns))
+    try:
+        for loss in args.loss:
+            for members in args.members:
+                result = run(path, members, loss, args.transport)
+                print("  ".join(f"{str(result[c]):>10}" for c in columns))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
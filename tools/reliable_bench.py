@@ -0,0 +1,83 @@
+# tools/reliable_bench.py
+"""
+Load test for ReliableSender: many messages in flight at once.
+
+Sends N messages through a ReliableSender whose transport only counts
+datagrams, ACKs half of them and lets the rest retry until they give up.
+Reports per-message cost of send and ACK and the CPU used while waiting
+on the timer wheel.
+
+    python -m tools.reliable_bench --messages 20000 --timeout 0.2
+"""
+import argparse
+import time
+
+import config
+from network.reliable import ReliableSender
+from network.rtt import RttEstimator
+
+PEER = "peer@10.0.0.2:50999"
+
+
+def run(messages: int, timeout: float) -> dict:
+    # Initial RTO; ACK round trips measured below replace it
+    config.RELIABLE_TIMEOUT = timeout
+    datagrams = [0]
+    outcome = {"delivered": 0, "given_up": 0}
+
+    def send(data, addr):
+        datagrams[0] += 1
+
+    def delivered(message_id, recipient):
+        outcome["delivered"] += 1
+
+    def give_up(message_id, recipient):
+        outcome["given_up"] += 1
+
+    sender = ReliableSender(send=send, rtt=RttEstimator())
+    ids = [f"{i:08x}" for i in range(messages)]
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for message_id in ids:
+        sender.send(
+            message_id, PEER, b"TYPE: X\n\n", ("10.0.0.2", 50999), delivered, give_up
+        )
+    send_us = (time.perf_counter() - start) / messages * 1e6
+    in_flight = sender.in_flight()
+
+    start = time.perf_counter()
+    for message_id in ids[::2]:
+        sender.ack(message_id, PEER)
+    ack_us = (time.perf_counter() - start) / len(ids[::2]) * 1e6
+
+    wait_cpu = time.process_time()
+    deadline = time.time() + config.RTO_MAX * (config.RELIABLE_RETRIES + 1)
+    while sender.in_flight() and time.time() < deadline:
+        time.sleep(0.05)
+
+    return {
+        "peak_in_flight": in_flight,
+        "send_us_per_msg": round(send_us, 2),
+        "ack_us_per_msg": round(ack_us, 2),
+        "datagrams": datagrams[0],
+        "retransmits": sender.stats["retransmits"],
+        **outcome,
+        "left_in_flight": sender.in_flight(),
+        "wait_cpu_s": round(time.process_time() - wait_cpu, 3),
+        "total_cpu_s": round(time.process_time() - cpu, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ReliableSender load test")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--timeout", type=float, default=0.2)
+    args = parser.parse_args()
+
+    for key, value in run(args.messages, args.timeout).items():
+        print(f"{key:>16}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# tools/resume_bench.py
+"""
+Kill a receiving node halfway through a transfer and let it resume.
+
+The sender runs in this process; the receiver runs as a child process on a
+fixed loopback port. Once half of the file is acked the child is killed
+with SIGKILL, then started again: it reloads its checkpoint, sends
+FILE_RESUME and the sender continues with only the chunks it lacks.
+
+    python -m tools.resume_bench --size-mb 500
+"""
+import argparse
+import contextlib
+import filecmp
+import io
+import math
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import config
+from network.broadcast import my_info
+from network.integrity import file_digest
+from network.peer_registry import add_peer
+
+FILEID = "5e5e5e5e"
+
+
+def _parse(data: bytes) -> dict:
+    content = {}
+    for line in data.decode("utf-8", errors="ignore").splitlines():
+        if ":" in line:
+            key, value = line.split(":", 1)
+            content[key.strip()] = value.strip()
+    return content
+
+
+def _serve(sock: socket.socket, handle) -> None:
+    while True:
+        try:
+            data, addr = sock.recvfrom(65535)
+        except OSError:
+            return
+        handle(_parse(data), addr)
+
+
+def receiver(args) -> None:
+    """Child process: one download, checkpointed under args.state"""
+    from network.file_transfer import handle_file_cancel, handle_file_chunk, restore_transfers
+    from network.reliable import handle_ack
+
+    config.FILE_CHECKPOINT_DIR = args.state
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sock.bind(("127.0.0.1", args.rx_port))
+    info = {"user_id": f"rx@127.0.0.1:{args.rx_port}"}
+    my_info.update(info)
+    add_peer(args.tx_id, "127.0.0.1", int(args.tx_id.rsplit(":", 1)[1]))
+
+    restore_transfers(info)
+    if FILEID not in config.incoming_files:
+        config.incoming_files[FILEID] = {
+            "from": args.tx_id,
+            "filename": args.out,
+            "filesize": args.filesize,
+            "chunk_size": args.chunk_size,
+            "hash": args.hash,
+            "accepted": True,
+        }
+    print("restored" if "received" in config.incoming_files[FILEID] else "fresh", flush=True)
+
+    def handle(content, addr):
+        kind = content.get("TYPE")
+        if kind == "FILE_CHUNK":
+            handle_file_chunk(content, addr, info)
+        elif kind == "ACK":
+            handle_ack(content.get("MESSAGE_ID", ""), content.get("FROM"), addr[0])
+        elif kind == "FILE_CANCEL":
+            handle_file_cancel(content, addr, info)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _serve(sock, handle)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run(path: str, chunk_size: int, kill_at: float) -> dict:
+    from network.file_transfer import (
+        handle_file_ack,
+        handle_file_resume,
+        range_indices,
+        start_transfer,
+        stop_transfer,
+    )
+    from network.message_sender import send_ack
+
+    filesize = os.path.getsize(path)
+    digest = file_digest(path)
+    work = tempfile.mkdtemp()
+    out_path = os.path.join(work, "received.bin")
+    config.FILE_CHECKPOINT_DIR = os.path.join(work, "sender-state")
+
+    tx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tx_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    tx_sock.bind(("127.0.0.1", 0))
+    tx_id = f"tx@127.0.0.1:{tx_sock.getsockname()[1]}"
+    rx_port = _free_port()
+    rx_id = f"rx@127.0.0.1:{rx_port}"
+    tx_info = {"user_id": tx_id}
+    my_info.update(tx_info)
+    add_peer(rx_id, "127.0.0.1", rx_port)
+
+    child_args = [
+        sys.executable, "-m", "tools.resume_bench", "--receiver",
+        "--rx-port", str(rx_port), "--tx-id", tx_id,
+        "--state", os.path.join(work, "receiver-state"), "--out", out_path,
+        "--filesize", str(filesize), "--chunk-size", str(chunk_size), "--hash", digest,
+    ]
+
+    def spawn() -> subprocess.Popen:
+        child = subprocess.Popen(child_args, stdout=subprocess.PIPE, text=True)
+        child.stdout.readline()  # "fresh" or "restored" once it is listening
+        return child
+
+    done = threading.Event()
+    resumes = []
+
+    def handle(content, addr):
+        kind = content.get("TYPE")
+        if kind == "FILE_ACK":
+            handle_file_ack(content, addr, tx_info)
+        elif kind == "FILE_RESUME":
+            send_ack(content["MESSAGE_ID"], content["FROM"])
+            resumes.append(content.get("RANGES", ""))
+            handle_file_resume(content, addr, tx_info)
+        elif kind == "FILE_RECEIVED":
+            stop_transfer(content["FILEID"], content.get("STATUS", "COMPLETE"))
+            done.set()
+
+    threading.Thread(target=_serve, args=(tx_sock, handle), daemon=True).start()
+
+    total = math.ceil(filesize / chunk_size)
+    config.active_file_transfers[FILEID] = {
+        "filepath": path,
+        "recipient": rx_id,
+        "chunk_size": chunk_size,
+        "total_chunks": total,
+        "filesize": filesize,
+        "sender_info": tx_info,
+        "hash": digest,
+    }
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        child = spawn()
+        start = time.perf_counter()
+        start_transfer(FILEID)
+        first = config.active_file_transfers[FILEID]["window"]
+        while first.acked.count < total * kill_at:
+            time.sleep(0.005)
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+        killed_at = time.perf_counter() - start
+        acked_before = first.acked.count
+        sent_before = first.stats["chunks_sent"]
+
+        child = spawn()
+        restarted = time.perf_counter()
+        while not resumes and time.perf_counter() - restarted < 30:
+            time.sleep(0.005)
+        resumed_after = time.perf_counter() - restarted
+        done.wait(600)
+        elapsed = time.perf_counter() - start
+        child.kill()
+        child.wait()
+    tx_sock.close()
+
+    transfer = config.active_file_transfers.pop(FILEID, {})
+    second = transfer.get("window")
+    listed = sum(1 for _ in range_indices(resumes[0], total)) if resumes else 0
+    sent_after = second.stats["chunks_sent"] if second else 0
+    intact = os.path.exists(out_path) and filecmp.cmp(path, out_path, shallow=False)
+    shutil.rmtree(work, ignore_errors=True)
+    return {
+        "chunks": total,
+        "killed at": f"{killed_at:.2f}s, {acked_before} chunks acked, {sent_before} sent",
+        "resumed": f"{resumed_after:.2f}s after restart, {listed} chunks on disk",
+        "sent after": f"{sent_after} ({sent_after - (total - listed)} beyond the missing)",
+        "sent overall": f"{sent_before + sent_after} ({(sent_before + sent_after) / total:.2f}x)",
+        "elapsed": f"{elapsed:.2f}s",
+        "intact": intact,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kill-and-resume file transfer test")
+    parser.add_argument("--size-mb", type=float, default=500)
+    parser.add_argument("--chunk-size", type=int, default=config.FILE_CHUNK_MAX)
+    parser.add_argument("--kill-at", type=float, default=0.5)
+    parser.add_argument("--receiver", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--rx-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--tx-id", help=argparse.SUPPRESS)
+    parser.add_argument("--state", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    parser.add_argument("--filesize", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--hash", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.receiver:
+        receiver(args)
+        return
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        remaining = int(args.size_mb * 2**20)
+        while remaining:
+            block = min(remaining, 2**20)
+            f.write(os.urandom(block))
+            remaining -= block
+        path = f.name
+    try:
+        result = run(path, args.chunk_size, args.kill_at)
+    finally:
+        os.unlink(path)
+    for key, value in result.items():
+        print(f"{key:>14}: {value}")
+
+
+if __name__ == "__main__":
+    main()
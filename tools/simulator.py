@@ -0,0 +1,488 @@
+# tools/simulator.py
+"""
+Local multi-node simulator for LSNP presence traffic.
+
+Runs the real schedulers from the network package against a virtual clock,
+so thousands of nodes can be simulated in a few seconds without sockets.
+
+    python -m tools.simulator presence --nodes 10 100 1000
+    python -m tools.simulator liveness --nodes 10 100 1000
+    python -m tools.simulator join --nodes 10 100 1000
+    python -m tools.simulator swarm --holders 1 2 4 8
+"""
+import argparse
+import heapq
+import itertools
+import random
+
+import config
+from network.file_transfer import ReceivedChunks, range_indices, sack_indices
+from network.liveness import SUSPECT, DEAD, LivenessMonitor, heartbeat_interval
+from network.peer_sync import pack_entries
+from network.presence import PresenceScheduler
+from network.swarm import SwarmDownload
+
+PROFILE_SIZE = 2048  # bytes, a PROFILE with a small avatar
+PING_SIZE = 64
+
+
+class EventLoop:
+    """Virtual clock with a heap of scheduled callbacks"""
+
+    def __init__(self):
+        self.now = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+
+    def clock(self) -> float:
+        return self.now
+
+    def call_later(self, delay: float, fn) -> None:
+        heapq.heappush(self._queue, (self.now + delay, next(self._seq), fn))
+
+    def run(self, until: float = None) -> None:
+        while self._queue:
+            when, _, fn = self._queue[0]
+            if until is not None and when > until:
+                break
+            heapq.heappop(self._queue)
+            self.now = when
+            fn()
+        if until is not None:
+            self.now = max(self.now, until)
+
+
+def simulate_presence(nodes: int, spread: float, seed: int = 1) -> dict:
+    """Every node sends one PING at a random time within `spread` seconds"""
+    loop = EventLoop()
+    rng = random.Random(seed)
+    traffic = {"pings": 0, "broadcasts": 0, "unicasts": 0, "bytes": 0}
+
+    def broadcast(_data):
+        traffic["broadcasts"] += 1
+        traffic["bytes"] += PROFILE_SIZE
+
+    def unicast(_data, _addr):
+        traffic["unicasts"] += 1
+        traffic["bytes"] += PROFILE_SIZE
+
+    schedulers = [
+        PresenceScheduler(
+            profile=lambda: b"x" * PROFILE_SIZE,
+            broadcast=broadcast,
+            unicast=unicast,
+            clock=loop.clock,
+            schedule=loop.call_later,
+            rng=random.Random(rng.random()),
+        )
+        for _ in range(nodes)
+    ]
+
+    def ping(sender):
+        traffic["pings"] += 1
+        traffic["bytes"] += PING_SIZE
+        for i, scheduler in enumerate(schedulers):
+            if i != sender:
+                scheduler.on_ping(("10.0.0.1", 50999 + sender))
+
+    for i in range(nodes):
+        loop.call_later(rng.uniform(0, spread), lambda i=i: ping(i))
+    loop.run()
+
+    # Before the scheduler every PING made every other node broadcast at once
+    legacy = nodes + nodes * (nodes - 1)
+    traffic["datagrams"] = traffic["pings"] + traffic["broadcasts"] + traffic["unicasts"]
+    traffic["legacy_datagrams"] = legacy
+    return traffic
+
+
+def cmd_presence(args) -> None:
+    print(
+        f"{'nodes':>6} {'legacy':>10} {'scheduled':>10} {'bcast':>7} "
+        f"{'ucast':>7} {'per node':>9} {'MB':>8}"
+    )
+    for n in args.nodes:
+        t = simulate_presence(n, args.spread, args.seed)
+        print(
+            f"{n:>6} {t['legacy_datagrams']:>10} {t['datagrams']:>10} "
+            f"{t['broadcasts']:>7} {t['unicasts']:>7} "
+            f"{t['datagrams'] / n:>9.1f} {t['bytes'] / 1e6:>8.2f}"
+        )
+    print(
+        f"(window {config.PROFILE_SUPPRESS_WINDOW}s, jitter "
+        f"{config.PROFILE_JITTER_MAX}s, budget {config.PRESENCE_BUDGET_BPS} B/s)"
+    )
+
+
+def simulate_liveness(nodes: int, duration: float, loss: float, seed: int = 1) -> dict:
+    """
+    Every node heartbeats on the adaptive interval; node 0 observes the rest.
+    Node 1 crashes halfway through, every other node stays up, so any
+    suspicion of them is a false positive caused by packet loss.
+    """
+    loop = EventLoop()
+    rng = random.Random(seed)
+    interval = heartbeat_interval(nodes - 1)
+    crash_at = duration / 2
+    peers = [{"user_id": str(i), "last_seen": 0.0} for i in range(1, nodes)]
+    monitor = LivenessMonitor(clock=loop.clock)
+    result = {
+        "interval": interval,
+        "pings": 0,
+        "false_suspect": 0,
+        "false_dead": 0,
+        "suspect_after": None,
+        "dead_after": None,
+    }
+
+    def on_transition(peer, _old, new):
+        if peer["user_id"] == "1" and loop.now >= crash_at:
+            key = "suspect_after" if new == SUSPECT else "dead_after"
+            if new in (SUSPECT, DEAD) and result[key] is None:
+                result[key] = loop.now - crash_at
+        elif new == SUSPECT:
+            result["false_suspect"] += 1
+        elif new == DEAD:
+            result["false_dead"] += 1
+
+    monitor.subscribe(on_transition)
+
+    def heartbeat(i):
+        if i == 1 and loop.now >= crash_at:
+            return
+        result["pings"] += 1
+        if i != 0 and rng.random() >= loss:
+            peers[i - 1]["last_seen"] = loop.now
+        jitter = rng.uniform(-config.HEARTBEAT_JITTER, config.HEARTBEAT_JITTER)
+        loop.call_later(interval * (1 + jitter), lambda: heartbeat(i))
+
+    # Sweeping more often than 1/20 of the interval adds nothing but runtime
+    sweep_every = max(config.LIVENESS_SWEEP_INTERVAL, interval / 20)
+
+    def sweep():
+        monitor.sweep(peers)
+        loop.call_later(sweep_every, sweep)
+
+    for i in range(nodes):
+        loop.call_later(rng.uniform(0, interval), lambda i=i: heartbeat(i))
+    loop.call_later(sweep_every, sweep)
+    loop.run(until=duration)
+    result["lan_rate"] = result["pings"] / duration
+    return result
+
+
+def cmd_liveness(args) -> None:
+    print(
+        f"{'nodes':>6} {'interval':>9} {'PING/s':>7} {'false susp':>10} "
+        f"{'false dead':>10} {'suspect in':>10} {'dead in':>9}"
+    )
+
+    def fmt(seconds):
+        return "-" if seconds is None else f"{seconds:.0f}s"
+
+    for n in args.nodes:
+        r = simulate_liveness(n, args.duration, args.loss, args.seed)
+        print(
+            f"{n:>6} {r['interval']:>8.0f}s {r['lan_rate']:>7.2f} "
+            f"{r['false_suspect']:>10} {r['false_dead']:>10} "
+            f"{fmt(r['suspect_after']):>10} {fmt(r['dead_after']):>9}"
+        )
+    print(
+        f"(target {config.HEARTBEAT_LAN_RATE} PING/s LAN-wide, loss {args.loss:.0%}, "
+        f"suspect/dead after {config.HEARTBEAT_SUSPECT_MISSES}/"
+        f"{config.HEARTBEAT_DEAD_MISSES} missed heartbeats)"
+    )
+
+
+def simulate_join(
+    nodes: int, loss: float, sync: bool, duration: float, seed: int = 1
+) -> dict:
+    """
+    A new node joins a LAN of `nodes` converged peers and runs startup
+    discovery. It learns a peer from any PROFILE or PING of that peer it
+    receives; with `sync` it also pulls the peer list from the first
+    neighbour it hears via PEERS_DIGEST/PEERS_SYNC, repeating at most once
+    per PEERS_SYNC_INTERVAL. Returns the times at
+    which it knew 99% and 100% of the LAN.
+    """
+    loop = EventLoop()
+    rng = random.Random(seed)
+    known = set()
+    result = {"p99": None, "full": None, "sync_datagrams": 0}
+    last_sync = [-config.PEERS_SYNC_INTERVAL]
+    interval = heartbeat_interval(nodes)
+
+    def learn(ids):
+        known.update(ids)
+        if result["p99"] is None and len(known) >= 0.99 * nodes:
+            result["p99"] = loop.now
+        if result["full"] is None and len(known) == nodes:
+            result["full"] = loop.now
+
+    def delivered():
+        return rng.random() >= loss
+
+    def start_sync(neighbour):
+        if loop.now - last_sync[0] < config.PEERS_SYNC_INTERVAL:
+            return
+        last_sync[0] = loop.now
+        result["sync_datagrams"] += 1
+        # Matching digests (joiner already complete) get no reply
+        if not delivered() or len(known) == nodes:
+            return
+        # The neighbour knows everyone; ~40 bytes per entry on the wire
+        batches = pack_entries([f"user{i}@10.0.{i // 250}.{i % 250}:50999|name"
+                                for i in range(nodes)], config.PEERS_SYNC_DATAGRAM_SIZE)
+        offset = 0
+        for batch in batches:
+            count = batch.count(";") + 1
+            result["sync_datagrams"] += 1
+            if delivered():
+                ids = range(offset, offset + count)
+                loop.call_later(0.001, lambda ids=ids: learn(ids))
+            offset += count
+
+    def heard_profile(i):
+        if delivered():
+            learn([i])
+            if sync:
+                start_sync(i)
+
+    def make_scheduler(i):
+        return PresenceScheduler(
+            profile=lambda: b"x" * PROFILE_SIZE,
+            broadcast=lambda _data: heard_profile(i),
+            unicast=lambda _data, addr: addr == "joiner" and heard_profile(i),
+            clock=loop.clock,
+            schedule=loop.call_later,
+            rng=random.Random(rng.random()),
+        )
+
+    schedulers = [make_scheduler(i) for i in range(nodes)]
+
+    def joiner_ping():
+        for scheduler in schedulers:
+            if delivered():
+                scheduler.on_ping("joiner")
+
+    # Heartbeats between old peers need no PROFILE reply, but the joiner
+    # learns whoever it hears PING
+    def heartbeat(i):
+        if delivered():
+            learn([i])
+            if sync:
+                start_sync(i)
+        loop.call_later(interval, lambda: heartbeat(i))
+
+    elapsed = 0.0
+    for delay in config.DISCOVERY_BACKOFF:
+        elapsed += delay
+        loop.call_later(elapsed, joiner_ping)
+    for i in range(nodes):
+        loop.call_later(rng.uniform(0, interval), lambda i=i: heartbeat(i))
+    loop.run(until=duration)
+    return result
+
+
+def cmd_join(args) -> None:
+    def median(runs, key):
+        times = sorted(
+            float("inf") if r[key] is None else r[key] for r in runs
+        )
+        return times[len(times) // 2]
+
+    def fmt(seconds):
+        return f">{args.duration:.0f}s" if seconds == float("inf") else f"{seconds:.2f}s"
+
+    print(
+        f"{'nodes':>6} {'bcast 99%':>10} {'bcast 100%':>11} "
+        f"{'sync 99%':>9} {'sync 100%':>10} {'sync dgrams':>12}"
+    )
+    for n in args.nodes:
+        seeds = range(args.seed, args.seed + args.runs)
+        plain = [simulate_join(n, args.loss, False, args.duration, s) for s in seeds]
+        synced = [simulate_join(n, args.loss, True, args.duration, s) for s in seeds]
+        print(
+            f"{n:>6} {fmt(median(plain, 'p99')):>10} {fmt(median(plain, 'full')):>11} "
+            f"{fmt(median(synced, 'p99')):>9} {fmt(median(synced, 'full')):>10} "
+            f"{synced[0]['sync_datagrams']:>12}"
+        )
+    print(
+        f"(median of {args.runs} runs, loss {args.loss:.0%}, "
+        f"heartbeat rate {config.HEARTBEAT_LAN_RATE}/s)"
+    )
+
+
+def simulate_swarm(
+    holders: int,
+    size_mb: float,
+    rate_mb: float,
+    downlink_mb: float,
+    stall: bool,
+    seed: int = 1,
+) -> dict:
+    """
+    One download from its sender plus `holders` other peers with the same
+    content, each uploading at a random 0.25x-2x of the sender's `rate_mb`.
+    Holders answer the FILE_QUERY 50 ms in, while the sender is already
+    streaming the whole file. With `stall` one holder stops sending for good
+    two seconds in. `downlink_mb` caps what the receiver can take in (0 for
+    no cap). Returns the time until every chunk is in and the swarm stats.
+    """
+    loop = EventLoop()
+    rng = random.Random(seed)
+    chunk_size = 32 * 1024
+    filesize = int(size_mb * 2**20)
+    received = ReceivedChunks(-(-filesize // chunk_size))
+    latency = 0.001
+    link_free = [0.0]
+    result = {"time": None}
+
+    class Source:
+        def __init__(self, peer, rate, stall_at=None):
+            self.peer = peer
+            self.rate = rate
+            self.stall_at = stall_at
+            self.todo = set()
+            self.sent = set()
+            self.seq = 0
+            self.busy = False
+
+        def wake(self):
+            if not self.busy and self.todo:
+                self.busy = True
+                loop.call_later(0, self.send_next)
+
+        def send_next(self):
+            if not self.todo or (self.stall_at is not None and loop.now >= self.stall_at):
+                self.busy = False
+                return
+            index = min(self.todo)
+            self.todo.discard(index)
+            self.sent.add(index)
+            arrival = loop.now + chunk_size / self.rate + latency
+            if downlink_mb:
+                arrival = link_free[0] = max(arrival, link_free[0]) + chunk_size / (downlink_mb * 2**20)
+            loop.call_later(arrival - loop.now, lambda: chunk_arrived(self.peer, index))
+            loop.call_later(chunk_size / self.rate, self.send_next)
+
+        def on_request(self, seq, ranges):
+            wanted = set(range_indices(ranges, received.total))
+            if not self.seq:
+                self.todo = wanted  # a fresh window limited to RANGES
+            else:
+                self.todo |= wanted - self.sent
+            self.seq = seq
+            self.wake()
+
+        def on_ack(self, cumulative, sack, seq):
+            if seq != self.seq:
+                return
+            self.todo = {i for i in self.todo if i >= cumulative}
+            self.todo.difference_update(sack_indices(cumulative, sack))
+
+    sources = {"sender": Source("sender", rate_mb * 2**20)}
+    for i in range(holders):
+        stall_at = 2.0 if stall and i == 0 and holders > 1 else None
+        sources[f"holder{i}"] = Source(f"holder{i}", rng.uniform(0.25, 2) * rate_mb * 2**20, stall_at)
+
+    def request(peer, seq, ranges):
+        loop.call_later(latency, lambda: sources[peer].on_request(seq, ranges))
+
+    swarm = SwarmDownload(
+        received, chunk_size, filesize, request, clock=loop.clock, schedule=loop.call_later
+    )
+
+    def chunk_arrived(peer, index):
+        if result["time"] is not None:
+            return
+        new = received.add(index)
+        unacked = swarm.on_chunk(peer, index, new) if swarm.state == "running" else 0
+        done = received.complete()
+        if unacked >= config.FILE_ACK_EVERY or done:
+            for target, cumulative, sack, seq in swarm.acks(peer):
+                loop.call_later(
+                    latency,
+                    lambda t=target, c=cumulative, s=sack, q=seq: sources[t].on_ack(c, s, q),
+                )
+        if done:
+            result["time"] = loop.now
+            swarm.stop()
+
+    def holders_found():
+        for peer in sources:
+            swarm.add_source(peer)
+        swarm.start()
+
+    sources["sender"].todo = set(range(received.total))
+    sources["sender"].wake()
+    if holders:
+        loop.call_later(0.05, holders_found)
+    loop.run(until=3600)
+    return {"time": result["time"], **swarm.summary()}
+
+
+def cmd_swarm(args) -> None:
+    alone = simulate_swarm(0, args.size_mb, args.rate_mb, args.downlink_mb, False, args.seed)
+    print(
+        f"{'holders':>8} {'time':>8} {'speedup':>8} {'requests':>9} "
+        f"{'moved':>6} {'shared':>7} {'dropped':>8}"
+    )
+    print(f"{0:>8} {alone['time']:>7.2f}s {1:>7.1f}x {'-':>9} {'-':>6} {'-':>7} {'-':>8}")
+    for holders in args.holders:
+        result = simulate_swarm(
+            holders, args.size_mb, args.rate_mb, args.downlink_mb, args.stall, args.seed
+        )
+        print(
+            f"{holders:>8} {result['time']:>7.2f}s {alone['time'] / result['time']:>7.1f}x "
+            f"{result['requests']:>9} {result['moved']:>6} {result['shared']:>7} "
+            f"{result['dropped']:>8}"
+        )
+    print(
+        f"({args.size_mb:g} MB, sender at {args.rate_mb:g} MB/s, holders at 0.25x-2x of it"
+        + (f", receiver downlink {args.downlink_mb:g} MB/s" if args.downlink_mb else "")
+        + (", one holder stalls at 2s" if args.stall else "")
+        + ")"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="LSNP multi-node simulator")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    presence = sub.add_parser("presence", help="PING/PROFILE traffic vs peer count")
+    presence.add_argument("--nodes", type=int, nargs="+", default=[10, 50, 100, 200, 500])
+    presence.add_argument("--spread", type=float, default=30.0)
+    presence.add_argument("--seed", type=int, default=1)
+    presence.set_defaults(func=cmd_presence)
+
+    liveness = sub.add_parser("liveness", help="heartbeat rate and failure detection")
+    liveness.add_argument("--nodes", type=int, nargs="+", default=[10, 100, 1000])
+    liveness.add_argument("--duration", type=float, default=40000.0)
+    liveness.add_argument("--loss", type=float, default=0.05)
+    liveness.add_argument("--seed", type=int, default=1)
+    liveness.set_defaults(func=cmd_liveness)
+
+    join = sub.add_parser("join", help="time for a new node to learn the LAN")
+    join.add_argument("--nodes", type=int, nargs="+", default=[10, 100, 1000])
+    join.add_argument("--duration", type=float, default=1800.0)
+    join.add_argument("--loss", type=float, default=0.05)
+    join.add_argument("--seed", type=int, default=1)
+    join.add_argument("--runs", type=int, default=9)
+    join.set_defaults(func=cmd_join)
+
+    swarm = sub.add_parser("swarm", help="download time vs number of peers holding the file")
+    swarm.add_argument("--holders", type=int, nargs="+", default=[1, 2, 4, 8])
+    swarm.add_argument("--size-mb", type=float, default=64.0)
+    swarm.add_argument("--rate-mb", type=float, default=4.0, help="sender upload, MB/s")
+    swarm.add_argument("--downlink-mb", type=float, default=0.0, help="0 for no cap")
+    swarm.add_argument("--no-stall", dest="stall", action="store_false")
+    swarm.add_argument("--seed", type=int, default=1)
+    swarm.set_defaults(func=cmd_swarm)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# tools/startup_bench.py
+"""
+Startup benchmark for a headless node.
+
+Measures `python -X importtime -c "import main"` and the time from the
+first import to a bound UDP socket, and fails (exit code 1) when the
+budget is exceeded or a UI-only dependency is imported eagerly.
+
+    python -m tools.startup_bench --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+STARTUP_BUDGET_MS = 100  # import main + bind the listening socket
+# Only needed once something is printed or rendered
+LAZY_MODULES = ("rich", "colorama", "PIL", "pyfiglet", "termcolor")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BIND_SNIPPET = """
+import time
+t = time.perf_counter()
+import main
+from network.socket_manager import start_listening
+sock, port = start_listening(lambda message, addr: None)
+print(f"BIND_MS {(time.perf_counter() - t) * 1000:.2f}")
+"""
+
+
+def import_profile():
+    """Return (cumulative ms of 'main', names of all imported modules)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    main_ms = None
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        modules.append(name)
+        if name == "main":
+            main_ms = int(cumulative) / 1000
+    return main_ms, modules
+
+
+def bind_time() -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", BIND_SNIPPET],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("BIND_MS"):
+            return float(line.split()[1])
+    raise RuntimeError(f"no timing in output: {result.stdout!r}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Headless startup benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS)
+    args = parser.parse_args()
+
+    import_times = []
+    bind_times = []
+    eager = set()
+    for _ in range(args.runs):
+        main_ms, modules = import_profile()
+        import_times.append(main_ms)
+        eager.update(
+            m for m in modules if m.split(".")[0] in LAZY_MODULES
+        )
+        bind_times.append(bind_time())
+
+    import_ms = statistics.median(import_times)
+    bind_ms = statistics.median(bind_times)
+    print(f"import main:      {import_ms:7.1f} ms (median of {args.runs})")
+    print(f"import + bind:    {bind_ms:7.1f} ms (budget {args.budget:.0f} ms)")
+
+    ok = True
+    if eager:
+        print(f"FAIL: imported at startup: {', '.join(sorted(eager))}")
+        ok = False
+    if bind_ms > args.budget:
+        print("FAIL: startup over budget")
+        ok = False
+    if ok:
+        print("OK")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
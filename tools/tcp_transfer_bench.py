@@ -0,0 +1,183 @@
+# tools/tcp_transfer_bench.py
+"""
+Throughput of one file transfer on loopback: FILE_CHUNKs over UDP vs the
+TCP side channel (socket.sendfile on the sender).
+
+The receiver runs as a child process; both ends go through the real
+message handling, path MTU probe, offer, accept and FILE_RECEIVED, so the
+UDP chunk size is what two nodes on this host would negotiate. Times run
+from the offer to the sender seeing FILE_RECEIVED, hash check included.
+
+    python -m tools.tcp_transfer_bench --size-mb 64 --runs 3
+"""
+import argparse
+import contextlib
+import filecmp
+import io
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import config
+from network.broadcast import my_info
+from network.peer_registry import add_peer
+from network.pmtu import PMTU_CAPABILITY
+from network.socket_manager import MAX_DATAGRAM
+
+
+def _parse(data: bytes) -> dict:
+    content = {}
+    for line in data.decode("utf-8", errors="ignore").splitlines():
+        if ":" in line:
+            key, value = line.split(":", 1)
+            content[key.strip()] = value.strip()
+    return content
+
+
+def _node(port: int, peer_id: str, on_message=None) -> None:
+    """Answer everything on `port` as a node would, peered with `peer_id`"""
+    import main
+
+    user_id = f"n{port}@127.0.0.1:{port}"
+    my_info.update({"user_id": user_id, "username": user_id.split("@")[0], "port": port})
+    peer_port = int(peer_id.rsplit(":", 1)[1])
+    add_peer(
+        peer_id, "127.0.0.1", peer_port, capabilities={PMTU_CAPABILITY}, max_datagram=MAX_DATAGRAM
+    )
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sock.bind(("127.0.0.1", port))
+
+    def serve():
+        while True:
+            data, addr = sock.recvfrom(65535)
+            main.handle_message(data.decode("utf-8", "ignore"), addr)
+            if on_message:
+                on_message(_parse(data))
+
+    threading.Thread(target=serve, daemon=True).start()
+
+
+def receiver(args) -> None:
+    """Child process: accept every offer into args.out"""
+    from network.file_transfer import accept_incoming
+
+    config.FILE_DOWNLOAD_DIR = args.out
+    config.FILE_CHECKPOINT_DIR = os.path.join(args.out, ".state")
+    config.FILE_STORE_MAX_BYTES = 0
+    config.FILE_SWARM = False
+
+    def on_message(content):
+        if content.get("TYPE") == "FILE_OFFER":
+            accept_incoming(content["FILEID"], my_info)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _node(args.port, args.tx_id, on_message)
+        print("ready", file=sys.__stdout__, flush=True)
+        threading.Event().wait()
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def transfer(path: str, rx_id: str, out: str, tcp: bool) -> tuple:
+    """Send `path` once; (seconds, chunk size, intact)"""
+    from network.message_sender import send_file_offer
+
+    config.FILE_TCP = tcp
+    received = os.path.join(out, os.path.basename(path))
+    start = time.perf_counter()
+    send_file_offer(rx_id, path, "bench", my_info)
+    deadline = time.time() + 600
+    chunk_size = None
+    # The offer goes out once the path MTU probe settles
+    while not config.active_file_transfers and time.time() < deadline:
+        time.sleep(0.001)
+    while config.active_file_transfers and time.time() < deadline:
+        chunk_size = next(iter(config.active_file_transfers.values()), {}).get("chunk_size", chunk_size)
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    intact = os.path.exists(received) and filecmp.cmp(path, received, shallow=False)
+    if os.path.exists(received):
+        os.unlink(received)  # or the next offer is answered from the download
+    return elapsed, chunk_size, intact
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP chunks vs TCP side channel on loopback")
+    parser.add_argument("--size-mb", type=float, nargs="+", default=[16, 64])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--receiver", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--tx-id", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.receiver:
+        receiver(args)
+        return
+
+    work = tempfile.mkdtemp()
+    out = os.path.join(work, "received")
+    os.makedirs(out)
+    config.FILE_CHECKPOINT_DIR = os.path.join(work, "state")
+    tx_port, rx_port = _free_port(), _free_port()
+    tx_id, rx_id = f"n{tx_port}@127.0.0.1:{tx_port}", f"n{rx_port}@127.0.0.1:{rx_port}"
+    child = subprocess.Popen(
+        [
+            sys.executable, "-m", "tools.tcp_transfer_bench", "--receiver",
+            "--port", str(rx_port), "--tx-id", tx_id, "--out", out,
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    child.stdout.readline()
+
+    columns = ["path", "MB", "chunk", "best s", "median s", "MB/s", "intact"]
+    print("  ".join(f"{c:>9}" for c in columns))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            _node(tx_port, rx_id)
+        for size_mb in args.size_mb:
+            path = os.path.join(work, f"bench-{size_mb:g}MB.bin")
+            with open(path, "wb") as f:
+                remaining = int(size_mb * 2**20)
+                while remaining:
+                    block = min(remaining, 2**20)
+                    f.write(os.urandom(block))
+                    remaining -= block
+            with contextlib.redirect_stdout(io.StringIO()):
+                transfer(path, rx_id, out, tcp=False)  # warm up: path MTU, file hash, page cache
+            for name, tcp in (("udp", False), ("tcp", True)):
+                results = []
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for _ in range(args.runs):
+                        results.append(transfer(path, rx_id, out, tcp))
+                times = [elapsed for elapsed, _, _ in results]
+                row = {
+                    "path": name,
+                    "MB": f"{size_mb:g}",
+                    "chunk": results[0][1],
+                    "best s": round(min(times), 3),
+                    "median s": round(statistics.median(times), 3),
+                    "MB/s": round(size_mb / min(times), 1),
+                    "intact": f"{sum(ok for _, _, ok in results)}/{len(results)}",
+                }
+                print("  ".join(f"{str(row[c]):>9}" for c in columns))
+    finally:
+        child.kill()
+        child.wait()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# tools/transfer_bench.py
+"""
+File transfer throughput across chunk sizes, on loopback.
+
+Runs a real sender (SendWindow driving a FileChunkSender) and receiver
+(handle_file_chunk answering with FILE_ACK) over two loopback UDP sockets
+in one process. Loss is applied per IP fragment of PATH_MTU_PAYLOAD bytes,
+so a datagram that would be fragmented on a 1500-byte Ethernet path is lost
+more often than one that fits in a single frame.
+
+With --concurrent, one upload per chunk size runs at once through
+start_transfer and the shared transfer scheduler, under --rate-kbps if
+given, and each upload's finish time and throughput is reported.
+
+    python -m tools.transfer_bench --size-mb 4 --loss 0 0.005 0.02
+    python -m tools.transfer_bench --concurrent --rate-kbps 8192
+"""
+import argparse
+import contextlib
+import filecmp
+import io
+import math
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+import config
+import network.file_transfer as file_transfer
+from network.file_transfer import SendWindow, handle_file_ack, start_transfer, stop_transfer
+from network.message_sender import FileChunkSender, chunk_size_for
+from network.integrity import file_digest
+from network.peer_registry import add_peer
+from network.rtt import RttEstimator
+from network.transfer_scheduler import get_scheduler
+
+PATH_MTU_PAYLOAD = 1472  # Ethernet MTU minus IPv4 and UDP headers
+CHUNK_HEADER = 205  # FILE_CHUNK headers for typical ids and a 1 GB file
+
+
+def _parse(data: bytes) -> dict:
+    content = {}
+    for line in data.decode("utf-8", errors="ignore").splitlines():
+        if ":" in line:
+            key, value = line.split(":", 1)
+            content[key.strip()] = value.strip()
+    return content
+
+
+def _listen(sock: socket.socket, handle) -> None:
+    while True:
+        try:
+            data, addr = sock.recvfrom(65535)
+        except OSError:
+            return
+        handle(_parse(data), addr)
+
+
+def _damage(content: dict, rng: random.Random) -> None:
+    # Swap one base64 character, as a bit error that slipped past the UDP checksum
+    data = content["DATA"]
+    position = rng.randrange(len(data))
+    replacement = "A" if data[position] != "A" else "B"
+    content["DATA"] = data[:position] + replacement + data[position + 1 :]
+
+
+def run(path: str, chunk_size: int, loss: float, corrupt: float = 0.0, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    filesize = os.path.getsize(path)
+    total = math.ceil(filesize / chunk_size)
+    fileid = f"{chunk_size:04x}{int(loss * 1000):04x}"[-8:]
+
+    rx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for sock in (rx_sock, tx_sock):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.bind(("127.0.0.1", 0))
+    rx_id = f"rx@127.0.0.1:{rx_sock.getsockname()[1]}"
+    tx_id = f"tx@127.0.0.1:{tx_sock.getsockname()[1]}"
+    add_peer(rx_id, "127.0.0.1", rx_sock.getsockname()[1])
+    add_peer(tx_id, "127.0.0.1", tx_sock.getsockname()[1])
+
+    out_path = os.path.join(tempfile.mkdtemp(), "received.bin")
+    digest = file_digest(path)
+    config.incoming_files[fileid] = {
+        "from": tx_id,
+        "filename": out_path,
+        "filesize": filesize,
+        "chunk_size": chunk_size,
+        "hash": digest,
+        "accepted": True,
+    }
+    tx_info = {"user_id": tx_id}
+    config.active_file_transfers[fileid] = {
+        "filepath": path,
+        "recipient": rx_id,
+        "chunk_size": chunk_size,
+        "total_chunks": total,
+        "filesize": filesize,
+        "sender_info": tx_info,
+    }
+
+    chunks = FileChunkSender(fileid, tx_info)
+    crc_failures = file_transfer._integrity_stats["crc_failures"]
+    done = threading.Event()
+    fragments = {}  # chunk index -> IP fragments its datagram needs
+
+    def lossy_send(index: int) -> None:
+        if index not in fragments:
+            size = min(chunk_size, filesize - index * chunk_size)
+            datagram = CHUNK_HEADER + 4 * math.ceil(size / 3)
+            fragments[index] = math.ceil(datagram / PATH_MTU_PAYLOAD)
+        if rng.random() < 1 - (1 - loss) ** fragments[index]:
+            return
+        chunks.send(index)
+
+    window = SendWindow(
+        total,
+        chunk_size,
+        filesize,
+        send=lossy_send,
+        peer=rx_id,
+        rtt=RttEstimator(),
+        on_done=lambda w: done.set(),
+    )
+
+    def receiver(content, addr):
+        if content.get("TYPE") == "FILE_CHUNK":
+            if corrupt and rng.random() < corrupt:
+                _damage(content, rng)
+            file_transfer.handle_file_chunk(content, addr, {"user_id": rx_id})
+
+    def sender(content, addr):
+        if content.get("TYPE") == "FILE_ACK" and rng.random() >= loss:
+            window.on_ack(int(content["CUMULATIVE"]), content.get("SACK", ""))
+
+    threading.Thread(target=_listen, args=(rx_sock, receiver), daemon=True).start()
+    threading.Thread(target=_listen, args=(tx_sock, sender), daemon=True).start()
+
+    # The receiver announces the finished file on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        window.start()
+        done.wait(600)
+        # The last FILE_ACK goes out just before the file is assembled
+        while fileid in config.incoming_files and window.state == "complete":
+            time.sleep(0.01)
+    chunks.close()
+    rx_sock.close()
+    tx_sock.close()
+
+    summary = window.summary()
+    intact = os.path.exists(out_path) and filecmp.cmp(path, out_path, shallow=False)
+    config.active_file_transfers.pop(fileid, None)
+    return {
+        "chunk": chunk_size,
+        "loss": loss,
+        "state": summary["state"],
+        "seconds": summary["elapsed"],
+        "MB/s": round(filesize / summary["elapsed"] / 2**20, 2) if summary["elapsed"] else 0,
+        "datagrams": window.stats["chunks_sent"],
+        "resent": f"{summary['retransmit_rate']:.1%}",
+        "crc_fail": file_transfer._integrity_stats["crc_failures"] - crc_failures,
+        "intact": intact,
+    }
+
+
+def run_concurrent(path: str, chunk_sizes: list, rate: float) -> list:
+    filesize = os.path.getsize(path)
+    get_scheduler().rate = rate
+
+    rx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for sock in (rx_sock, tx_sock):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        sock.bind(("127.0.0.1", 0))
+    rx_id = f"rx@127.0.0.1:{rx_sock.getsockname()[1]}"
+    tx_id = f"tx@127.0.0.1:{tx_sock.getsockname()[1]}"
+    add_peer(rx_id, "127.0.0.1", rx_sock.getsockname()[1])
+    add_peer(tx_id, "127.0.0.1", tx_sock.getsockname()[1])
+    tx_info = {"user_id": tx_id}
+
+    out_dir = tempfile.mkdtemp()
+    finished = {}  # fileid -> seconds
+    all_done = threading.Event()
+    fileids = []
+    for chunk_size in chunk_sizes:
+        fileid = f"c{chunk_size:07x}"
+        fileids.append(fileid)
+        config.incoming_files[fileid] = {
+            "from": tx_id,
+            "filename": os.path.join(out_dir, f"{fileid}.bin"),
+            "filesize": filesize,
+            "chunk_size": chunk_size,
+            "accepted": True,
+        }
+        config.active_file_transfers[fileid] = {
+            "filepath": path,
+            "recipient": rx_id,
+            "chunk_size": chunk_size,
+            "total_chunks": math.ceil(filesize / chunk_size),
+            "filesize": filesize,
+            "sender_info": tx_info,
+        }
+
+    def receiver(content, addr):
+        if content.get("TYPE") == "FILE_CHUNK":
+            file_transfer.handle_file_chunk(content, addr, {"user_id": rx_id})
+
+    def sender(content, addr):
+        if content.get("TYPE") == "FILE_ACK":
+            handle_file_ack(content, addr, tx_info)
+        elif content.get("TYPE") == "FILE_RECEIVED":
+            fileid = content["FILEID"]
+            stop_transfer(fileid, content.get("STATUS", "COMPLETE"))
+            finished.setdefault(fileid, time.perf_counter() - start)
+            if len(finished) == len(fileids):
+                all_done.set()
+
+    threading.Thread(target=_listen, args=(rx_sock, receiver), daemon=True).start()
+    threading.Thread(target=_listen, args=(tx_sock, sender), daemon=True).start()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for fileid in fileids:
+            start_transfer(fileid)
+        all_done.wait(600)
+    rx_sock.close()
+    tx_sock.close()
+
+    results = []
+    for chunk_size, fileid in zip(chunk_sizes, fileids):
+        out_path = config.incoming_files.get(fileid, {}).get("filename") or os.path.join(
+            out_dir, f"{fileid}.bin"
+        )
+        seconds = finished.get(fileid)
+        transfer = config.active_file_transfers.pop(fileid, {})
+        results.append(
+            {
+                "chunk": chunk_size,
+                "state": transfer["window"].state if "window" in transfer else "-",
+                "seconds": round(seconds, 2) if seconds else "-",
+                "MB/s": round(filesize / seconds / 2**20, 2) if seconds else 0,
+                "intact": os.path.exists(out_path)
+                and filecmp.cmp(path, out_path, shallow=False),
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="File transfer chunk size benchmark")
+    parser.add_argument("--size-mb", type=float, default=4)
+    parser.add_argument("--loss", type=float, nargs="+", default=[0, 0.005, 0.02])
+    parser.add_argument("--corrupt", type=float, default=0, help="fraction of chunks damaged")
+    parser.add_argument(
+        "--chunks",
+        type=int,
+        nargs="+",
+        default=[
+            config.FILE_LEGACY_CHUNK_SIZE,
+            chunk_size_for(PATH_MTU_PAYLOAD, CHUNK_HEADER),
+            8 * 1024,
+            32 * 1024,
+            config.FILE_CHUNK_MAX,
+        ],
+    )
+    parser.add_argument("--concurrent", action="store_true")
+    parser.add_argument("--rate-kbps", type=float, default=0)
+    args = parser.parse_args()
+    config.FILE_CHECKPOINT_DIR = tempfile.mkdtemp()
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        remaining = int(args.size_mb * 2**20)
+        while remaining:
+            block = min(remaining, 2**20)
+            f.write(os.urandom(block))
+            remaining -= block
+        path = f.name
+
+    if args.concurrent:
+        columns = ["chunk", "state", "seconds", "MB/s", "intact"]
+        print("  ".join(f"{c:>9}" for c in columns))
+        try:
+            for result in run_concurrent(path, args.chunks, args.rate_kbps * 1024):
+                print("  ".join(f"{str(result[c]):>9}" for c in columns))
+        finally:
+            os.unlink(path)
+        return
+
+    columns = [
+        "chunk", "loss", "state", "seconds", "MB/s", "datagrams", "resent", "crc_fail", "intact"
+    ]
+    print("  ".join(f"{c:>9}" for c in columns))
+    try:
+        for loss in args.loss:
+            for chunk_size in args.chunks:
+                result = run(path, chunk_size, loss, args.corrupt)
+                print("  ".join(f"{str(result[c]):>9}" for c in columns))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
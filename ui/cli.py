@@ -1,6 +1,4 @@
 # ui/cli.py
-from rich.console import Console
-from rich.table import Table
 from network import my_info
 from network.message_sender import (
     send_post,
@@ -10,8 +8,12 @@ from network.message_sender import (
     send_like,
     send_file_offer,
 )
-from network.broadcast import send_profile
+from network.broadcast import send_profile, invalidate_profile_cache
 from network.peer_registry import get_peer_list, get_peer
+from network.metrics import collect_metrics
+from network.liveness import get_peer_state
+from network.rtt import format_rtt
+from network.file_transfer import accept_incoming, get_transfer_status, reject_incoming
 from network.tictactoe import send_invite, send_move
 from ui.utils import print_info, print_error, print_prompt, print_success, print_verbose
 import config
@@ -27,13 +29,25 @@ from network.group_manager import (
     get_group_members,
     send_group_message,
 )
+from network.group_transfer import get_group_upload_status, send_group_file
 
-console = Console()
+# rich is imported on first table output, not at startup
+_console = None
 
 
-# ui/cli.py
+def _get_console():
+    global _console
+    if _console is None:
+        from rich.console import Console
+
+        _console = Console()
+    return _console
+
 
-console = Console()
+def _new_table(title: str):
+    from rich.table import Table
+
+    return Table(title=title)
 
 
 def cmd_whoami(_args):
@@ -52,7 +66,7 @@ def cmd_peers(_args):
         print_info("No peers known yet.")
         return True
 
-    table = Table(title="Known Peers")
+    table = _new_table("Known Peers")
     table.add_column("User ID", style="cyan")
     table.add_column("Display Name", style="magenta")
     table.add_column("Address", style="green")
@@ -66,7 +80,7 @@ def cmd_peers(_args):
             f"{peer['ip']}:{peer['port']}",
             last_seen,
         )
-    console.print(table)
+    _get_console().print(table)
     return True
 
 
@@ -437,14 +451,14 @@ def cmd_groups(args):
             print_info("You are not in any groups")
             return True
 
-        table = Table(title="Your Groups")
+        table = _new_table("Your Groups")
         table.add_column("ID", style="cyan")
         table.add_column("Name", style="magenta")
         table.add_column("Members", style="green")
 
         for group in groups:
             table.add_row(group["id"], group["name"], str(group["members"]))
-        console.print(table)
+        _get_console().print(table)
     elif args[0] == "members" and len(args) == 2:
         # Show members of a specific group
         group_id = args[1]
@@ -603,11 +617,13 @@ def cmd_peers(_args):
         print_info("No peers known yet.")
         return True
 
-    table = Table(title="Known Peers")
+    table = _new_table("Known Peers")
     table.add_column("User ID", style="cyan")
     table.add_column("Display Name", style="magenta")
     table.add_column("Address", style="green")
     table.add_column("Last Seen", style="yellow")
+    table.add_column("State", style="blue")
+    table.add_column("RTT p50/p90/p99 ms", style="white")
 
     for peer in peers:
         last_seen = time.strftime("%H:%M:%S", time.localtime(peer["last_seen"]))
@@ -616,8 +632,31 @@ def cmd_peers(_args):
             peer["display_name"],
             f"{peer['ip']}:{peer['port']}",
             last_seen,
+            get_peer_state(peer["user_id"]),
+            format_rtt(peer["user_id"]),
         )
-    console.print(table)
+    _get_console().print(table)
+    return True
+
+
+def cmd_stats(_args):
+    """Show counters and timings reported by the network subsystems"""
+    metrics = collect_metrics()
+    if not metrics:
+        print_info("No metrics yet.")
+        return True
+
+    table = _new_table("Network Stats")
+    table.add_column("Subsystem", style="cyan")
+    table.add_column("Metric", style="magenta")
+    table.add_column("Value", style="green")
+
+    for source, values in metrics.items():
+        for name, value in values.items():
+            if isinstance(value, float):
+                value = f"{value:.3f}"
+            table.add_row(source, name, str(value))
+    _get_console().print(table)
     return True
 
 
@@ -713,6 +752,9 @@ def cmd_help(_args):
         "file send <user> <path> [desc]    - Send a file to user",
         "file accept <fileid>              - Accept incoming file transfer",
         "file reject <fileid>              - Reject incoming file transfer",
+        "file status                       - Progress, rate and ETA of file transfers",
+        "stats                             - Show network counters and timings",
+        "group_file <id> <path> [desc]     - Send a file to every member of a group at once",
     ]
     for cmd in commands:
         if cmd:
@@ -869,6 +911,9 @@ def cmd_set_avatar(args):
         with open(avatar_path, "rb") as f:
             my_info["avatar_data"] = base64.b64encode(f.read()).decode("utf-8")
             my_info["avatar_type"] = get_mime_type(avatar_path)
+        # Keep the path so later edits to the file are picked up by PROFILE
+        my_info["avatar_path"] = avatar_path
+        invalidate_profile_cache()
         print_success(
             f"Avatar set from { avatar_path}. Send 'hello' to update your profile."
         )
@@ -902,12 +947,57 @@ def cmd_show_avatar(args):
     return True
 
 
+def _format_eta(seconds) -> str:
+    if seconds is None:
+        return "-"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def cmd_file_status():
+    """Live progress of every upload and download"""
+    rows = get_transfer_status() + get_group_upload_status()
+    if not rows:
+        print_info("No file transfers in progress.")
+        return True
+
+    table = _new_table("File Transfers")
+    table.add_column("", style="blue")
+    table.add_column("File ID", style="cyan")
+    table.add_column("Peer", style="magenta")
+    table.add_column("File", style="white")
+    table.add_column("State", style="blue")
+    table.add_column("Progress", style="green")
+    table.add_column("Rate KB/s", style="yellow")
+    table.add_column("ETA", style="yellow")
+
+    for row in rows:
+        percent = row["done"] / row["total"] if row["total"] else 1.0
+        table.add_row(
+            "↑" if row["direction"] == "up" else "↓",
+            row["fileid"],
+            row["peer"],
+            os.path.basename(row["filename"]),
+            row["state"],
+            f"{row['done'] / 2**20:.1f}/{row['total'] / 2**20:.1f} MB ({percent:.0%})",
+            f"{row['rate'] / 1024:.1f}",
+            _format_eta(row["eta"]),
+        )
+    _get_console().print(table)
+    return True
+
+
 def cmd_file(args):
     """Handle file transfer commands"""
+    if args and args[0] == "status":
+        return cmd_file_status()
+
     if len(args) < 2:
         print_error("Usage: file send <recipient> <filepath> [description]")
         print_error("       file accept <fileid>")
         print_error("       file reject <fileid>")
+        print_error("       file status")
         return True
 
     subcmd = args[0]
@@ -928,17 +1018,19 @@ def cmd_file(args):
 
     elif subcmd == "accept":
         fileid = args[1]
-        if fileid in config.incoming_files:
+        if accept_incoming(fileid, my_info):
             print_success(f"Accepting file {fileid}")
-            # The actual transfer happens automatically when chunks arrive
+            if config.pending_file_offer and config.pending_file_offer["fileid"] == fileid:
+                config.pending_file_offer = None
         else:
             print_error(f"No pending file with ID {fileid}")
 
     elif subcmd == "reject":
         fileid = args[1]
-        if fileid in config.incoming_files:
+        if reject_incoming(fileid, my_info):
             print_success(f"Rejected file {fileid}")
-            del config.incoming_files[fileid]
+            if config.pending_file_offer and config.pending_file_offer["fileid"] == fileid:
+                config.pending_file_offer = None
         else:
             print_error(f"No pending file with ID {fileid}")
 
@@ -983,14 +1075,14 @@ def cmd_groups(args):
             print_info("You are not in any groups")
             return True
 
-        table = Table(title="Your Groups")
+        table = _new_table("Your Groups")
         table.add_column("ID", style="cyan")
         table.add_column("Name", style="magenta")
         table.add_column("Members", style="green")
 
         for group in groups:
             table.add_row(group["id"], group["name"], str(group["members"]))
-        console.print(table)
+        _get_console().print(table)
     elif args[0] == "members" and len(args) == 2:
         # Show members of a specific group
         group_id = args[1]
@@ -1084,6 +1176,21 @@ def cmd_reject_file(args):
     return True
 
 
+def cmd_group_file(args):
+    """Send one file to a whole group in a single broadcast stream"""
+    if len(args) < 2:
+        print_error("Usage: group_file <group_id> <filepath> [description]")
+        return True
+
+    group_id = args[0]
+    filepath = args[1]
+    description = " ".join(args[2:]) if len(args) > 2 else "No description"
+
+    if send_group_file(group_id, filepath, description, my_info):
+        print_success(f"File offer sent to group {group_id} for {filepath}")
+    return True
+
+
 def cmd_accept_file(args):
     """Handle 'y' command to accept file transfer"""
     if not config.pending_file_offer:
@@ -1091,8 +1198,10 @@ def cmd_accept_file(args):
         return True
 
     fileid = config.pending_file_offer["fileid"]
-    print_success(f"Accepting file {fileid}")
-    # The transfer will proceed automatically as chunks arrive
+    if accept_incoming(fileid, my_info):
+        print_success(f"Accepting file {fileid}")
+    else:
+        print_error(f"File offer {fileid} is no longer available")
     config.pending_file_offer = None
     return True
 
@@ -1105,8 +1214,7 @@ def cmd_reject_file(args):
 
     fileid = config.pending_file_offer["fileid"]
     print_success(f"Rejected file {fileid}")
-    if fileid in config.incoming_files:
-        del config.incoming_files[fileid]
+    reject_incoming(fileid, my_info)
     config.pending_file_offer = None
     return True
 
@@ -1115,11 +1223,13 @@ command_registry = {
     "exit": cmd_exit,
     "whoami": cmd_whoami,
     "peers": cmd_peers,
+    "stats": cmd_stats,
     "send": cmd_send,
     "groups": cmd_groups,
     "group_create": cmd_group_create,
     "group_update": cmd_group_update,
     "group_message": cmd_group_message,
+    "group_file": cmd_group_file,
     "help": cmd_help,
     "verbose": cmd_verbose,
     "ttt": cmd_ttt,
@@ -1,49 +1,121 @@
 import base64
+import hashlib
 import os
+import threading
 import config
+from collections import OrderedDict
+from functools import lru_cache
 from io import BytesIO
-from PIL import Image
-from termcolor import colored
 
+RENDER_CACHE_SIZE = 64  # rendered avatars kept in memory
+RENDER_WORKERS = 2
+
+# (avatar hash, width, terminal kind) -> escape sequence, or None if undecodable
+_render_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_pending = {}  # same key -> Future of a render already in progress
+_cache_lock = threading.Lock()
+_executor = None
+
+
+def _terminal_kind() -> str:
+    if "TERM" in os.environ and "kitty" in os.environ["TERM"].lower():
+        return "kitty"
+    elif "ITERM_PROFILE" in os.environ:
+        return "iterm"
+    return "text"
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        _executor = ThreadPoolExecutor(
+            max_workers=RENDER_WORKERS, thread_name_prefix="avatar"
+        )
+    return _executor
+
+
+def _render(data: str, kind: str, width: int):
+    """Decode the avatar and build the terminal escape sequence for it"""
+    img_data = base64.b64decode(data)
+
+    if kind == "kitty":
+        from PIL import Image
 
-def display_image(data: str, display_name: str, width: int = 30) -> bool:
-    """
-    Displays an image in terminal using various methods
-    Returns True if successful, False if fell back to text
-    """
-    try:
-        img_data = base64.b64decode(data)
         img = Image.open(BytesIO(img_data))
+        img.thumbnail((width * 10, width * 10))
+        with BytesIO() as output:
+            img.save(output, format="PNG")
+            return f"\033_Ga=T,f=100,t=d;{base64.standard_b64encode(output.getvalue()).decode()}\033\\"
 
-        # Try Kitty terminal first
-        if "TERM" in os.environ and "kitty" in os.environ["TERM"].lower():
-            from base64 import standard_b64encode
+    return f"\033]1337;File=inline=1;width={width}px;preserveAspectRatio=1:{base64.standard_b64encode(img_data).decode()}\a"
 
-            img.thumbnail((width * 10, width * 10))
-            with BytesIO() as output:
-                img.save(output, format="PNG")
-                print(
-                    f"\033_Ga=T,f=100,t=d;{standard_b64encode(output.getvalue()).decode()}\033\\"
-                )
-            return True
 
-        # Try iTerm2
-        elif "ITERM_PROFILE" in os.environ:
-            from base64 import standard_b64encode
+def _render_and_store(key: tuple, data: str, kind: str, width: int):
+    try:
+        output = _render(data, kind, width)
+    except Exception as e:
+        if config.verbose_mode:
+            print(f"Failed to display image: {e}")
+        output = None  # remember bad avatars too, so they aren't decoded again
+
+    with _cache_lock:
+        _render_cache[key] = output
+        while len(_render_cache) > RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+        _pending.pop(key, None)
+    return output
+
+
+def _print_output(future):
+    output = future.result()
+    if output:
+        print(output)
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _figlet_banner(text: str) -> str:
+    from pyfiglet import Figlet
+    from termcolor import colored
+
+    return colored(Figlet(font="small").renderText(text), "cyan")
 
-            print(
-                f"\033]1337;File=inline=1;width={width}px;preserveAspectRatio=1:{standard_b64encode(img_data).decode()}\a"
-            )
-            return True
 
-        # Fallback to ASCII art
-        else:
-            from pyfiglet import Figlet
+def display_image(data: str, display_name: str, width: int = 30) -> bool:
+    """
+    Displays an image in terminal using various methods
+    Returns True if the terminal can show it, False if fell back to text.
+    Decoding runs on a worker thread and the result is memoized, so the
+    image may be printed shortly after this returns.
+    """
+    try:
+        kind = _terminal_kind()
 
-            f = Figlet(font="small")
-            print(colored(f.renderText(display_name[:3]), "cyan"))
+        # Fallback to ASCII art, no need to decode the avatar at all
+        if kind == "text":
+            print(_figlet_banner(display_name[:3]))
             return False
 
+        avatar_hash = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        key = (avatar_hash, width, kind)
+        with _cache_lock:
+            if key in _render_cache:
+                _render_cache.move_to_end(key)
+                output = _render_cache[key]
+                if output:
+                    print(output)
+                return output is not None
+
+            future = _pending.get(key)
+            if future is None:
+                future = _get_executor().submit(
+                    _render_and_store, key, data, kind, width
+                )
+                _pending[key] = future
+        future.add_done_callback(_print_output)
+        return True
+
     except Exception as e:
         if config.verbose_mode:
             print(f"Failed to display image: {e}")
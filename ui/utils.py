@@ -1,27 +1,38 @@
 # ui/utils.py
-from colorama import init, Fore
-from rich import print as rprint
 import config
 
-init(autoreset=True)
+# colorama/rich are only imported the first time something is printed
+_fore = None
+
+
+def _colors():
+    global _fore
+    if _fore is None:
+        from colorama import init, Fore
+
+        init(autoreset=True)
+        _fore = Fore
+    return _fore
 
 
 def print_success(msg: str):
-    print(Fore.GREEN + msg)
+    print(_colors().GREEN + msg)
 
 
 def print_error(msg: str):
-    print(Fore.RED + "Error: " + msg)
+    print(_colors().RED + "Error: " + msg)
 
 
 def print_info(msg: str):
-    print(Fore.CYAN + msg)
+    print(_colors().CYAN + msg)
 
 
 def print_prompt():
+    from rich import print as rprint
+
     rprint("[yellow]>> [/yellow]", end="", flush=True)
 
 
 def print_verbose(message: str):
     if getattr(config, "verbose_mode", False):
-        print(Fore.CYAN + str(message))
+        print(_colors().CYAN + str(message))